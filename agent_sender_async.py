@@ -5,19 +5,40 @@ Async System Monitor (Multi-rate MQTT sender)
 CPU/MEM/NET 每秒、DISK 每 3 秒、TEMP 每 10 秒
 - 加入 cpu.loadavg、system.uptime_sec
 - 加入 mqtt_stats：publish_ok/err、last_rc、is_connected、reconnects
+- 可選 OpenMetrics 拉取端點（METRICS_PORT），每個 tick 渲染一次並快取
+- 加入 processes：增量掃描 /proc/<pid>/stat 的 top-N（CPU / RSS / I/O）
+- 加入 cgroups：cgroup v2 各容器 / slice 的 CPU、記憶體、I/O、memory pressure
+- 加入 filesystems：各掛載點容量 / inode（statvfs），掛載表改變時才重建清單
+- NET_RULES / DISK_RULES：介面與裝置的 include / exclude / aggregate 規則，限制 payload 大小
+- 磁碟歸併改用 /sys/block 拓樸索引：分割區歸到實體磁碟，LVM / LUKS / md / multipath 另列邏輯卷
+- 可選 MQTT v5（MQTT_PROTOCOL=5）：topic alias、message expiry、content-type user property，不支援時退回 3.1.1
+- 多 broker（MQTT_BROKERS）：failover 保持熱備連線、fanout 同一份 payload 寫入多個 broker
+- MQTT_IO=asyncio：由 event loop 直接驅動 paho socket（不再有 loop_start 執行緒），連線狀態改為可 await 的事件
+- 有界送出佇列（MQTT_QUEUE_*）：drop-oldest / drop-newest / coalesce，佇列深度與丟棄數回報在 mqtt_stats
+- 非阻塞啟動：import 時不做網路 I/O，背景連線，第一筆樣本先排隊；較重的採集器在第一筆 publish 之後才啟動
+- 邊緣告警規則（ALERT_RULES）：門檻 / 持續時間 / 遲滯，只把狀態轉換發到 sys/agents/<host>/alerts
+- Collector 外掛 API：register_collector(key, fn, interval, blocking, budget_ms)，支援 entry point；超出 CPU 預算自動降頻
+- 每筆樣本帶 seq（行程內遞增）與 ts_ms（毫秒取樣時間），接收端據此分辨延遲、掉包與 agent 停頓
 """
 
 import asyncio
+import fnmatch
 import json
 import os
 import re
+import select
 import socket
+import threading
 import time
 import glob
+from array import array
+from collections import deque
 from typing import Any, Dict, Optional
 
 import psutil
 from paho.mqtt import client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -30,44 +51,421 @@ MQTT_PASS   = os.getenv("MQTT_PASS", "seven777")
 HOSTNAME    = socket.gethostname()
 TOPIC       = f"sys/agents/{HOSTNAME}/metrics"
 
+# 多 broker："host[:port],host[:port]"；未設定時即為 BROKER_HOST:BROKER_PORT
+#   failover：全部保持連線，只發給第一個已連線的（依列出順序）
+#   fanout  ：每個已連線的 broker 都發一份
+MQTT_BROKERS     = os.getenv("MQTT_BROKERS") or (f"[{BROKER_HOST}]:{BROKER_PORT}" if ":" in BROKER_HOST else f"{BROKER_HOST}:{BROKER_PORT}")
+MQTT_BROKER_MODE = os.getenv("MQTT_BROKER_MODE", "failover")
+
+# MQTT 網路 I/O：thread（paho loop_start 執行緒）或 asyncio（add_reader / add_writer 由 event loop 驅動）
+MQTT_IO              = os.getenv("MQTT_IO", "thread")
+MQTT_CONNECT_TIMEOUT = float(os.getenv("MQTT_CONNECT_TIMEOUT", "5"))
+
+# MQTT v5（opt-in）：預設仍為 3.1.1
+MQTT_PROTOCOL        = os.getenv("MQTT_PROTOCOL", "3.1.1")
+MQTT_MESSAGE_EXPIRY  = int(os.getenv("MQTT_MESSAGE_EXPIRY", "5"))   # 秒；過期的樣本由 broker 丟棄
+PAYLOAD_CONTENT_TYPE = "application/json"
+
+# 送出佇列上限：broker 變慢或半開連線時不讓 paho 的佇列無限成長（0 = 不限）
+#   drop-oldest：丟最舊的；drop-newest：丟新進來的；coalesce：同一 topic 只保留最新一份
+MQTT_QUEUE_MAX_MSGS  = int(os.getenv("MQTT_QUEUE_MAX_MSGS", "60"))
+MQTT_QUEUE_MAX_BYTES = int(os.getenv("MQTT_QUEUE_MAX_BYTES", str(1024 * 1024)))
+MQTT_QUEUE_POLICY    = os.getenv("MQTT_QUEUE_POLICY", "drop-oldest")
+
+# ===== OpenMetrics exporter CONFIG =====
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))        # 0 = 停用
+METRICS_BIND = os.getenv("METRICS_BIND", "127.0.0.1")
+
+# ===== Process collector CONFIG =====
+PROC_INTERVAL  = float(os.getenv("PROC_INTERVAL", "5"))     # 0 = 停用
+PROC_TOP_N     = int(os.getenv("PROC_TOP_N", "5"))
+PROC_BUDGET_MS = float(os.getenv("PROC_BUDGET_MS", "10"))   # 每個 slice 最多佔用的時間
+
+# ===== cgroup v2 collector CONFIG =====
+CGROUP_ROOT      = os.getenv("CGROUP_ROOT", "/sys/fs/cgroup")
+CGROUP_INTERVAL  = float(os.getenv("CGROUP_INTERVAL", "5"))   # 0 = 停用
+CGROUP_MAX_DEPTH = int(os.getenv("CGROUP_MAX_DEPTH", "4"))
+
+# ===== Filesystem collector CONFIG =====
+FS_INTERVAL  = float(os.getenv("FS_INTERVAL", "30"))       # 0 = 停用
+FS_MOUNTINFO = os.getenv("FS_MOUNTINFO", "/proc/self/mountinfo")
+
+# ===== Collector plugins CONFIG =====
+COLLECTOR_BUDGET_MS   = float(os.getenv("COLLECTOR_BUDGET_MS", "50"))  # 每次採集允許的 CPU 時間（預設值）
+COLLECTOR_MAX_DEMOTE  = int(os.getenv("COLLECTOR_MAX_DEMOTE", "16"))   # 降頻上限：基本間隔的倍數
+COLLECTOR_PLUGINS     = os.getenv("COLLECTOR_PLUGINS", "")             # 額外載入的模組，以 , 分隔
+COLLECTOR_ENTRY_POINT = "hwmonitor_mqtt.collectors"                    # 第三方套件的 entry point group
+
+# ===== Alert rules CONFIG =====
+# 格式："名稱: 路徑 運算子 門檻 [for 秒數s] [clear 解除值]"，以 ; 分隔；路徑中的 * 展開 dict 的鍵或 list 的元素
+#   例：ALERT_RULES="disk_busy: disk_io.*.stats.util_percent > 95 for 60s clear 80"
+# 只有狀態轉換（firing / resolved）會發佈到 ALERT_TOPIC；ALERT_RULES=none 停用
+DEFAULT_ALERT_RULES = (
+    "cpu_high: cpu.percent_total >= 90 for 30s clear 75;"
+    "ram_high: memory.ram.percent >= 90 for 30s clear 75;"
+    "temp_high: temperatures.*.*.current >= 80 for 10s clear 70;"
+    "fs_full: filesystems.*.percent >= 90 for 60s clear 85"
+)
+ALERT_RULES = os.getenv("ALERT_RULES") or DEFAULT_ALERT_RULES
+ALERTS_ENABLED = ALERT_RULES.strip().lower() not in ("none", "off")
+ALERT_TOPIC = f"sys/agents/{HOSTNAME}/alerts"
+ALERT_QUEUE_MAX = int(os.getenv("ALERT_QUEUE_MAX", "256"))   # 斷線期間保留的告警轉換數
+
+# ===== Device selection rules =====
+# 格式："動作:glob[,glob...][=彙總名稱]"，以 ; 分隔，由上而下第一條符合者生效；都不符合則保留
+#   例：NET_RULES="exclude:lo;aggregate:veth*,cali*=containers;aggregate:br-*,docker0=bridges"
+NET_RULES  = os.getenv("NET_RULES", "")
+DISK_RULES = os.getenv("DISK_RULES", "exclude:loop*")
+
 # ===== MQTT Client =====
-mqtt_client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"agent-{HOSTNAME}")
-mqtt_client.username_pw_set(MQTT_USER, MQTT_PASS)
-mqtt_client.loop_start()
-
-mqtt_stats = {
-    "publish_ok": 0,
-    "publish_err": 0,
-    "last_publish_rc": None,
-    "reconnects": 0,
-    "is_connected": False,
-    "last_error": None,
-}
+mqtt_protocol = mqtt.MQTTv5 if MQTT_PROTOCOL.lower().lstrip("v") in ("5", "5.0") else mqtt.MQTTv311
 
-def on_connect(client, userdata, connect_flags, reason_code, properties=None):
-    mqtt_stats["is_connected"] = (reason_code == 0)
-    if reason_code == 0:
-        print(f"✅ MQTT connected to {BROKER_HOST}:{BROKER_PORT}")
-        mqtt_stats["last_error"] = None
-    else:
-        print(f"❌ MQTT connect failed: reason_code={reason_code}")
-        mqtt_stats["last_error"] = f"Connect failed: {reason_code}"
-mqtt_client.on_connect = on_connect
+class BrokerLink:
+    """
+    單一 broker 的連線：各自的 client、統計、v5 topic alias 與退避狀態。
+    MQTT_IO=asyncio 時 socket 由 event loop 的 add_reader / add_writer 驅動，所有 callback 都在同一執行緒；
+    thread 模式則沿用 paho 的 loop_start()。兩種模式的連線狀態變化都會觸發 state_changed 事件。
+    """
 
-def on_disconnect(client, userdata, disconnect_flags, reason_code, properties=None):
-    mqtt_stats["is_connected"] = False
-    print(f"⚠️ MQTT disconnected: reason_code={reason_code}")
-    mqtt_stats["last_error"] = f"Disconnected: {reason_code}"
-mqtt_client.on_disconnect = on_disconnect
+    def __init__(self, host: str, port: int, protocol: int, will: bool = True, index: int = 0):
+        self.host, self.port = host, port
+        # 同一叢集 / bridge 的 broker 會把相同 client id 視為接管連線；第一條維持原 id，其餘加上序號
+        self.client_id = f"agent-{HOSTNAME}" if index == 0 else f"agent-{HOSTNAME}-{index}"
+        self.name = f"[{host}]:{port}" if ":" in host else f"{host}:{port}"
+        self.protocol = protocol
+        self.will = will                    # 是否登記 agent_offline last will
+        self.stats = {
+            "publish_ok": 0,
+            "publish_err": 0,
+            "last_publish_rc": None,
+            "reconnects": 0,
+            "is_connected": False,
+            "last_error": None,
+            "protocol": "5" if protocol == mqtt.MQTTv5 else "3.1.1",
+            "queue_depth": 0,
+            "queue_bytes": 0,
+            "dropped": 0,
+        }
+        # 有界送出佇列：paho 一次只持有一則尚未寫出的訊息，其餘留在這裡依 MQTT_QUEUE_POLICY 丟棄 / 合併
+        self.outq: deque = deque()          # (topic, payload)
+        self.qbytes = 0
+        # 告警另外排隊：不受 MQTT_QUEUE_POLICY 擠掉、斷線也不清空，連上後優先送出
+        self.alertq: deque = deque(maxlen=ALERT_QUEUE_MAX)
+        self._inflight: Optional[mqtt.MQTTMessageInfo] = None
+        self._written_mid = -1              # on_publish 先於 is_published() 觸發，另外記下已寫出的 mid
+        self._last_len = 0                  # 上一份 payload 的大小，用來預估下一份是否還放得下
+        self._qlock = threading.Lock()
+        self.connecting = False             # 連線中：第一筆樣本先排隊，CONNACK 後立即送出
+        self.announce_online = False        # 連上（或成為 active）後由 publish loop 重送告警狀態
+        # v5 topic alias：每條連線各自編號，重新連線即失效
+        self.topic_alias_max = 0
+        self.topic_aliases: Dict[str, int] = {}
+        self.v5_fallback = False
+        self.state_changed = asyncio.Event()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._misc_task: Optional[asyncio.Task] = None
+        # 只建立 client 物件；網路執行緒與連線都延後到 mqtt_reconnector
+        self.client = self._create_client()
 
-def mqtt_connect():
-    try:
-        mqtt_client.connect(BROKER_HOST, BROKER_PORT, keepalive=30)
-    except Exception as e:
-        mqtt_stats["last_error"] = str(e)
-        print(f"⚠️ MQTT connect failed: {e}")
+    def _create_client(self) -> mqtt.Client:
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=self.client_id, protocol=self.protocol)
+        client.username_pw_set(MQTT_USER, MQTT_PASS)
+        client.on_connect = self.on_connect
+        client.on_disconnect = self.on_disconnect
+        client.on_publish = self.on_publish
+        if ALERTS_ENABLED and self.will:
+            # broker 偵測到 agent 失聯時代為發出 agent_offline（取代 viewer 端的 15 秒 staleness 判斷）
+            client.will_set(ALERT_TOPIC, json.dumps({
+                "host": HOSTNAME, "rule": "agent_offline", "instance": "", "state": "firing",
+            }, separators=(",", ":")))
+        if MQTT_IO == "asyncio":
+            client.on_socket_open = self._on_socket_open
+            client.on_socket_close = self._on_socket_close
+            client.on_socket_register_write = self._on_socket_register_write
+            client.on_socket_unregister_write = self._on_socket_unregister_write
+        return client
+
+    def attach(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self.state_changed.set()
+
+    def _signal(self):
+        # 可能在 paho 執行緒或 executor 中被呼叫，一律經由 call_soon_threadsafe 回到 event loop
+        if self._loop is not None and not self._loop.is_closed():  # 結束時 close() 觸發的 on_disconnect
+            self._loop.call_soon_threadsafe(self.state_changed.set)
+
+    # --- asyncio socket 整合（paho 的 external event loop API）---
+    # paho 在 on_socket_close 之後立即關閉 socket，所以在 loop 執行緒內必須同步登記 / 取消；
+    # 只有 executor 中的 connect() 觸發時才改走 call_soon_threadsafe。
+    def _in_loop(self, fn, *args):
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            fn(*args)
+        else:
+            self._loop.call_soon_threadsafe(fn, *args)
+
+    def _socket_op(self, op, *args):
+        try:
+            op(*args)
+        except (OSError, ValueError):
+            pass  # socket 已被關閉
+
+    def _watch_socket(self, sock):
+        self._socket_op(self._loop.add_reader, sock, self.client.loop_read)
+        if self._misc_task is None or self._misc_task.done():
+            self._misc_task = self._loop.create_task(self._misc_loop())
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._in_loop(self._watch_socket, sock)
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._in_loop(self._socket_op, self._loop.remove_reader, sock)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._in_loop(self._socket_op, self._loop.add_writer, sock, self.client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._in_loop(self._socket_op, self._loop.remove_writer, sock)
+
+    async def _misc_loop(self):
+        # keepalive / 逾時檢查；斷線後 loop_misc 回傳非 SUCCESS 即結束
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
+
+    def on_connect(self, client, userdata, connect_flags, reason_code, properties=None):
+        self.stats["is_connected"] = (reason_code == 0)
+        if reason_code == 0:
+            print(f"✅ MQTT connected to {self.name}")
+            self.stats["last_error"] = None
+            self.topic_aliases = {}
+            self.topic_alias_max = getattr(properties, "TopicAliasMaximum", 0) if self.protocol == mqtt.MQTTv5 else 0
+            self.announce_online = True
+        else:
+            print(f"❌ MQTT connect to {self.name} failed: reason_code={reason_code}")
+            self.stats["last_error"] = f"Connect failed: {reason_code}"
+            if self.protocol == mqtt.MQTTv5 and reason_code == "Unsupported protocol version":
+                self.v5_fallback = True  # 交給 mqtt_reconnector 換成 3.1.1 client
+        self._signal()
+        if reason_code == 0:
+            if agent_stats["first_connect_ms"] is None:
+                agent_stats["first_connect_ms"] = since_start_ms()
+            self.pump()  # 連線期間排隊的樣本
 
-mqtt_connect()
+    def on_disconnect(self, client, userdata, disconnect_flags, reason_code, properties=None):
+        self.stats["is_connected"] = False
+        print(f"⚠️ MQTT {self.name} disconnected: reason_code={reason_code}")
+        self.stats["last_error"] = f"Disconnected: {reason_code}"
+        self.drop_queue()
+        self._signal()
+
+    def on_publish(self, client, userdata, mid, reason_code=None, properties=None):
+        self._written_mid = mid
+        self.pump()
+
+    def is_connected(self) -> bool:
+        return self.client.is_connected()
+
+    def connect(self):
+        try:
+            self.client.connect(self.host, self.port, keepalive=30)
+            if MQTT_IO != "asyncio":
+                self.client.loop_start()  # 已啟動時 paho 直接回傳 MQTT_ERR_INVAL
+        except Exception as e:
+            self.stats["last_error"] = str(e)
+            print(f"⚠️ MQTT connect to {self.name} failed: {e}")
+            self._signal()
+
+    async def connect_async(self):
+        # TCP connect 會阻塞到逾時，交給 executor；之後的讀寫都回到 event loop
+        await asyncio.get_running_loop().run_in_executor(None, self.connect)
+
+    def fallback_to_v311(self):
+        """broker 回覆不支援 v5 時，換一個 3.1.1 client 重新連線。"""
+        print(f"↩️ {self.name} 不支援 MQTT v5，改用 3.1.1")
+        old = self.client
+        old.loop_stop()
+        try:
+            old.disconnect()
+        except Exception:
+            pass
+        self.protocol = mqtt.MQTTv311
+        self.stats["protocol"] = "3.1.1"
+        self.v5_fallback = False
+        self.client = self._create_client()
+
+    def _send(self, topic: str, payload: bytes) -> mqtt.MQTTMessageInfo:
+        if self.protocol != mqtt.MQTTv5:
+            return self.client.publish(topic, payload, qos=0, retain=False)
+        props = Properties(PacketTypes.PUBLISH)
+        props.MessageExpiryInterval = MQTT_MESSAGE_EXPIRY
+        props.PayloadFormatIndicator = 1
+        props.UserProperty = ("content-type", PAYLOAD_CONTENT_TYPE)
+        aliases = self.topic_aliases
+        alias = aliases.get(topic)
+        if alias:
+            # 已登記的 alias：只送空 topic + alias 編號
+            props.TopicAlias = alias
+            return self.client.publish("", payload, qos=0, retain=False, properties=props)
+        if len(aliases) < self.topic_alias_max:
+            alias = len(aliases) + 1
+            props.TopicAlias = alias
+            info = self.client.publish(topic, payload, qos=0, retain=False, properties=props)
+            if info.rc == mqtt.MQTT_ERR_SUCCESS:
+                aliases[topic] = alias  # 完整 topic 已送達 broker 才算登記完成
+            return info
+        return self.client.publish(topic, payload, qos=0, retain=False, properties=props)
+
+    def publish(self, topic: str, payload: bytes):
+        if topic == ALERT_TOPIC:
+            with self._qlock:
+                self.alertq.append(payload)
+            self.pump()
+            return
+        if not self.is_connected() and not self.connecting:
+            # 未連線且沒有在連線中：不排隊，直接記一次失敗（與以往相同）
+            self.stats["publish_err"] += 1
+            self.stats["last_publish_rc"] = mqtt.MQTT_ERR_NO_CONN
+            return
+        with self._qlock:
+            self._enqueue(topic, payload)
+        self.pump()
+
+    def _enqueue(self, topic: str, payload: bytes):
+        q = self.outq
+        self._last_len = len(payload)
+        if MQTT_QUEUE_POLICY == "coalesce":
+            for i, (t, old) in enumerate(q):
+                if t == topic:
+                    del q[i]
+                    self.qbytes -= len(old)
+                    self.stats["dropped"] += 1
+                    break
+        while q and self._over_limit(len(payload)):
+            if MQTT_QUEUE_POLICY == "drop-newest":
+                self.stats["dropped"] += 1
+                return
+            _, old = q.popleft()
+            self.qbytes -= len(old)
+            self.stats["dropped"] += 1
+        q.append((topic, payload))
+        self.qbytes += len(payload)
+
+    def _over_limit(self, extra: int = 0) -> bool:
+        return ((MQTT_QUEUE_MAX_MSGS > 0 and len(self.outq) >= MQTT_QUEUE_MAX_MSGS)
+                or (MQTT_QUEUE_MAX_BYTES > 0 and self.qbytes + extra > MQTT_QUEUE_MAX_BYTES))
+
+    def saturated(self) -> bool:
+        """佇列已滿且 paho 還沒寫出上一則：新樣本只會被丟棄或擠掉舊的。"""
+        return not self._writable() and self._over_limit(self._last_len)
+
+    def _writable(self) -> bool:
+        info = self._inflight
+        return info is None or info.mid == self._written_mid or info.is_published()
+
+    def pump(self):
+        """
+        把佇列頭交給 paho，直到 paho 手上有一則尚未寫出的訊息為止。
+        thread 模式下 on_publish 在 paho 執行緒呼叫；拿不到鎖代表另一邊正在 pump，
+        釋放鎖後再檢查一次，避免兩邊都以為對方會處理而卡住。
+        """
+        while (self.alertq or self.outq) and self._writable() and self.is_connected():
+            if not self._qlock.acquire(blocking=False):
+                return
+            try:
+                while (self.alertq or self.outq) and self._writable() and self.is_connected():
+                    if self.alertq:
+                        topic, payload = ALERT_TOPIC, self.alertq.popleft()
+                    else:
+                        topic, payload = self.outq.popleft()
+                        self.qbytes -= len(payload)
+                    self._send_now(topic, payload)
+            finally:
+                self._qlock.release()
+        self.stats["queue_depth"] = len(self.outq)
+        self.stats["queue_bytes"] = self.qbytes
+
+    def _send_now(self, topic: str, payload: bytes):
+        try:
+            info = self._send(topic, payload)
+            self.stats["last_publish_rc"] = info.rc
+            if info.rc == mqtt.MQTT_ERR_SUCCESS:
+                self.stats["publish_ok"] += 1
+                self._inflight = info
+            else:
+                self.stats["publish_err"] += 1
+        except Exception as e:
+            self.stats["publish_err"] += 1
+            self.stats["last_error"] = str(e)
+
+    def drop_queue(self):
+        # 只清樣本；alertq 保留到重新連線
+        with self._qlock:
+            self.stats["dropped"] += len(self.outq)
+            self.outq.clear()
+            self.qbytes = 0
+            self._inflight = None
+        self.stats["queue_depth"] = 0
+        self.stats["queue_bytes"] = 0
+
+    def close(self):
+        if MQTT_IO != "asyncio":
+            self.client.loop_stop()
+        self.client.disconnect()
+
+def _parse_brokers(spec: str) -> list:
+    """host、host:port、[IPv6]:port 或不帶埠號的 IPv6 位址，以逗號分隔。"""
+    out = []
+    for item in filter(None, (x.strip() for x in spec.split(","))):
+        if item.startswith("["):
+            host, _, rest = item[1:].partition("]")
+            if rest and not rest.startswith(":"):
+                raise ValueError(f"invalid broker address: {item!r}")
+            port = rest[1:]
+        elif item.count(":") == 1:
+            host, _, port = item.partition(":")
+        else:
+            host, port = item, ""       # 主機名稱，或未加括號的 IPv6 位址
+        out.append((host, int(port) if port else BROKER_PORT))
+    return out
+
+# failover 的熱備連線斷線不代表 agent 離線，last will 只登記在首選 broker（它有連線時必為 active）；
+# fanout 時每個 broker 的訂閱者都只看得到自己那一份，所以每條連線都登記。
+mqtt_links = [BrokerLink(host, port, mqtt_protocol, will=(MQTT_BROKER_MODE == "fanout" or i == 0), index=i)
+              for i, (host, port) in enumerate(_parse_brokers(MQTT_BROKERS))]
+_active_link: Optional[BrokerLink] = None
+
+def active_link() -> BrokerLink:
+    """failover：依列出順序取第一個已連線的 broker；熱備已連線，切換不必等退避。"""
+    global _active_link
+    link = next((l for l in mqtt_links if l.is_connected()), mqtt_links[0])
+    if link is not _active_link:
+        if _active_link is not None:
+            print(f"🔀 MQTT failover: {_active_link.name} -> {link.name}")
+            link.announce_online = True     # 備援先前沒收到告警，切換後重送目前狀態
+        _active_link = link
+    return link
+
+def mqtt_stats_snapshot() -> Dict[str, Any]:
+    links = mqtt_links if MQTT_BROKER_MODE == "fanout" else [active_link()]
+    head = links[0].stats
+    return {
+        "publish_ok": sum(l.stats["publish_ok"] for l in mqtt_links),
+        "publish_err": sum(l.stats["publish_err"] for l in mqtt_links),
+        "last_publish_rc": head["last_publish_rc"],
+        "is_connected": any(l.stats["is_connected"] for l in links),
+        "reconnects": sum(l.stats["reconnects"] for l in mqtt_links),
+        "last_error": head["last_error"],
+        "protocol": head["protocol"],
+        "mode": MQTT_BROKER_MODE,
+        "queue_depth": sum(l.stats["queue_depth"] for l in links),
+        "queue_bytes": sum(l.stats["queue_bytes"] for l in links),
+        "dropped": sum(l.stats["dropped"] for l in mqtt_links),
+        "queue_policy": MQTT_QUEUE_POLICY,
+        "brokers": [dict(l.stats, broker=l.name, active=(l in links)) for l in mqtt_links],
+    }
 
 # ===== GLOBAL STATE =====
 metrics: Dict[str, Any] = {
@@ -77,16 +475,88 @@ metrics: Dict[str, Any] = {
     "temperatures": None,
     "network_io": None,
     "system": None,
+    "processes": None,
+    "cgroups": None,
+    "filesystems": None,
 }
 
+# agent 自身的啟動統計：時間都從行程建立起算（含直譯器與套件 import）
+def _process_age() -> float:
+    """
+    行程已存活的秒數。/proc/stat 的 btime 只有秒級精度，psutil 的 create_time() 會差到將近 1 秒，
+    因此改用 /proc/self/stat 的 starttime（開機後的 ticks）對照 CLOCK_BOOTTIME。
+    """
+    try:
+        with open("/proc/self/stat", "rb") as f:
+            fields = f.read().rsplit(b")", 1)[1].split()
+        return max(0.0, time.clock_gettime(time.CLOCK_BOOTTIME) - int(fields[19]) / os.sysconf("SC_CLK_TCK"))
+    except (OSError, IndexError, ValueError, AttributeError):
+        return 0.0
+
+_proc_age = _process_age()
+_START_MONO = time.monotonic() - _proc_age
+agent_stats: Dict[str, Any] = {
+    "pid": os.getpid(),
+    "started_at": int(time.time() - _proc_age),
+    "init_ms": None,           # 進入 main()
+    "first_publish_ms": None,  # 第一筆樣本交給 MQTT 佇列
+    "first_connect_ms": None,  # 第一次 CONNACK
+}
+# 第一筆 publish 之前不啟動較重的採集器（/proc、cgroup、sysfs 掃描），避免拖慢開機後第一筆資料
+first_published = asyncio.Event()
+
+# 每份樣本的序號：連被 drop-newest 直接丟掉的樣本也佔一號，接收端才看得到缺口
+publish_seq = 0
+
+def since_start_ms() -> float:
+    return round((time.monotonic() - _START_MONO) * 1000.0, 1)
+
 # ===== Helpers =====
 def normalize_device_name(name: str) -> str:
+    """/sys/block 不可讀時的後援：以名稱規則把分割區歸到所屬磁碟。"""
     if m := re.match(r"^(nvme\d+n\d+)(?:p\d+)?$", name): return m.group(1)
     if m := re.match(r"^(sd[a-z]+)\d*$", name): return m.group(1)
     if m := re.match(r"^(mmcblk\d+)(?:p\d+)?$", name): return m.group(1)
     if m := re.match(r"^(md\d+)(?:p\d+)?$", name): return m.group(1)
     return name
 
+_SELECT_CACHE_MAX = 4096
+
+def compile_select_rules(spec: str):
+    """
+    將規則字串編譯成查表函式 name -> 輸出名稱（None = 略過）。
+    規則只在啟動時編譯一次；每個名稱第一次出現時比對，之後直接查快取。
+    """
+    rules = []
+    for chunk in filter(None, (c.strip() for c in spec.split(";"))):
+        action, _, rest = chunk.partition(":")
+        pats, _, target = rest.partition("=")
+        globs = [g.strip() for g in pats.split(",") if g.strip()]
+        if action not in ("include", "exclude", "aggregate") or not globs or (action == "aggregate") != bool(target):
+            raise ValueError(f"invalid selection rule: {chunk!r}")
+        rx = re.compile("|".join(fnmatch.translate(g) for g in globs))
+        rules.append((rx.match, action, target.strip()))
+
+    cache: Dict[str, Optional[str]] = {}
+    def select(name: str) -> Optional[str]:
+        try:
+            return cache[name]
+        except KeyError:
+            pass
+        out: Optional[str] = name
+        for match, action, target in rules:
+            if match(name):
+                out = None if action == "exclude" else (target if action == "aggregate" else name)
+                break
+        if len(cache) >= _SELECT_CACHE_MAX:
+            cache.clear()  # 容器頻繁進出時避免快取無限成長
+        cache[name] = out
+        return out
+    return select
+
+net_select = compile_select_rules(NET_RULES)
+disk_select = compile_select_rules(DISK_RULES)
+
 # ===== CPU / MEM =====
 def get_cpu_block() -> Dict[str, Any]:
     freq = psutil.cpu_freq()
@@ -117,82 +587,628 @@ def get_system_block() -> Dict[str, Any]:
         "pid": os.getpid(),
     }
 
+# ===== Device counter state =====
+class CounterTable:
+    """
+    裝置計數器的前一次數值：名稱 -> 固定 slot，數值放在 array('Q') 中（每個 slot 佔 width 格）。
+    slot 在裝置存在期間不變，消失後釋放給新裝置重用；每個 tick 只寫數值，不產生 dict / namedtuple。
+    """
+    __slots__ = ("width", "index", "names", "prev", "stamp", "free", "delta", "tick", "seen", "changed")
+
+    def __init__(self, width: int):
+        self.width = width
+        self.index: Dict[bytes, int] = {}
+        self.names: list = []            # slot -> 名稱（str，只在新裝置出現時 decode 一次）
+        self.prev = array("Q")
+        self.stamp = array("L")          # slot 最後一次出現的 tick
+        self.free: list = []
+        self.delta = [0] * width         # 最近一次 advance() 的差值
+        self.tick = 0
+        self.seen = 0
+        self.changed = False
+
+    def begin(self):
+        self.tick += 1
+        self.seen = 0
+        self.changed = False
+
+    def advance(self, key: bytes, values) -> int:
+        """寫入本次數值並把差值放進 delta（計數器歸零時為 0）；回傳 slot，新裝置只記基準並回傳 -1。"""
+        w, prev = self.width, self.prev
+        self.seen += 1
+        slot = self.index.get(key)
+        if slot is None:
+            if self.free:
+                slot = self.free.pop()
+                self.names[slot] = key.decode()
+                prev[slot * w:(slot + 1) * w] = array("Q", map(int, values))
+                self.stamp[slot] = self.tick
+            else:
+                slot = len(self.names)
+                self.names.append(key.decode())
+                prev.extend(map(int, values))
+                self.stamp.append(self.tick)
+            self.index[key] = slot
+            self.changed = True
+            return -1
+        self.stamp[slot] = self.tick
+        delta, base = self.delta, slot * w
+        for i in range(w):
+            v = int(values[i])
+            d = v - prev[base + i]
+            delta[i] = d if d > 0 else 0
+            prev[base + i] = v
+        return slot
+
+    def end(self) -> bool:
+        """釋放本次沒出現的裝置；裝置集合有變動時回傳 True。"""
+        if self.seen != len(self.index):
+            for key, slot in list(self.index.items()):
+                if self.stamp[slot] != self.tick:
+                    del self.index[key]
+                    self.free.append(slot)
+            self.changed = True
+        return self.changed
+
 # ===== Disk I/O =====
-_prev_disk = psutil.disk_io_counters(perdisk=True)
+# 直接讀一次 /proc/diskstats：同一份資料同時得到位元組計數與 io_ticks / time_in_queue / await。
+# 欄位（name 之後）：reads rmerged rsect rtime writes wmerged wsect wtime in_flight io_ticks time_in_queue
+_SECTOR = 512
+
+# ===== Block device topology =====
+# 由 /sys/block 的 partition 目錄、slaves、holders 建立索引：
+#   實體磁碟      -> (自身名稱, None, 其上的邏輯卷)
+#   分割區        -> None（I/O 已含在所屬磁碟那一列）
+#   dm-* / md*    -> (dm 名稱或 md 名稱, (實體磁碟...), 種類)
+# 只有在 /proc/diskstats 的裝置清單改變時才重建，平常每列只是一次 dict 查詢。
+_SYS_BLOCK = "/sys/block"
+_blk_index: Dict[str, Optional[tuple]] = {}
+
+def _sysfs_str(path: str) -> Optional[str]:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def _listdir(path: str) -> list:
+    try:
+        return os.listdir(path)
+    except OSError:
+        return []
+
+def _dm_kind(disk: str) -> str:
+    uuid = _sysfs_str(f"{_SYS_BLOCK}/{disk}/dm/uuid") or ""
+    for prefix, kind in (("LVM-", "lvm"), ("CRYPT-", "crypt"), ("mpath-", "multipath")):
+        if uuid.startswith(prefix):
+            return kind
+    return "md" if disk.startswith("md") else "dm"
+
+def build_block_index() -> Dict[str, Optional[tuple]]:
+    disks = _listdir(_SYS_BLOCK)
+    if not disks:
+        return {}
+    part_of: Dict[str, str] = {}
+    for d in disks:
+        for e in _listdir(f"{_SYS_BLOCK}/{d}"):
+            if os.path.isfile(f"{_SYS_BLOCK}/{d}/{e}/partition"):
+                part_of[e] = d
+    slaves = {d: _listdir(f"{_SYS_BLOCK}/{d}/slaves") for d in disks}
+    names = {d: (_sysfs_str(f"{_SYS_BLOCK}/{d}/dm/name") or d) for d in disks if slaves[d]}
+
+    def physical(dev: str, depth: int = 0) -> set:
+        disk = part_of.get(dev, dev)
+        if not slaves.get(disk) or depth > 8:
+            return {disk}
+        return set().union(*(physical(s, depth + 1) for s in slaves[disk]))
+
+    def holders_dir(dev: str) -> str:
+        return f"{_SYS_BLOCK}/{part_of[dev]}/{dev}/holders" if dev in part_of else f"{_SYS_BLOCK}/{dev}/holders"
+
+    def volumes(dev: str, depth: int = 0) -> set:
+        out = set()
+        for h in _listdir(holders_dir(dev)):
+            if h in names and depth <= 8:
+                out.add(names[h])
+                out |= volumes(h, depth + 1)
+        return out
+
+    index: Dict[str, Optional[tuple]] = {}
+    for d in disks:
+        if slaves[d]:
+            index[d] = (names[d], tuple(sorted(physical(d))), _dm_kind(d))
+        else:
+            vols = volumes(d).union(*(volumes(p) for p, owner in part_of.items() if owner == d))
+            index[d] = (d, None, tuple(sorted(vols)))
+    for part in part_of:
+        index[part] = None
+    return index
+
+_disk_counters = CounterTable(11)   # 第一次呼叫只記錄基準，不在 import 時讀取
 def get_disk_io_block(elapsed: float) -> Dict[str, Any]:
-    global _prev_disk
-    curr = psutil.disk_io_counters(perdisk=True)
+    global _blk_index
+    table = _disk_counters
+    prev, delta = table.prev, table.delta
+    acc: Dict[str, list] = {}
+    topo: Dict[str, tuple] = {}
+    table.begin()
+    try:
+        f = open("/proc/diskstats", "rb")
+    except OSError:
+        return {}
+    with f:
+        for line in f:
+            parts = line.split()
+            if len(parts) < 14:
+                continue
+            slot = table.advance(parts[2], parts[3:14])
+            if slot < 0:
+                continue
+            dev = table.names[slot]
+            target = disk_select(dev)
+            if target is None:
+                continue
+            if target != dev:
+                parent = target
+            elif dev in _blk_index:
+                entry = _blk_index[dev]
+                if entry is None:
+                    continue  # 分割區：整顆磁碟那一列已包含
+                parent = entry[0]
+                topo[parent] = entry
+            else:
+                parent = normalize_device_name(dev)
+                # 整顆磁碟本身已包含其分割區，存在時只取整顆那一列，避免重複加總
+                if parent != dev and parent.encode() in table.index:
+                    continue
+            a = acc.get(parent)
+            if a is None:
+                a = acc[parent] = [0] * 11
+            for i in (0, 2, 3, 4, 6, 7, 10):
+                a[i] += delta[i]
+            a[8] += prev[slot * 11 + 8]   # in_flight 為瞬時值
+            if delta[9] > a[9]:
+                a[9] = delta[9]           # 多個分割區時 util 取最大
+    if table.end():
+        _blk_index = build_block_index()  # 裝置集合改變（含第一次）才重建拓樸，下一輪生效
+
     result: Dict[str, Any] = {}
-    for dev, io in curr.items():
-        if dev.startswith("loop") or dev.startswith("dm-"):
-            continue
-        parent = normalize_device_name(dev)
-        prev = _prev_disk.get(dev)
-        if not prev:
-            continue
-        rbps = (io.read_bytes - prev.read_bytes) / elapsed
-        wbps = (io.write_bytes - prev.write_bytes) / elapsed
-        riops = (io.read_count - prev.read_count) / elapsed
-        wiops = (io.write_count - prev.write_count) / elapsed
-        # 若多個分割區被歸到同一 parent，取加總（同秒內通常只有一筆）
-        if parent not in result:
-            result[parent] = {"rate": {"read_bytes_per_s": 0.0, "write_bytes_per_s": 0.0, "read_iops": 0.0, "write_iops": 0.0}}
-        result[parent]["rate"]["read_bytes_per_s"]  += rbps
-        result[parent]["rate"]["write_bytes_per_s"] += wbps
-        result[parent]["rate"]["read_iops"]         += riops
-        result[parent]["rate"]["write_iops"]        += wiops
-    # round
-    for v in result.values():
-        for k in v["rate"]:
-            v["rate"][k] = round(v["rate"][k], 3)
-    _prev_disk = curr
+    ms = elapsed * 1000.0
+    for parent, a in acc.items():
+        row = result[parent] = {
+            "rate": {
+                "read_bytes_per_s":  round(a[2] * _SECTOR / elapsed, 3),
+                "write_bytes_per_s": round(a[6] * _SECTOR / elapsed, 3),
+                "read_iops":         round(a[0] / elapsed, 3),
+                "write_iops":        round(a[4] / elapsed, 3),
+            },
+            "stats": {
+                "util_percent":    round(min(100.0, a[9] * 100.0 / ms), 3),
+                "read_await_ms":   round(a[3] / a[0], 3) if a[0] else 0.0,
+                "write_await_ms":  round(a[7] / a[4], 3) if a[4] else 0.0,
+                "avg_queue_depth": round(a[10] / ms, 3),
+                "in_flight":       a[8],
+            },
+        }
+        if entry := topo.get(parent):
+            if entry[1] is not None:
+                # 邏輯卷：I/O 已反映在實體磁碟上，加總時應略過
+                row["kind"], row["parents"] = entry[2], list(entry[1])
+            elif entry[2]:
+                row["volumes"] = list(entry[2])
     return result
 
 # ===== Network I/O (ALL NICs) =====
-_prev_net = psutil.net_io_counters(pernic=True)
+# 計數器直接讀 /proc/net/dev（不經 psutil 的 namedtuple）；非 Linux 時退回 psutil。
+# 介面 meta（isup / speed / mtu / duplex）變動很少：介面集合改變或每 NIC_META_REFRESH 秒才重讀一次，
+# 每個介面的 meta dict 在兩次重讀之間直接沿用。
+# 每張介面的輸出列在介面存在期間重複使用、就地更新數值（publish / 告警 / OpenMetrics 都是同步讀取，不保留參照）。
+NIC_META_REFRESH = 5.0
+_NIC_NO_META = {"isup": None, "speed_mbps": None, "mtu": None, "duplex": None}
+_net_counters = CounterTable(2)     # 第一次呼叫只記錄基準
+_nic_meta: Dict[str, dict] = {}
+_nic_meta_at = 0.0
+_nic_rows: Dict[str, tuple] = {}    # 介面 -> (row, rate, cumulative)
+
+def _iter_net_dev():
+    try:
+        f = open(f"{getattr(psutil, 'PROCFS_PATH', '/proc')}/net/dev", "rb")
+    except OSError:
+        for nic, io in psutil.net_io_counters(pernic=True).items():
+            yield nic.encode(), (io.bytes_recv, io.bytes_sent)
+        return
+    with f:
+        next(f, None)
+        next(f, None)  # 兩行標題
+        for line in f:
+            name, _, rest = line.partition(b":")
+            fields = rest.split()
+            if len(fields) >= 9:
+                yield name.strip(), (fields[0], fields[8])
+
+def _refresh_nic_meta():
+    global _nic_meta, _nic_meta_at
+    meta: Dict[str, dict] = {}
+    for nic, st in psutil.net_if_stats().items():
+        meta[nic] = {
+            "isup": st.isup,
+            "speed_mbps": st.speed if st.speed >= 0 else None,
+            "mtu": st.mtu if st.mtu >= 0 else None,
+            "duplex": st.duplex,
+        }
+    _nic_meta, _nic_meta_at = meta, time.monotonic()
+
 def get_net_io_block(elapsed: float) -> Dict[str, Any]:
-    global _prev_net
-    curr = psutil.net_io_counters(pernic=True)
-    stats = psutil.net_if_stats()
+    table = _net_counters
+    prev, delta = table.prev, table.delta
     per_nic: Dict[str, Any] = {}
-    total = {"rate": {"rx_bytes_per_s": 0.0, "tx_bytes_per_s": 0.0},
-             "cumulative": {"bytes_recv": 0, "bytes_sent": 0}}
+    aggregated: Dict[str, list] = {}    # 彙總名稱 -> [rx B/s, tx B/s, bytes_recv, bytes_sent, members]
+    rx_total = tx_total = 0.0
+    recv_total = sent_total = 0
+
+    table.begin()
+    for key, values in _iter_net_dev():
+        slot = table.advance(key, values)
+        if slot < 0:
+            continue
+        nic = table.names[slot]
+        target = net_select(nic)
+        if target is None:
+            continue
+        rx_bps = delta[0] / elapsed
+        tx_bps = delta[1] / elapsed
+        recv, sent = prev[2 * slot], prev[2 * slot + 1]
+        rx_total += rx_bps
+        tx_total += tx_bps
+        recv_total += recv
+        sent_total += sent
+
+        if target != nic:
+            # 彙總列：多張介面加總成一列，不帶 meta；先佔住第一個成員的位置，迴圈結束再填入
+            a = aggregated.get(target)
+            if a is None:
+                a = aggregated[target] = [0.0, 0.0, 0, 0, 0]
+                per_nic[target] = None
+            a[0] += rx_bps
+            a[1] += tx_bps
+            a[2] += recv
+            a[3] += sent
+            a[4] += 1
+            continue
+
+        cached = _nic_rows.get(nic)
+        if cached is None:
+            rate, cum = {}, {}
+            cached = _nic_rows[nic] = ({"rate": rate, "cumulative": cum, "meta": _NIC_NO_META}, rate, cum)
+        row, rate, cum = cached
+        rate["rx_bytes_per_s"] = round(rx_bps, 3)
+        rate["tx_bytes_per_s"] = round(tx_bps, 3)
+        cum["bytes_recv"] = recv
+        cum["bytes_sent"] = sent
+        row["meta"] = _nic_meta.get(nic, _NIC_NO_META)
+        per_nic[nic] = row
+    if table.end():
+        for nic in [n for n in _nic_rows if n not in per_nic]:
+            del _nic_rows[nic]
+        _refresh_nic_meta()
+    elif time.monotonic() - _nic_meta_at >= NIC_META_REFRESH:
+        _refresh_nic_meta()
+
+    for target, a in aggregated.items():
+        per_nic[target] = {"rate": {"rx_bytes_per_s": round(a[0], 3), "tx_bytes_per_s": round(a[1], 3)},
+                           "cumulative": {"bytes_recv": a[2], "bytes_sent": a[3]},
+                           "members": a[4]}
+    total = {"rate": {"rx_bytes_per_s": round(rx_total, 3), "tx_bytes_per_s": round(tx_total, 3)},
+             "cumulative": {"bytes_recv": recv_total, "bytes_sent": sent_total}}
+    return {"per_nic": per_nic, "total": total}
+
+# ===== Processes (incremental /proc scan) =====
+# 每個 PID 佔一個 slot；前次計數器放在 array 裡，PID 結束後 slot 回收再利用。
+_CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+_proc_slot: Dict[int, int] = {}     # pid -> slot
+_proc_free: list = []               # 可回收的 slot
+_proc_start = array("Q")            # starttime（偵測 PID 重用）
+_proc_cpu   = array("Q")            # utime + stime（ticks）
+_proc_io    = array("Q")            # read_bytes + write_bytes
+_proc_ts    = array("d")            # 上次取樣時間
+_proc_gen   = array("I")            # 最後一次被掃到的 round
+_proc_round = 0
+
+def _proc_alloc(pid: int) -> int:
+    if _proc_free:
+        slot = _proc_free.pop()
+    else:
+        slot = len(_proc_ts)
+        for arr in (_proc_start, _proc_cpu, _proc_io, _proc_gen):
+            arr.append(0)
+        _proc_ts.append(0.0)
+    _proc_slot[pid] = slot
+    return slot
+
+def _read_proc_io(pid: int) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/io", "rb") as f:
+            total = 0
+            for line in f:
+                if line.startswith(b"read_bytes:") or line.startswith(b"write_bytes:"):
+                    total += int(line.split()[1])
+            return total
+    except OSError:
+        return None  # 權限不足或 PID 已結束
+
+def _sample_pid(pid: int, now: float) -> Optional[tuple]:
+    """讀取單一 PID，回傳 (cpu_percent, rss, io_bytes_per_s, pid, name)；第一次看到的 PID 回傳 None。"""
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            raw = f.read()
+    except OSError:
+        return None
+    lp, rp = raw.find(b"("), raw.rfind(b")")
+    fields = raw[rp + 2:].split()
+    cpu = int(fields[11]) + int(fields[12])
+    start = int(fields[19])
+    rss = int(fields[21]) * _PAGE_SIZE
+    io = _read_proc_io(pid)
 
-    for nic, io in curr.items():
-        prev = _prev_net.get(nic)
+    slot = _proc_slot.get(pid)
+    fresh = slot is None or _proc_start[slot] != start
+    if slot is None:
+        slot = _proc_alloc(pid)
+    prev_cpu, prev_io, prev_ts = _proc_cpu[slot], _proc_io[slot], _proc_ts[slot]
+    _proc_start[slot] = start
+    _proc_cpu[slot] = cpu
+    _proc_io[slot] = io or 0
+    _proc_ts[slot] = now
+    _proc_gen[slot] = _proc_round
+    if fresh:
+        return None
+
+    dt = max(1e-6, now - prev_ts)
+    cpu_pct = (cpu - prev_cpu) / _CLK_TCK / dt * 100.0
+    io_bps = (io - prev_io) / dt if io is not None and io >= prev_io else 0.0
+    return (cpu_pct, rss, io_bps, pid, raw[lp + 1:rp].decode(errors="replace"))
+
+def _proc_sweep():
+    """回收本輪沒掃到（已結束）的 PID。"""
+    for pid, slot in list(_proc_slot.items()):
+        if _proc_gen[slot] != _proc_round:
+            del _proc_slot[pid]
+            _proc_free.append(slot)
+
+async def get_processes_block(budget_ms: float, top_n: int) -> Optional[Dict[str, Any]]:
+    """
+    掃描一整輪 /proc；每超過 budget_ms 就讓出 event loop，
+    因此即使有上千個 process，也不會卡住 1 Hz 的 CPU/MEM loop。
+    """
+    global _proc_round
+    try:
+        pids = [int(d) for d in os.listdir("/proc") if d.isdigit()]
+    except FileNotFoundError:
+        return None
+
+    _proc_round = (_proc_round + 1) & 0xFFFFFFFF
+    budget = budget_ms / 1000.0
+    rows = []
+    slices, busy = 1, 0.0
+    slice_start = time.perf_counter()
+    for pid in pids:
+        row = _sample_pid(pid, time.time())
+        if row:
+            rows.append(row)
+        if time.perf_counter() - slice_start >= budget:
+            busy += time.perf_counter() - slice_start
+            await asyncio.sleep(0)
+            slices += 1
+            slice_start = time.perf_counter()
+    _proc_sweep()
+    busy += time.perf_counter() - slice_start
+
+    def top(idx: int) -> list:
+        return [
+            {"pid": r[3], "name": r[4], "cpu_percent": round(r[0], 1), "rss": r[1], "io_bytes_per_s": round(r[2], 3)}
+            for r in sorted(rows, key=lambda r: r[idx], reverse=True)[:top_n]
+        ]
+
+    return {
+        "count": len(pids),
+        "top_cpu": top(0),
+        "top_rss": top(1),
+        "top_io": top(2),
+        "scan_ms": round(busy * 1000.0, 3),
+        "slices": slices,
+    }
+
+# ===== cgroup v2 (containers / slices) =====
+# 目錄清單只在階層改變時重建：以根目錄 cgroup.stat（nr_descendants / nr_dying_descendants）當簽章，
+# 建立或刪除 cgroup 都會改變它；平常每個 tick 只讀各 cgroup 的幾個小檔。
+_cgroup_sig: Optional[bytes] = None
+_cgroup_dirs: list = []                     # [(相對路徑, 絕對路徑)]
+_prev_cgroup: Dict[str, tuple] = {}         # 相對路徑 -> (ts, usage_usec, throttled_usec, rbytes, wbytes)
+
+def _read_bytes(path: str) -> Optional[bytes]:
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+def _refresh_cgroup_dirs() -> bool:
+    """若階層有變就重建目錄清單；回傳是否為 cgroup v2。"""
+    global _cgroup_sig, _cgroup_dirs
+    sig = _read_bytes(os.path.join(CGROUP_ROOT, "cgroup.stat"))
+    if sig is None:
+        return False
+    if sig == _cgroup_sig:
+        return True
+    dirs = []
+    base_depth = CGROUP_ROOT.rstrip("/").count("/")
+    for cur, subdirs, files in os.walk(CGROUP_ROOT):
+        depth = cur.rstrip("/").count("/") - base_depth
+        if depth >= CGROUP_MAX_DEPTH:
+            subdirs[:] = []
+        if depth > 0 and "cpu.stat" in files:
+            dirs.append((os.path.relpath(cur, CGROUP_ROOT), cur))
+    _cgroup_sig, _cgroup_dirs = sig, dirs
+    for rel in set(_prev_cgroup) - {rel for rel, _ in dirs}:
+        del _prev_cgroup[rel]
+    return True
+
+def _kv_ints(raw: bytes) -> Dict[bytes, int]:
+    out: Dict[bytes, int] = {}
+    for line in raw.splitlines():
+        k, _, v = line.partition(b" ")
+        if v.isdigit():
+            out[k] = int(v)
+    return out
+
+def _pressure_avg10(raw: Optional[bytes]) -> tuple:
+    some = full = None
+    for line in (raw or b"").splitlines():
+        kind, _, rest = line.partition(b" ")
+        avg10 = float(rest.split(b" ", 1)[0].partition(b"=")[2] or 0)
+        if kind == b"some":
+            some = avg10
+        elif kind == b"full":
+            full = avg10
+    return some, full
+
+def get_cgroups_block() -> Optional[Dict[str, Any]]:
+    global _cgroup_sig
+    if not _refresh_cgroup_dirs():
+        return None
+    result: Dict[str, Any] = {}
+    gone = False
+    for rel, path in _cgroup_dirs:
+        cpu_raw = _read_bytes(os.path.join(path, "cpu.stat"))
+        if cpu_raw is None:
+            gone = True  # cgroup 已被刪除，下一輪重建清單
+            continue
+        now = time.time()
+        cpu = _kv_ints(cpu_raw)
+        usage, throttled = cpu.get(b"usage_usec", 0), cpu.get(b"throttled_usec", 0)
+        rbytes = wbytes = 0
+        for line in (_read_bytes(os.path.join(path, "io.stat")) or b"").splitlines():
+            for kv in line.split()[1:]:
+                k, _, v = kv.partition(b"=")
+                if k == b"rbytes":
+                    rbytes += int(v)
+                elif k == b"wbytes":
+                    wbytes += int(v)
+        mem_raw = _read_bytes(os.path.join(path, "memory.current"))
+        some, full = _pressure_avg10(_read_bytes(os.path.join(path, "memory.pressure")))
+
+        prev = _prev_cgroup.get(rel)
+        _prev_cgroup[rel] = (now, usage, throttled, rbytes, wbytes)
         if not prev:
             continue
-        rx_bps = (io.bytes_recv - prev.bytes_recv) / elapsed
-        tx_bps = (io.bytes_sent - prev.bytes_sent) / elapsed
-        st = stats.get(nic)
-        meta = {"isup": None, "speed_mbps": None, "mtu": None, "duplex": None}
-        if st:
-            meta["isup"] = st.isup
-            meta["speed_mbps"] = st.speed if st.speed >= 0 else None
-            meta["mtu"] = st.mtu if st.mtu >= 0 else None
-            meta["duplex"] = st.duplex
-
-        per_nic[nic] = {
-            "rate": {"rx_bytes_per_s": round(rx_bps, 3), "tx_bytes_per_s": round(tx_bps, 3)},
-            "cumulative": {"bytes_recv": io.bytes_recv, "bytes_sent": io.bytes_sent},
-            "meta": meta
+        dt = max(1e-6, now - prev[0])
+        result[rel] = {
+            "cpu_percent": round((usage - prev[1]) / 1e6 / dt * 100.0, 3),
+            "throttled_percent": round((throttled - prev[2]) / 1e6 / dt * 100.0, 3),
+            "memory_current": int(mem_raw) if mem_raw else None,
+            "read_bytes_per_s": round(max(0, rbytes - prev[3]) / dt, 3),
+            "write_bytes_per_s": round(max(0, wbytes - prev[4]) / dt, 3),
+            "memory_pressure_some_avg10": some,
+            "memory_pressure_full_avg10": full,
         }
-        total["rate"]["rx_bytes_per_s"] += rx_bps
-        total["rate"]["tx_bytes_per_s"] += tx_bps
-        total["cumulative"]["bytes_recv"] += io.bytes_recv
-        total["cumulative"]["bytes_sent"] += io.bytes_sent
-
-    _prev_net = curr
-    total["rate"]["rx_bytes_per_s"] = round(total["rate"]["rx_bytes_per_s"], 3)
-    total["rate"]["tx_bytes_per_s"] = round(total["rate"]["tx_bytes_per_s"], 3)
-    return {"per_nic": per_nic, "total": total}
+    if gone:
+        _cgroup_sig = None
+    return result
 
-# ===== Temperatures: map drivetemp -> sda/sdb/mmcblk/vd*, and NVMe -> nvmeXnY =====
-import glob
-import os
-import re
-from typing import Optional, Dict, Any
+# ===== Filesystems (capacity / inodes) =====
+# 虛擬檔案系統、overlay 層與網路掛載（statvfs 可能卡住）一律略過
+_FS_SKIP_TYPES = {
+    "proc", "sysfs", "devtmpfs", "devpts", "tmpfs", "ramfs", "securityfs", "cgroup", "cgroup2",
+    "pstore", "bpf", "debugfs", "tracefs", "configfs", "fusectl", "mqueue", "hugetlbfs",
+    "autofs", "binfmt_misc", "rpc_pipefs", "nsfs", "efivarfs", "selinuxfs", "squashfs",
+    "overlay", "aufs", "fuse.lxcfs", "fuse.portal", "fuse.gvfsd-fuse",
+    "nfs", "nfs4", "cifs", "smb3", "smbfs", "fuse.sshfs", "sshfs", "ceph", "glusterfs",
+    "fuse.glusterfs", "9p", "afs", "lustre", "davfs", "fuse.rclone", "fuse.s3fs",
+}
+_mountinfo_fd = None
+_mountinfo_poll = None
+_mountinfo_raw: Optional[bytes] = None
+_fs_mounts: list = []   # [(mountpoint, device, fstype)]
+
+def _unescape_mount(path: str) -> str:
+    return re.sub(r"\\([0-7]{3})", lambda m: chr(int(m.group(1), 8)), path)
+
+def _mountinfo_changed() -> bool:
+    """
+    掛載表改變時 kernel 會對 mountinfo 觸發 POLLPRI；
+    平常只做一次 poll(0)，不必每次重讀整個檔案。
+    """
+    global _mountinfo_fd, _mountinfo_poll
+    if _mountinfo_fd is None:
+        try:
+            _mountinfo_fd = open(FS_MOUNTINFO, "rb")
+            _mountinfo_poll = select.poll()
+            _mountinfo_poll.register(_mountinfo_fd, select.POLLPRI | select.POLLERR)
+        except (OSError, AttributeError):
+            _mountinfo_poll = None
+        return True
+    if _mountinfo_poll is None:
+        return True  # 無法 poll：退回比對內容
+    return bool(_mountinfo_poll.poll(0))
 
+def _refresh_fs_mounts():
+    global _mountinfo_raw, _fs_mounts
+    if not _mountinfo_changed():
+        return
+    try:
+        if _mountinfo_fd is not None:
+            _mountinfo_fd.seek(0)
+            raw = _mountinfo_fd.read()   # 讀完即清除 POLLPRI
+        else:
+            with open(FS_MOUNTINFO, "rb") as f:
+                raw = f.read()
+    except OSError:
+        return
+    if raw == _mountinfo_raw:
+        return
+    mounts, seen_dev = [], set()
+    for line in raw.decode(errors="replace").splitlines():
+        pre, _, post = line.partition(" - ")
+        pre_f, post_f = pre.split(), post.split()
+        if len(pre_f) < 5 or len(post_f) < 2:
+            continue
+        majmin, mountpoint = pre_f[2], _unescape_mount(pre_f[4])
+        fstype, source = post_f[0], post_f[1]
+        if fstype in _FS_SKIP_TYPES or majmin in seen_dev:
+            continue  # 同一裝置的 bind mount 只取第一個
+        seen_dev.add(majmin)
+        mounts.append((mountpoint, source, fstype))
+    _mountinfo_raw, _fs_mounts = raw, mounts
+
+def get_filesystems_block() -> Optional[Dict[str, Any]]:
+    _refresh_fs_mounts()
+    result: Dict[str, Any] = {}
+    for mountpoint, device, fstype in _fs_mounts:
+        try:
+            st = os.statvfs(mountpoint)
+        except OSError:
+            continue
+        total = st.f_blocks * st.f_frsize
+        used = (st.f_blocks - st.f_bfree) * st.f_frsize
+        free = st.f_bavail * st.f_frsize
+        inodes_used = st.f_files - st.f_ffree
+        result[mountpoint] = {
+            "device": device,
+            "fstype": fstype,
+            "total": total,
+            "used": used,
+            "free": free,
+            # 與 df 相同：used / (used + 非 root 可用)
+            "percent": round(used * 100.0 / (used + free), 1) if used + free else 0.0,
+            "inodes_total": st.f_files,
+            "inodes_used": inodes_used,
+            "inodes_free": st.f_favail,
+            "inodes_percent": round(inodes_used * 100.0 / st.f_files, 1) if st.f_files else None,
+        }
+    return result or None
+
+# ===== Temperatures: map drivetemp -> sda/sdb/mmcblk/vd*, and NVMe -> nvmeXnY =====
 def _resolve_drivetemp_blockdev(hwmon_dir: str) -> Optional[str]:
     """
     從 /sys/class/hwmon/hwmonX （name=drivetemp）追溯到對應的 block 裝置名，例如 sda/sdb/mmcblk0/vda。
@@ -345,37 +1361,444 @@ def get_temps_block() -> Optional[Dict[str, Any]]:
     return out or None
 
 
+# ===== Collector registry =====
+# 新增指標不必再改 loop / metrics / publish_metrics：註冊一個 collector 即可。
+#   @register_collector("ups", interval=10)
+#   def read_ups(): return {...}
+# fn 可以是一般函式、回傳 coroutine 的函式，或 blocking=True 的阻塞函式（改在 executor 執行）。
+# 每次執行都量測 CPU 時間（thread_time）；平均超過 budget_ms 就把間隔加倍，降到夠便宜後再逐步恢復。
+# coroutine 以一般 Task 執行，量到的是整段期間此執行緒的 CPU 時間（含等待時其他 task 的時間，為上限值）；
+# 會長時間等待 I/O 的 collector 請用 blocking=True 或提高 budget_ms。
+class Collector:
+    def __init__(self, key: str, fn, interval: float, blocking: bool, budget_ms: float, source: str):
+        self.key = key
+        self.fn = fn
+        self.base_interval = interval
+        self.interval = interval
+        self.blocking = blocking
+        self.budget_ms = budget_ms
+        self.source = source
+        self.runs = 0
+        self.errors = 0
+        self.last_error: Optional[str] = None
+        self.cpu_ms = 0.0        # 最近一次
+        self.cpu_ms_avg = 0.0    # EWMA
+
+    def account(self, cpu_ms: float):
+        self.runs += 1
+        self.cpu_ms = round(cpu_ms, 3)
+        self.cpu_ms_avg = cpu_ms if self.runs == 1 else self.cpu_ms_avg * 0.7 + cpu_ms * 0.3
+        limit = self.base_interval * COLLECTOR_MAX_DEMOTE
+        if self.cpu_ms_avg > self.budget_ms and self.interval < limit:
+            self.interval = min(self.interval * 2, limit)
+            print(f"🐢 collector {self.key} 平均 {self.cpu_ms_avg:.1f} ms > {self.budget_ms} ms，降頻為每 {self.interval:g} 秒")
+        elif self.cpu_ms_avg < self.budget_ms / 4 and self.interval > self.base_interval:
+            self.interval = max(self.interval / 2, self.base_interval)
+            print(f"🐇 collector {self.key} 恢復為每 {self.interval:g} 秒")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "interval": self.interval,
+            "base_interval": self.base_interval,
+            "budget_ms": self.budget_ms,
+            "cpu_ms": self.cpu_ms,
+            "cpu_ms_avg": round(self.cpu_ms_avg, 3),
+            "runs": self.runs,
+            "errors": self.errors,
+            "last_error": self.last_error,
+            "source": self.source,
+        }
+
+collectors: Dict[str, Collector] = {}
+_PAYLOAD_KEYS = ("ts", "ts_ms", "seq", "host", "mqtt_stats", "agent")
+
+def register_collector(key: str, fn=None, *, interval: float = 1.0, blocking: bool = False,
+                       budget_ms: Optional[float] = None, source: str = "builtin"):
+    """
+    註冊一個 collector，其結果放在 payload 的 key 欄位。可直接呼叫或當 decorator 使用。
+    interval <= 0 代表停用（與 *_INTERVAL=0 的慣例相同）。
+    外掛不可使用 metrics 中已有的 key（cpu、memory…），以免蓋掉核心欄位。
+    """
+    if fn is None:
+        return lambda f: register_collector(key, f, interval=interval, blocking=blocking,
+                                            budget_ms=budget_ms, source=source)
+    if key in collectors or key in _PAYLOAD_KEYS or (source != "builtin" and key in metrics):
+        raise ValueError(f"collector key already in use: {key!r}")
+    if interval > 0:
+        collectors[key] = Collector(key, fn, interval, blocking,
+                                    COLLECTOR_BUDGET_MS if budget_ms is None else budget_ms, source)
+        metrics.setdefault(key, None)
+    return fn
+
+def _timed_call(fn):
+    t0 = time.thread_time()
+    value = fn()
+    return value, (time.thread_time() - t0) * 1000.0
+
+async def run_collector(c: Collector):
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            if c.blocking:
+                value, cpu_ms = await loop.run_in_executor(None, _timed_call, c.fn)
+            else:
+                t0 = time.thread_time()
+                value = c.fn()
+                if asyncio.iscoroutine(value):
+                    value = await asyncio.create_task(value, name=f"collector:{c.key}")
+                cpu_ms = (time.thread_time() - t0) * 1000.0
+            # 無法序列化的結果（set、datetime、bytes…）在這裡就丟棄，不讓它到 publish_metrics 的 json.dumps
+            json.dumps(value, separators=(",", ":"))
+            metrics[c.key] = value
+            c.account(cpu_ms)
+        except Exception as e:
+            c.errors += 1
+            c.last_error = f"{type(e).__name__}: {e}"
+            print(f"⚠️ collector {c.key} failed: {c.last_error}")
+        await asyncio.sleep(c.interval)
+
+def load_collector_plugins():
+    """
+    載入外部 collector：
+      - entry point group "hwmonitor_mqtt.collectors"：指向一個接受 register_collector 的函式
+      - COLLECTOR_PLUGINS="mod_a,mod_b"：import 模組並呼叫其 register(register_collector)
+    單一外掛失敗只印警告，不影響其他 collector。
+    """
+    from importlib import import_module
+    from importlib.metadata import entry_points
+
+    hooks = []
+    try:
+        for ep in entry_points(group=COLLECTOR_ENTRY_POINT):
+            hooks.append((ep.name, ep.load))
+    except Exception as e:
+        print(f"⚠️ collector entry points unavailable: {e}")
+    for mod in filter(None, (m.strip() for m in COLLECTOR_PLUGINS.split(","))):
+        hooks.append((mod, lambda mod=mod: import_module(mod).register))
+
+    for name, load in hooks:
+        def register(key, fn=None, _src=name, **kw):
+            return register_collector(key, fn, source=_src, **kw)
+        try:
+            load()(register)
+            print(f"🧩 collector plugin loaded: {name}")
+        except Exception as e:
+            print(f"⚠️ collector plugin {name} failed to load: {type(e).__name__}: {e}")
+
+def collector_stats() -> Dict[str, Any]:
+    return {key: c.stats() for key, c in collectors.items()}
+
+# 內建的次要 collector 也走同一套排程（1 Hz 的 CPU / 記憶體 / 網路 / 磁碟仍由專屬 loop 負責）
+register_collector("temperatures", get_temps_block, interval=10)
+register_collector("processes", lambda: get_processes_block(PROC_BUDGET_MS, PROC_TOP_N), interval=PROC_INTERVAL)
+register_collector("cgroups", get_cgroups_block, interval=CGROUP_INTERVAL)
+register_collector("filesystems", get_filesystems_block, interval=FS_INTERVAL)
+
+# ===== Edge alerts =====
+# 規則只在啟動時編譯一次：路徑轉成一串巢狀的存取函式，每個 sample 直接套用，不再逐次解析字串。
+_ALERT_RULE_RE = re.compile(
+    r"^([\w.-]+)\s*:\s*([^\s<>=]+)\s*(>=|<=|>|<)\s*(-?\d+(?:\.\d+)?)"
+    r"(?:\s+for\s+(\d+(?:\.\d+)?)s?)?(?:\s+clear\s+(-?\d+(?:\.\d+)?))?$"
+)
+_ALERT_OPS = {">": float.__gt__, ">=": float.__ge__, "<": float.__lt__, "<=": float.__le__}
+
+def _compile_path(path: str):
+    """回傳 accessor(root) -> [(instance, value)]；* 會展開 dict 的鍵或 list 元素（有 label 時用 label）。"""
+    def build(parts: list):
+        if not parts:
+            def leaf(node, inst):
+                if isinstance(node, (int, float)) and not isinstance(node, bool):
+                    return [("/".join(inst), float(node))]
+                return []
+            return leaf
+        key, rest = parts[0], build(parts[1:])
+        if key == "*":
+            def each(node, inst):
+                if isinstance(node, dict):
+                    items = node.items()
+                elif isinstance(node, list):
+                    items = (((v.get("label") if isinstance(v, dict) else None) or str(i), v) for i, v in enumerate(node))
+                else:
+                    return []
+                out = []
+                for k, v in items:
+                    out.extend(rest(v, inst + (k,)))
+                return out
+            return each
+        index = int(key) if key.isdigit() else key
+        def get(node, inst):
+            try:
+                child = node[index]
+            except (KeyError, IndexError, TypeError):
+                return []
+            return rest(child, inst)
+        return get
+    walk = build(path.split("."))
+    return lambda root: walk(root, ())
+
+class AlertRule:
+    def __init__(self, name: str, path: str, op: str, threshold: float, hold: float, clear: float):
+        self.name, self.path, self.op = name, path, op
+        self.threshold, self.hold, self.clear = threshold, hold, clear
+        self.access = _compile_path(path)
+        self.test = _ALERT_OPS[op]
+        # instance -> [state, since, value]；state 為 pending / firing
+        self.states: Dict[str, list] = {}
+
+def compile_alert_rules(spec: str) -> list:
+    rules = []
+    for chunk in filter(None, (c.strip() for c in spec.split(";"))):
+        m = _ALERT_RULE_RE.match(chunk)
+        if not m:
+            raise ValueError(f"invalid alert rule: {chunk!r}")
+        name, path, op, threshold, hold, clear = m.groups()
+        threshold = float(threshold)
+        rules.append(AlertRule(name, path, op, threshold, float(hold or 0),
+                               float(clear) if clear is not None else threshold))
+    return rules
+
+alert_rules = compile_alert_rules(ALERT_RULES) if ALERTS_ENABLED else []
+
+def evaluate_alerts(root: Dict[str, Any], now: float) -> list:
+    """對一個 sample 套用所有規則，只回傳狀態轉換（firing / resolved）。"""
+    events = []
+    for rule in alert_rules:
+        seen = set()
+        for inst, value in rule.access(root):
+            seen.add(inst)
+            st = rule.states.get(inst)
+            if st is not None and st[0] == "firing":
+                # 遲滯：要越過 clear 值才解除
+                if not rule.test(value, rule.clear):
+                    del rule.states[inst]
+                    events.append((rule, inst, "resolved", value))
+                else:
+                    st[2] = value
+            elif rule.test(value, rule.threshold):
+                if st is None:
+                    st = rule.states[inst] = ["pending", now, value]
+                st[2] = value
+                if now - st[1] >= rule.hold:
+                    st[0] = "firing"
+                    events.append((rule, inst, "firing", value))
+            elif st is not None:
+                del rule.states[inst]  # pending 期間回落，不發佈
+        for inst in [i for i in rule.states if i not in seen]:
+            # 裝置 / 掛載點消失：firing 中的視為解除
+            if rule.states.pop(inst)[0] == "firing":
+                events.append((rule, inst, "resolved", None))
+    return events
+
+def alerts_firing() -> list:
+    return [(rule.name, inst) for rule in alert_rules for inst, st in rule.states.items() if st[0] == "firing"]
+
+def _alert_message(rule: Optional[AlertRule], inst: str, state: str, value: Optional[float]) -> bytes:
+    msg = {
+        "ts": int(time.time()),
+        "host": HOSTNAME,
+        "rule": rule.name if rule else "agent_offline",
+        "instance": inst,
+        "state": state,
+        "value": value,
+    }
+    if rule:
+        msg.update(path=rule.path, op=rule.op, threshold=rule.threshold, clear=rule.clear, hold_s=rule.hold)
+    return json.dumps(msg, separators=(",", ":")).encode()
+
+def publish_alerts(events: list, links: list):
+    fresh = {(rule.name, inst) for rule, inst, _, _ in events}
+    for link in links:
+        if link.announce_online and link.is_connected():
+            # 抵銷 broker 先前可能代發的 last will，並重送所有觸發中的告警（斷線或 failover 期間可能漏掉）
+            link.announce_online = False
+            if link.will:
+                link.publish(ALERT_TOPIC, _alert_message(None, "", "resolved", None))
+            for rule in alert_rules:
+                for inst, st in rule.states.items():
+                    if st[0] == "firing" and (rule.name, inst) not in fresh:
+                        link.publish(ALERT_TOPIC, _alert_message(rule, inst, "firing", st[2]))
+    for rule, inst, state, value in events:
+        print(f"{'🚨' if state == 'firing' else '✅'} alert {rule.name}[{inst}] {state} (value={value})")
+        data = _alert_message(rule, inst, state, value)
+        for link in links:
+            link.publish(ALERT_TOPIC, data)
+
 # ===== MQTT publish =====
 def publish_metrics():
+    global publish_seq
+    publish_seq += 1
+    links = mqtt_links if MQTT_BROKER_MODE == "fanout" else [active_link()]
+    if MQTT_QUEUE_POLICY == "drop-newest" and all(l.saturated() for l in links):
+        # 佇列已滿且 broker 沒在消化：這份樣本注定被丟，連序列化都省掉
+        for link in links:
+            link.stats["dropped"] += 1
+        return
+    now = time.time()
     payload = {
-        "ts": int(time.time()),
+        "ts": int(now),
+        "ts_ms": int(now * 1000),
+        "seq": publish_seq,
         "host": HOSTNAME,
-        "system": metrics["system"],
-        "cpu": metrics["cpu"],
-        "memory": metrics["memory"],
-        "disk_io": metrics["disk_io"],
-        "temperatures": metrics["temperatures"],
-        "network_io": metrics["network_io"],
-        "mqtt_stats": {
-            "publish_ok": mqtt_stats["publish_ok"],
-            "publish_err": mqtt_stats["publish_err"],
-            "last_publish_rc": mqtt_stats["last_publish_rc"],
-            "is_connected": mqtt_stats["is_connected"],
-            "reconnects": mqtt_stats["reconnects"],
-            "last_error": mqtt_stats["last_error"],
-        }
+        **metrics,  # 內建欄位與所有已註冊 collector 的 key
+        "mqtt_stats": mqtt_stats_snapshot(),
+        "agent": dict(agent_stats, uptime_sec=round(time.monotonic() - _START_MONO, 1),
+                      collectors=collector_stats()),
     }
+    # 更小的 JSON（減少頻寬）；每個 tick 只序列化一次，所有 broker 共用同一份 bytes
+    data = json.dumps(payload, separators=(',', ':')).encode()
+    for link in links:
+        link.publish(TOPIC, data)
+    if not first_published.is_set():
+        agent_stats["first_publish_ms"] = since_start_ms()
+        print(f"📤 first sample queued {agent_stats['first_publish_ms']} ms after process start")
+        first_published.set()
+
+# ===== OpenMetrics exporter =====
+# 每個 publish tick 渲染一次並快取成 bytes；scrape 只回傳快取，
+# 不會觸發任何採集，因此 _disk_counters / _net_counters 只會被採集 loop 推進。
+OPENMETRICS_CONTENT_TYPE = b"application/openmetrics-text; version=1.0.0; charset=utf-8"
+_openmetrics_cache: bytes = b"# EOF\n"
+
+def _om_escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _om_labels(**labels: Any) -> str:
+    return "{" + ",".join(f'{k}="{_om_escape(v)}"' for k, v in labels.items()) + "}"
+
+def render_openmetrics() -> bytes:
+    families: Dict[str, list] = {}
+
+    def add(name: str, kind: str, help_text: str, value: Any, /, **labels: Any):
+        if value is None:
+            return
+        fam = families.setdefault(name, [kind, help_text, []])
+        sample = f"{name}_total" if kind == "counter" else name
+        fam[2].append(f"{sample}{_om_labels(host=HOSTNAME, **labels)} {float(value)!r}")
+
+    if cpu := metrics["cpu"]:
+        add("hwmon_cpu_percent", "gauge", "CPU usage percent", cpu["percent_total"], core="total")
+        for i, pct in enumerate(cpu["percent_per_core"] or []):
+            add("hwmon_cpu_percent", "gauge", "CPU usage percent", pct, core=i)
+        for period, val in zip(("1m", "5m", "15m"), cpu["loadavg"]):
+            add("hwmon_load_average", "gauge", "System load average", val, period=period)
+        if cpu["freq_mhz"]:
+            add("hwmon_cpu_frequency_mhz", "gauge", "Current CPU frequency", cpu["freq_mhz"].get("current"))
+
+    if mem := metrics["memory"]:
+        for area in ("ram", "swap"):
+            for field, val in mem[area].items():
+                if field == "percent":
+                    add("hwmon_memory_percent", "gauge", "Memory usage percent", val, area=area)
+                else:
+                    add("hwmon_memory_bytes", "gauge", "Memory size in bytes", val, area=area, field=field)
+
+    if sysb := metrics["system"]:
+        add("hwmon_uptime_seconds", "gauge", "Seconds since boot", sysb["uptime_sec"])
+
+    for dev, v in (metrics["disk_io"] or {}).items():
+        r = v["rate"]
+        add("hwmon_disk_read_bytes_per_second", "gauge", "Disk read throughput", r["read_bytes_per_s"], device=dev)
+        add("hwmon_disk_write_bytes_per_second", "gauge", "Disk write throughput", r["write_bytes_per_s"], device=dev)
+        add("hwmon_disk_read_iops", "gauge", "Disk read operations per second", r["read_iops"], device=dev)
+        add("hwmon_disk_write_iops", "gauge", "Disk write operations per second", r["write_iops"], device=dev)
+        st = v["stats"]
+        add("hwmon_disk_utilization_percent", "gauge", "Disk busy time percent", st["util_percent"], device=dev)
+        add("hwmon_disk_read_await_ms", "gauge", "Average read latency", st["read_await_ms"], device=dev)
+        add("hwmon_disk_write_await_ms", "gauge", "Average write latency", st["write_await_ms"], device=dev)
+        add("hwmon_disk_avg_queue_depth", "gauge", "Average request queue depth", st["avg_queue_depth"], device=dev)
+        add("hwmon_disk_in_flight", "gauge", "Requests currently in flight", st["in_flight"], device=dev)
+
+    if net := metrics["network_io"]:
+        for nic, v in net["per_nic"].items():
+            add("hwmon_network_receive_bytes_per_second", "gauge", "NIC receive throughput", v["rate"]["rx_bytes_per_s"], nic=nic)
+            add("hwmon_network_transmit_bytes_per_second", "gauge", "NIC transmit throughput", v["rate"]["tx_bytes_per_s"], nic=nic)
+            add("hwmon_network_receive_bytes", "counter", "NIC bytes received", v["cumulative"]["bytes_recv"], nic=nic)
+            add("hwmon_network_transmit_bytes", "counter", "NIC bytes sent", v["cumulative"]["bytes_sent"], nic=nic)
+
+    for sensor, entries in (metrics["temperatures"] or {}).items():
+        for e in entries:
+            add("hwmon_temperature_celsius", "gauge", "Sensor temperature", e["current"], sensor=sensor, label=e["label"])
+
+    if procs := metrics["processes"]:
+        add("hwmon_processes", "gauge", "Number of processes", procs["count"])
+        for p in procs["top_cpu"]:
+            add("hwmon_process_cpu_percent", "gauge", "Top processes by CPU", p["cpu_percent"], pid=p["pid"], name=p["name"])
+        for p in procs["top_rss"]:
+            add("hwmon_process_rss_bytes", "gauge", "Top processes by RSS", p["rss"], pid=p["pid"], name=p["name"])
+        for p in procs["top_io"]:
+            add("hwmon_process_io_bytes_per_second", "gauge", "Top processes by I/O", p["io_bytes_per_s"], pid=p["pid"], name=p["name"])
+
+    for cg, v in (metrics["cgroups"] or {}).items():
+        add("hwmon_cgroup_cpu_percent", "gauge", "cgroup CPU usage percent", v["cpu_percent"], cgroup=cg)
+        add("hwmon_cgroup_throttled_percent", "gauge", "cgroup CPU throttled percent", v["throttled_percent"], cgroup=cg)
+        add("hwmon_cgroup_memory_bytes", "gauge", "cgroup memory.current", v["memory_current"], cgroup=cg)
+        add("hwmon_cgroup_read_bytes_per_second", "gauge", "cgroup read throughput", v["read_bytes_per_s"], cgroup=cg)
+        add("hwmon_cgroup_write_bytes_per_second", "gauge", "cgroup write throughput", v["write_bytes_per_s"], cgroup=cg)
+        add("hwmon_cgroup_memory_pressure_some_avg10", "gauge", "cgroup memory pressure (some, avg10)", v["memory_pressure_some_avg10"], cgroup=cg)
+
+    for mp, v in (metrics["filesystems"] or {}).items():
+        add("hwmon_filesystem_size_bytes", "gauge", "Filesystem size", v["total"], mountpoint=mp, device=v["device"], fstype=v["fstype"])
+        add("hwmon_filesystem_used_bytes", "gauge", "Filesystem used space", v["used"], mountpoint=mp, device=v["device"], fstype=v["fstype"])
+        add("hwmon_filesystem_avail_bytes", "gauge", "Filesystem space available to non-root", v["free"], mountpoint=mp, device=v["device"], fstype=v["fstype"])
+        add("hwmon_filesystem_inodes", "gauge", "Filesystem total inodes", v["inodes_total"], mountpoint=mp, device=v["device"], fstype=v["fstype"])
+        add("hwmon_filesystem_inodes_used", "gauge", "Filesystem used inodes", v["inodes_used"], mountpoint=mp, device=v["device"], fstype=v["fstype"])
+
+    for rule_name, inst in alerts_firing():
+        add("hwmon_alert_firing", "gauge", "Alert rules currently firing", 1, rule=rule_name, instance=inst)
+
+    for key, c in collectors.items():
+        add("hwmon_collector_cpu_ms", "gauge", "Collector CPU time per run (EWMA)", round(c.cpu_ms_avg, 3), collector=key)
+        add("hwmon_collector_interval_seconds", "gauge", "Current collector interval", c.interval, collector=key)
+        add("hwmon_collector_errors", "counter", "Collector failures", c.errors, collector=key)
+
+    for key in ("init_ms", "first_publish_ms", "first_connect_ms"):
+        if agent_stats[key] is not None:
+            add("hwmon_agent_startup_seconds", "gauge", "Agent startup milestones since process start",
+                agent_stats[key] / 1000.0, stage=key[:-3])
+
+    for link in mqtt_links:
+        st = link.stats
+        add("hwmon_mqtt_publish_ok", "counter", "Successful MQTT publishes", st["publish_ok"], broker=link.name)
+        add("hwmon_mqtt_publish_err", "counter", "Failed MQTT publishes", st["publish_err"], broker=link.name)
+        add("hwmon_mqtt_reconnects", "counter", "MQTT reconnect attempts", st["reconnects"], broker=link.name)
+        add("hwmon_mqtt_connected", "gauge", "MQTT connection state", int(st["is_connected"]), broker=link.name)
+        add("hwmon_mqtt_queue_depth", "gauge", "Messages waiting in the outgoing queue", st["queue_depth"], broker=link.name)
+        add("hwmon_mqtt_queue_bytes", "gauge", "Bytes waiting in the outgoing queue", st["queue_bytes"], broker=link.name)
+        add("hwmon_mqtt_dropped", "counter", "Messages dropped by the queue policy", st["dropped"], broker=link.name)
+
+    lines = []
+    for name, (kind, help_text, samples) in families.items():
+        lines.append(f"# TYPE {name} {kind}")
+        lines.append(f"# HELP {name} {help_text}")
+        lines.extend(samples)
+    lines.append("# EOF")
+    return ("\n".join(lines) + "\n").encode()
+
+async def _handle_scrape(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
     try:
-        # 更小的 JSON（減少頻寬）
-        info = mqtt_client.publish(TOPIC, json.dumps(payload, separators=(',', ':')), qos=0, retain=False)
-        mqtt_stats["last_publish_rc"] = info.rc
-        if info.rc == mqtt.MQTT_ERR_SUCCESS:
-            mqtt_stats["publish_ok"] += 1
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # 讀掉其餘 header
+        while (line := await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request_line.split()
+        if len(parts) >= 2 and parts[0] == b"GET" and parts[1].split(b"?")[0] == b"/metrics":
+            body = _openmetrics_cache
+            head = b"HTTP/1.1 200 OK\r\nContent-Type: " + OPENMETRICS_CONTENT_TYPE
         else:
-            mqtt_stats["publish_err"] += 1
-    except Exception as e:
-        mqtt_stats["publish_err"] += 1
-        mqtt_stats["last_error"] = str(e)
+            body = b"not found\n"
+            head = b"HTTP/1.1 404 Not Found\r\nContent-Type: text/plain"
+        writer.write(head + b"\r\nContent-Length: " + str(len(body)).encode() + b"\r\nConnection: close\r\n\r\n" + body)
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+async def serve_openmetrics():
+    server = await asyncio.start_server(_handle_scrape, METRICS_BIND, METRICS_PORT)
+    print(f"📈 OpenMetrics exporter on http://{METRICS_BIND}:{METRICS_PORT}/metrics")
+    async with server:
+        await server.serve_forever()
 
 # ===== Async tasks =====
 async def loop_cpu_mem():
@@ -386,77 +1809,113 @@ async def loop_cpu_mem():
         await asyncio.sleep(1)
 
 async def loop_disk():
+    await first_published.wait()
+    get_disk_io_block(1.0)  # 建立拓樸索引與計數器基準
     last = time.time()
     while True:
+        await asyncio.sleep(3)
         now = time.time()
         metrics["disk_io"] = get_disk_io_block(max(1e-6, now - last))
         last = now
-        await asyncio.sleep(3)
-
-async def loop_temps():
-    while True:
-        metrics["temperatures"] = get_temps_block()
-        await asyncio.sleep(10)
 
 async def loop_network():
+    get_net_io_block(1.0)  # 計數器基準
     last = time.time()
     while True:
+        await asyncio.sleep(1)
         now = time.time()
         metrics["network_io"] = get_net_io_block(max(1e-6, now - last))
         last = now
-        await asyncio.sleep(1)
+
+async def loop_collectors():
+    # 第一筆 publish 之後才載入外掛並啟動所有已註冊的 collector
+    await first_published.wait()
+    load_collector_plugins()
+    await asyncio.gather(*(run_collector(c) for c in list(collectors.values())))
 
 async def loop_publish():
+    global _openmetrics_cache
     while True:
         publish_metrics()
+        if ALERTS_ENABLED:
+            publish_alerts(evaluate_alerts(metrics, time.time()),
+                           mqtt_links if MQTT_BROKER_MODE == "fanout" else [active_link()])
+        if METRICS_PORT:
+            _openmetrics_cache = render_openmetrics()
         await asyncio.sleep(1)
 
-async def mqtt_reconnector():
-    """自動重連機制，使用指數退避策略"""
+async def mqtt_reconnector(link: BrokerLink):
+    """自動重連機制，使用指數退避策略（每個 broker 各自退避）；以連線事件取代輪詢"""
     retry_delay = 3  # 初始重連延遲（秒）
     max_delay = 60   # 最大重連延遲（秒）
+    link.attach(asyncio.get_running_loop())
+    first_attempt = True
 
     while True:
-        if not mqtt_client.is_connected():
-            mqtt_stats["reconnects"] += 1
-            print(f"🔄 嘗試重連 MQTT (第 {mqtt_stats['reconnects']} 次)...")
-            mqtt_connect()
-
-            # 等待連線結果
-            await asyncio.sleep(2)
+        if link.v5_fallback:
+            link.fallback_to_v311()
+            retry_delay = 3
+        link.state_changed.clear()
+        if link.is_connected():
+            # 已連線：等到狀態改變（斷線）才醒來
+            retry_delay = 3
+            await link.state_changed.wait()
+            continue
 
-            # 根據連線狀態調整延遲
-            if mqtt_stats["is_connected"]:
-                retry_delay = 3  # 重連成功，重置延遲
-            else:
-                # 連線失敗，使用指數退避
-                retry_delay = min(retry_delay * 2, max_delay)
-                print(f"⏳ 重連失敗，{retry_delay} 秒後重試")
+        if first_attempt:
+            print(f"🔌 連線 MQTT {link.name}...")
+            first_attempt = False
         else:
-            # 已連線，保持短間隔檢查
-            retry_delay = 3
+            link.stats["reconnects"] += 1
+            print(f"🔄 嘗試重連 MQTT {link.name} (第 {link.stats['reconnects']} 次)...")
+        link.connecting = True
+        await link.connect_async()
+
+        # 等待 CONNACK（或連線被拒）事件，而不是固定睡 2 秒
+        try:
+            await asyncio.wait_for(link.state_changed.wait(), timeout=MQTT_CONNECT_TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
+        link.connecting = False
 
+        # 根據連線狀態調整延遲
+        if link.stats["is_connected"]:
+            retry_delay = 3  # 重連成功，重置延遲
+            continue
+        if link.v5_fallback:
+            continue         # 換成 3.1.1 後立即重試
+        # 連線失敗，使用指數退避
+        link.drop_queue()
+        retry_delay = min(retry_delay * 2, max_delay)
+        print(f"⏳ {link.name} 重連失敗，{retry_delay} 秒後重試")
         await asyncio.sleep(retry_delay)
 
 # ===== MAIN =====
 async def main():
-    print(f"🚀 Async Agent started on {HOSTNAME}")
+    agent_stats["init_ms"] = since_start_ms()
+    print(f"🚀 Async Agent started on {HOSTNAME} ({agent_stats['init_ms']} ms)")
     # 預熱 CPU 計算（提升第一筆準確度）
     psutil.cpu_percent(interval=None, percpu=True)
-    await asyncio.gather(
+    # 依序啟動：輕量採集 -> 連線（背景）-> 第一筆 publish；其餘採集器等第一筆送出後才開始
+    tasks = [
         loop_cpu_mem(),
-        loop_disk(),
-        loop_temps(),
         loop_network(),
+        *(mqtt_reconnector(link) for link in mqtt_links),
         loop_publish(),
-        mqtt_reconnector(),
-    )
+        loop_disk(),
+        loop_collectors(),
+    ]
+    if METRICS_PORT:
+        tasks.append(serve_openmetrics())
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        # 在 event loop 關閉前送出 DISCONNECT（asyncio 模式的 socket callback 需要 loop）
+        for link in mqtt_links:
+            link.close()
 
 if __name__ == "__main__":
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
         print("🛑 stopped by user")
-    finally:
-        mqtt_client.loop_stop()
-        mqtt_client.disconnect()
@@ -0,0 +1,515 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Multi-process sharded fleet aggregator
+- N shard processes each decode a slice of sys/agents/+/metrics:
+    filter : a shard only decodes hosts whose crc32(host) % N equals its index.
+             With --host-list each shard subscribes to the exact topics of its own hosts,
+             so the broker only sends it its slice. Without a list MQTT wildcards cannot
+             express the split: every shard receives the full stream (N x broker egress,
+             every paho thread parses every packet) and skips foreign hosts by topic
+    share  : shards join one MQTT shared subscription ($share/<group>/...) and the
+             broker balances messages between them; use it when the host set is not known
+- Shards write a fixed-size per-host summary into their own shared-memory region
+  (one writer per region, seqlock per slot); the coordinator merges all regions
+  into fleet-wide views without any IPC round trips
+- Delivery health from seq / ts_ms (see stream_health.py): ingestion-lag histogram,
+  lost samples and agent stalls; in share mode only lag is tracked
+- If a shard process dies (e.g. it cannot reach the broker) the coordinator stops and exits
+  non-zero instead of merging and publishing a fleet view with that shard's hosts missing
+- --bench measures decode + summarize throughput offline for 1..N shards;
+  --bench-broker publishes the same messages through a broker and measures end-to-end
+  ingest (socket, paho thread, decode) for 1..N shards
+
+Usage:
+    python fleet_aggregator.py --shards 4 --broker 127.0.0.1:1883 --host-list hosts.txt
+    python fleet_aggregator.py --shards 4 --mode share --broker 127.0.0.1:1883
+    python fleet_aggregator.py --bench --hosts 2000 --samples 5
+    python fleet_aggregator.py --bench-broker --mode share --broker 127.0.0.1:1883 --hosts 2000 --samples 5
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import signal
+import struct
+import time
+import zlib
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait as wait_any
+from typing import Dict, Iterator, Optional
+
+from dotenv import load_dotenv
+
+from stream_health import LAG_BUCKETS_MS, StreamHealth, format_ms, percentile
+
+load_dotenv()
+
+BROKER_HOST = os.getenv("BROKER_HOST", "127.0.0.1")
+BROKER_PORT = int(os.getenv("BROKER_PORT", "1883"))
+MQTT_USER = os.getenv("MQTT_USER", "mqtter")
+MQTT_PASS = os.getenv("MQTT_PASS", "seven777")
+TOPIC = "sys/agents/+/metrics"
+SHARE_GROUP = "hwagg"
+STALE_SECONDS = 15
+SUBSCRIBE_BATCH = 500    # --host-list 時每個 SUBSCRIBE 封包最多幾個 topic
+FLUSH_EVERY = 0.1        # shard 把計數器寫回區段的間隔（秒）
+
+# 區段開頭：shard 計數器；之後每台主機一個固定大小的 slot
+#   header: received, decoded, skipped, errors, bytes, stalls, restarts, lag 直方圖（len(LAG_BUCKETS_MS) + 1 格）
+#   slot  : seq（奇數 = 寫入中）, ts, host, cpu%, ram%, rx B/s, tx B/s, disk R B/s, disk W B/s, max temp, max fs%,
+#           msgs, gaps, missed, 最近一次 lag ms
+HEADER = struct.Struct(f"<7Q{len(LAG_BUCKETS_MS) + 1}Q")
+SLOT = struct.Struct("<Id32s8fIIIf")
+FIELDS = ("cpu", "ram", "rx", "tx", "disk_r", "disk_w", "temp", "fs")
+NAN = float("nan")
+
+
+def owner(host: bytes, shards: int) -> int:
+    # 不可用 hash()：每個行程的字串 hash seed 不同
+    return zlib.crc32(host) % shards
+
+
+def host_of(topic: bytes) -> bytes:
+    return topic.split(b"/", 3)[2]
+
+
+def broker_addr(broker: str) -> tuple:
+    host, _, port = broker.rpartition(":") if ":" in broker else (broker, "", "")
+    return host, int(port) if port else BROKER_PORT
+
+
+def load_host_list(path: str) -> list:
+    """每行一個主機名稱，# 開頭為註解；含 MQTT 萬用字元的名稱無法當成 topic，略過。"""
+    with open(path) as f:
+        names = [line.split("#", 1)[0].strip() for line in f]
+    return [n for n in names if n and not any(c in n for c in "+#/")]
+
+
+def shard_topics(index: int, shards: int, mode: str, hosts: Optional[list]) -> list:
+    if mode == "share":
+        return [f"$share/{SHARE_GROUP}/{TOPIC}"]
+    if hosts:
+        return [TOPIC.replace("+", h) for h in hosts if owner(h.encode(), shards) == index]
+    return [TOPIC]
+
+
+def summarize(payload: dict) -> tuple:
+    """把完整 payload 壓成 8 個 float；缺值為 NaN。"""
+    cpu = (payload.get("cpu") or {}).get("percent_total")
+    ram = ((payload.get("memory") or {}).get("ram") or {}).get("percent")
+    total = ((payload.get("network_io") or {}).get("total") or {}).get("rate") or {}
+    disk_r = disk_w = 0.0
+    for dev in (payload.get("disk_io") or {}).values():
+        if "parents" in dev:
+            continue  # 邏輯卷的 I/O 已算在實體磁碟上
+        rate = dev.get("rate") or {}
+        disk_r += rate.get("read_bytes_per_s") or 0.0
+        disk_w += rate.get("write_bytes_per_s") or 0.0
+    temps = [e.get("current") for entries in (payload.get("temperatures") or {}).values()
+             for e in entries if e.get("current") is not None]
+    fs = [v.get("percent") for v in (payload.get("filesystems") or {}).values() if v.get("percent") is not None]
+    val = lambda x: NAN if x is None else float(x)
+    return (val(cpu), val(ram), val(total.get("rx_bytes_per_s")), val(total.get("tx_bytes_per_s")),
+            disk_r, disk_w, max(temps) if temps else NAN, max(fs) if fs else NAN)
+
+
+class ShardWriter:
+    """單一寫入者：只有擁有這個區段的 shard 會寫，slot 以 seqlock 保護給 coordinator 讀。"""
+
+    def __init__(self, name: str, slots: int, track_seq: bool = True):
+        self.shm = shared_memory.SharedMemory(name=name)
+        self.buf = self.shm.buf
+        self.slots = slots
+        self.index: Dict[bytes, int] = {}
+        self.counters = [0, 0, 0, 0, 0]
+        self.health = StreamHealth(track_seq=track_seq)
+
+    def update(self, host: bytes, ts: float, values: tuple, health=None):
+        slot = self.index.get(host)
+        if slot is None:
+            if len(self.index) >= self.slots:
+                self.counters[3] += 1
+                return
+            slot = self.index[host] = len(self.index)
+            msgs = 0
+        else:
+            msgs = SLOT.unpack_from(self.buf, HEADER.size + slot * SLOT.size)[11]
+        off = HEADER.size + slot * SLOT.size
+        seq = struct.unpack_from("<I", self.buf, off)[0]
+        struct.pack_into("<I", self.buf, off, seq + 1)        # 奇數：寫入中
+        if health is None:
+            link = (0, 0, NAN)
+        else:
+            link = (health.gaps, health.missed, health.last_lag_ms)
+        SLOT.pack_into(self.buf, off, seq + 1, ts, host[:32], *values, msgs + 1, *link)
+        struct.pack_into("<I", self.buf, off, seq + 2)        # 偶數：完成
+
+    def flush_counters(self):
+        with self.health.lock:
+            hosts = list(self.health.hosts.values())
+            hist = list(self.health.hist)
+        HEADER.pack_into(self.buf, 0, *self.counters, sum(h.stalls for h in hosts),
+                         sum(h.restarts for h in hosts), *hist)
+
+    def handle(self, topic: bytes, data: bytes, shard: Optional[int], shards: int):
+        recv_ms = time.time() * 1000.0
+        c = self.counters
+        c[0] += 1
+        c[4] += len(data)
+        host = host_of(topic)
+        if shard is not None and owner(host, shards) != shard:
+            c[2] += 1
+            return
+        try:
+            payload = json.loads(data)
+            health = self.health.observe(host.decode(errors="replace"), payload, recv_ms)
+            self.update(host, float(payload.get("ts") or time.time()), summarize(payload), health)
+            c[1] += 1
+        except (ValueError, TypeError, AttributeError):
+            c[3] += 1
+
+
+def read_region(buf, slots: int) -> Iterator[tuple]:
+    """coordinator 端：seqlock 讀取，寫入中或讀取期間被改寫的 slot 重讀。"""
+    for i in range(slots):
+        off = HEADER.size + i * SLOT.size
+        for _ in range(8):
+            rec = SLOT.unpack_from(buf, off)
+            if rec[0] == 0:
+                return  # slot 依序配置，第一個空 slot 之後都是空的
+            if rec[0] % 2 == 0 and struct.unpack_from("<I", buf, off)[0] == rec[0]:
+                yield rec
+                break
+
+
+def shard_main(index: int, shards: int, shm_name: str, slots: int, broker: str, mode: str,
+               hosts: Optional[list] = None, ready=None):
+    import paho.mqtt.client as mqtt
+
+    writer = ShardWriter(shm_name, slots, track_seq=(mode == "filter"))
+    topics = shard_topics(index, shards, mode, hosts)
+    batches = [topics[i:i + SUBSCRIBE_BATCH] for i in range(0, len(topics), SUBSCRIBE_BATCH)]
+    acked = []
+    shard = index if mode == "filter" else None
+
+    def on_connect(c, u, f, rc, p=None):
+        if rc != 0:
+            return
+        acked.clear()
+        for batch in batches:
+            c.subscribe([(t, 0) for t in batch])
+        if not batches and ready is not None:
+            ready.set()     # 沒有分到任何主機
+
+    def on_subscribe(c, u, mid, rc, p=None):
+        acked.append(mid)
+        if len(acked) == len(batches) and ready is not None:
+            ready.set()
+
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"hwagg-{os.getpid()}-{index}")
+    client.username_pw_set(MQTT_USER, MQTT_PASS)
+    client.on_connect = on_connect
+    client.on_subscribe = on_subscribe
+    client.on_message = lambda c, u, msg: writer.handle(msg.topic.encode(), msg.payload, shard, shards)
+    try:
+        client.connect(*broker_addr(broker), 60)
+    except OSError as e:
+        # 以非零結束碼離開，coordinator 會偵測到而不是默默少掉這個 shard 的主機
+        print(f"❌ shard {index}: cannot connect to {broker}: {e}", flush=True)
+        writer.shm.close()
+        raise SystemExit(1)
+    client.loop_start()     # 連上之後斷線由 paho 自動重連，on_connect 重新訂閱
+    try:
+        while True:
+            time.sleep(FLUSH_EVERY)
+            writer.flush_counters()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.loop_stop()
+        writer.shm.close()
+
+
+def merge(regions: list, slots: int, now: Optional[float]) -> dict:
+    """所有 shard 區段合併成全艦隊視圖；share 模式下同一主機可能出現在多個區段，取最新的。"""
+    hosts: Dict[bytes, tuple] = {}
+    counters = [0] * (7 + len(LAG_BUCKETS_MS) + 1)
+    for shm in regions:
+        for i, v in enumerate(HEADER.unpack_from(shm.buf, 0)):
+            counters[i] += v
+        for rec in read_region(shm.buf, slots):
+            name = rec[2].rstrip(b"\0")
+            if name not in hosts or hosts[name][1] < rec[1]:
+                hosts[name] = rec
+    live = [r for r in hosts.values() if now is None or now - r[1] <= STALE_SECONDS]
+    col = lambda k: [r[3 + k] for r in live if r[3 + k] == r[3 + k]]  # 排除 NaN
+    cpu, temp = col(0), col(6)
+    hottest = sorted(((r[3 + 6], r[2].rstrip(b"\0").decode()) for r in live if r[3 + 6] == r[3 + 6]), reverse=True)
+    hist = counters[7:]
+    missed = sum(r[13] for r in hosts.values())
+    decoded = counters[1]
+    lossiest = sorted(((r[13], r[2].rstrip(b"\0").decode()) for r in hosts.values() if r[13]), reverse=True)
+    slow = sorted(((r[14], r[2].rstrip(b"\0").decode()) for r in live if r[14] == r[14]), reverse=True)
+    return {
+        "hosts": len(hosts),
+        "live": len(live),
+        "stale": len(hosts) - len(live),
+        "cpu_avg": round(sum(cpu) / len(cpu), 1) if cpu else None,
+        "cpu_max": round(max(cpu), 1) if cpu else None,
+        "ram_avg": round(sum(col(1)) / len(col(1)), 1) if col(1) else None,
+        "net_rx_bytes_per_s": round(sum(col(2)), 1),
+        "net_tx_bytes_per_s": round(sum(col(3)), 1),
+        "disk_read_bytes_per_s": round(sum(col(4)), 1),
+        "disk_write_bytes_per_s": round(sum(col(5)), 1),
+        "temp_max": round(max(temp), 1) if temp else None,
+        "hottest": [{"host": h, "temp": round(t, 1)} for t, h in hottest[:5]],
+        "received": counters[0],
+        "decoded": counters[1],
+        "skipped": counters[2],
+        "errors": counters[3],
+        "lag_p50_ms": percentile(hist, 0.5),
+        "lag_p99_ms": percentile(hist, 0.99),
+        "gaps": sum(r[12] for r in hosts.values()),
+        "missed": missed,
+        "loss_pct": round(missed * 100.0 / (decoded + missed), 3) if decoded + missed else 0.0,
+        "stalls": counters[5],
+        "restarts": counters[6],
+        "lossiest": [{"host": h, "missed": n} for n, h in lossiest[:5]],
+        "slowest": [{"host": h, "lag_ms": round(lag, 1)} for lag, h in slow[:5]],
+    }
+
+
+def run(args):
+    ctx = mp.get_context("spawn")
+    size = HEADER.size + args.max_hosts * SLOT.size
+    regions = [shared_memory.SharedMemory(create=True, size=size) for _ in range(args.shards)]
+    hosts = load_host_list(args.host_list) if args.host_list and args.mode == "filter" else None
+    procs = [ctx.Process(target=shard_main, daemon=True,
+                         args=(i, args.shards, regions[i].name, args.max_hosts, args.broker, args.mode, hosts))
+             for i in range(args.shards)]
+    for p in procs:
+        p.start()
+    if hosts:
+        print(f"🧮 {args.shards} shards ({args.mode}, {len(hosts)} hosts from {args.host_list}) <- {args.broker}")
+    else:
+        print(f"🧮 {args.shards} shards ({args.mode}) <- {args.broker}")
+        if args.mode == "filter" and args.shards > 1:
+            print("   ⚠️ no --host-list: every shard receives the full stream; use --mode share or a host list")
+
+    pub = None
+    if args.publish_topic:
+        import paho.mqtt.client as mqtt
+        pub = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"hwagg-coord-{os.getpid()}")
+        pub.username_pw_set(MQTT_USER, MQTT_PASS)
+        pub.connect(*broker_addr(args.broker), 60)
+        pub.loop_start()
+
+    last_decoded, last_t = 0, time.monotonic()
+    try:
+        while True:
+            # 任一 shard 結束就立即醒來：少了它，合併出的艦隊視圖會缺一整片主機
+            ended = wait_any([p.sentinel for p in procs], args.report_every)
+            if ended:
+                for i, p in enumerate(procs):
+                    if p.sentinel in ended:
+                        p.join(5)   # sentinel 先就緒，結束碼要等行程回收後才有
+                        print(f"❌ shard {i} exited with code {p.exitcode}; its hosts would be missing from the fleet view")
+                raise SystemExit(1)
+            now_m = time.monotonic()
+            view = merge(regions, args.max_hosts, time.time())
+            rate = (view["decoded"] - last_decoded) / (now_m - last_t)
+            last_decoded, last_t = view["decoded"], now_m
+            view["decoded_per_s"] = round(rate, 1)
+            print(f"hosts={view['hosts']} live={view['live']} cpu_avg={view['cpu_avg']} temp_max={view['temp_max']} "
+                  f"rx={view['net_rx_bytes_per_s'] / 1e6:.1f}MB/s decoded={rate:.0f}/s skipped={view['skipped']} "
+                  f"lag_p99={format_ms(view['lag_p99_ms'])} lost={view['missed']} stalls={view['stalls']}")
+            if pub:
+                pub.publish(args.publish_topic, json.dumps(view, separators=(",", ":")), qos=0)
+    except KeyboardInterrupt:
+        print("🛑 stopped by user")
+    finally:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl-C 會送給整個行程群組，清理期間不再中斷
+        for p in procs:
+            p.terminate()
+            p.join()
+        if pub:
+            pub.loop_stop()
+        for shm in regions:
+            shm.close()
+            shm.unlink()
+
+
+# ===== Offline benchmark =====
+def _bench_messages(hosts: int, samples: int, seed: int) -> list:
+    import random
+    from types import SimpleNamespace
+    from fleet_loadgen import SimAgent
+
+    random.seed(seed)
+    opts = SimpleNamespace(prefix="bench", cores=8, disks=2, nics=2, sensors=4, procs=5)
+    agents = [SimAgent(i, opts) for i in range(hosts)]
+    return [(a.topic.encode(), json.dumps(a.payload(), separators=(",", ":")).encode())
+            for _ in range(samples) for a in agents]
+
+
+def bench_shard(index: int, shards: int, shm_name: str, slots: int, hosts: int, samples: int,
+                seed: int, start, results):
+    messages = _bench_messages(hosts, samples, seed)  # 每個 shard 自己產生同一批資料，不計入時間
+    writer = ShardWriter(shm_name, slots)
+    start.wait()
+    t0 = time.perf_counter()
+    for topic, data in messages:
+        writer.handle(topic, data, index, shards)  # filter 模式：每個 shard 都看到全部訊息
+    elapsed = time.perf_counter() - t0
+    writer.flush_counters()
+    writer.shm.close()
+    results.put((index, writer.counters[1], elapsed))
+
+
+def _shard_counts(limit: int) -> list:
+    counts, n = [], 1
+    while n < limit:
+        counts.append(n)
+        n *= 2
+    return counts + [limit]
+
+
+def bench(args):
+    ctx = mp.get_context("spawn")
+    counts = _shard_counts(args.shards)
+    total = args.hosts * args.samples
+    print(f"🏁 decode+summarize benchmark: {args.hosts} hosts x {args.samples} samples = {total} messages, "
+          f"{os.cpu_count()} CPUs")
+    base = None
+    for shards in counts:
+        size = HEADER.size + args.max_hosts * SLOT.size
+        regions = [shared_memory.SharedMemory(create=True, size=size) for _ in range(shards)]
+        start, results = ctx.Event(), ctx.Queue()
+        procs = [ctx.Process(target=bench_shard, args=(i, shards, regions[i].name, args.max_hosts,
+                                                        args.hosts, args.samples, args.seed, start, results))
+                 for i in range(shards)]
+        for p in procs:
+            p.start()
+        time.sleep(0.2)
+        start.set()
+        rows = [results.get() for _ in procs]
+        for p in procs:
+            p.join()
+        wall = max(r[2] for r in rows)
+        decoded = sum(r[1] for r in rows)
+        view = merge(regions, args.max_hosts, None)  # 不判斷 stale，只驗證合併結果
+        for shm in regions:
+            shm.close()
+            shm.unlink()
+        rate = decoded / wall
+        base = base or rate
+        print(f"  shards={shards:<3} {rate:10.0f} msg/s  speedup x{rate / base:4.2f}  "
+              f"(efficiency {rate / base / shards * 100:3.0f}%)  hosts merged={view['hosts']}")
+
+
+def bench_publish(broker: str, hosts: int, samples: int, seed: int, connected, start, results):
+    import asyncio
+    from fleet_loadgen import MiniClient
+
+    messages = _bench_messages(hosts, samples, seed)  # 與 shard 無關的準備工作，不計入時間
+
+    async def blast():
+        client = MiniClient(f"hwagg-bench-{os.getpid()}")
+        await client.connect(*broker_addr(broker))
+        connected.set()
+        await asyncio.get_running_loop().run_in_executor(None, start.wait)
+        t0 = time.perf_counter()
+        for topic, data in messages:
+            client.publish(topic.decode(), data)
+            if client.writer.transport.get_write_buffer_size() > 1 << 20:
+                await client.writer.drain()
+        await client.writer.drain()
+        results.put(time.perf_counter() - t0)
+        await client.close()
+
+    asyncio.run(blast())
+
+
+def bench_broker(args):
+    """經由 broker 的端到端 ingest：socket、paho 執行緒、decode、寫入共享記憶體都算在內。"""
+    ctx = mp.get_context("spawn")
+    total = args.hosts * args.samples
+    names = [f"bench-{i:05d}" for i in range(args.hosts)]   # 與 _bench_messages 的 SimAgent 名稱相同
+    hosts = names if args.mode == "filter" else None
+    print(f"🏁 broker ingest benchmark ({args.mode}{', per-host subscriptions' if hosts else ''}) via {args.broker}: "
+          f"{args.hosts} hosts x {args.samples} samples = {total} messages, {os.cpu_count()} CPUs")
+    base = None
+    for shards in _shard_counts(args.shards):
+        size = HEADER.size + args.max_hosts * SLOT.size
+        regions = [shared_memory.SharedMemory(create=True, size=size) for _ in range(shards)]
+        readies = [ctx.Event() for _ in range(shards)]
+        procs = [ctx.Process(target=shard_main, daemon=True, args=(i, shards, regions[i].name, args.max_hosts,
+                                                                    args.broker, args.mode, hosts, readies[i]))
+                 for i in range(shards)]
+        connected, start, results = ctx.Event(), ctx.Event(), ctx.Queue()
+        pub = ctx.Process(target=bench_publish, args=(args.broker, args.hosts, args.samples, args.seed,
+                                                      connected, start, results))
+        try:
+            for p in procs:
+                p.start()
+            pub.start()
+            if not all(r.wait(30) for r in readies) or not connected.wait(60):
+                raise SystemExit(f"❌ shards or publisher could not subscribe / connect to {args.broker}")
+            t0 = time.monotonic()
+            start.set()
+            # 等到全部 decode 完，或 5 秒沒有進展（broker 丟訊息時）
+            decoded, last_change = 0, t0
+            while decoded < total and time.monotonic() - last_change < 5:
+                time.sleep(FLUSH_EVERY / 2)
+                now = sum(HEADER.unpack_from(shm.buf, 0)[1] for shm in regions)
+                if now != decoded:
+                    decoded, last_change = now, time.monotonic()
+            wall = last_change - t0
+            dead = [i for i, p in enumerate(procs) if p.exitcode is not None]
+            if dead:
+                raise SystemExit(f"❌ shard(s) {dead} exited during the run; results would be incomplete")
+            pub_elapsed = results.get(timeout=30)
+        finally:
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            for p in procs + [pub]:
+                p.terminate()
+                p.join()
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            for shm in regions:
+                shm.close()
+                shm.unlink()
+        rate = decoded / wall
+        base = base or rate
+        print(f"  shards={shards:<3} {rate:10.0f} msg/s  speedup x{rate / base:4.2f}  "
+              f"(efficiency {rate / base / shards * 100:3.0f}%)  decoded={decoded}/{total}  "
+              f"publisher {total / pub_elapsed:.0f} msg/s")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--shards", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--mode", choices=("filter", "share"), default="filter")
+    ap.add_argument("--broker", default=f"{BROKER_HOST}:{BROKER_PORT}", help="host[:port]")
+    ap.add_argument("--max-hosts", type=int, default=8192, help="slots per shard region")
+    ap.add_argument("--report-every", type=float, default=5.0)
+    ap.add_argument("--publish-topic", default="", help="publish the merged fleet view here (e.g. sys/fleet/summary)")
+    ap.add_argument("--host-list", default="", help="filter mode: file with one host per line; "
+                                                     "each shard subscribes only to its own hosts' topics")
+    ap.add_argument("--bench", action="store_true", help="offline decode benchmark for 1..--shards shards")
+    ap.add_argument("--bench-broker", action="store_true",
+                    help="end-to-end ingest benchmark through --broker (e.g. mqtt_standin.py) for 1..--shards shards")
+    ap.add_argument("--hosts", type=int, default=2000, help="bench: simulated hosts")
+    ap.add_argument("--samples", type=int, default=5, help="bench: samples per host")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+    if args.bench_broker:
+        bench_broker(args)
+    elif args.bench:
+        bench(args)
+    else:
+        run(args)
+
+
+if __name__ == "__main__":
+    main()
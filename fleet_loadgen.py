@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Synthetic fleet load generator
+- Simulates N agents in one asyncio process, one MQTT connection per agent
+- Payloads follow the exact schema of agent_sender_async.publish_metrics()
+  with configurable core / disk / NIC / sensor counts and slowly drifting values
+- A subscriber connection measures end-to-end latency (publish -> delivery), matched by
+  each payload's seq so a dropped message costs one sample instead of skewing the rest;
+  with --qos 1 the PUBACK round trip is reported as well
+- Prints achieved publish / delivery rates and latency percentiles every few seconds
+
+Usage:
+    python mqtt_standin.py --port 1883 &
+    python fleet_loadgen.py --agents 2000 --rate 1 --broker 127.0.0.1:1883 --duration 60
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import resource
+import struct
+import time
+
+from dotenv import load_dotenv
+
+from mqtt_standin import encode_varint
+
+load_dotenv()
+
+BROKER_HOST = os.getenv("BROKER_HOST", "127.0.0.1")
+BROKER_PORT = int(os.getenv("BROKER_PORT", "1883"))
+MQTT_USER = os.getenv("MQTT_USER", "mqtter")
+MQTT_PASS = os.getenv("MQTT_PASS", "seven777")
+
+GiB = 1024 ** 3
+INFLIGHT_MAX = 4096     # 每個 topic 最多記住幾筆送出時間（訂閱端落後太多時不再精確，但記憶體有界）
+_SEQ = re.compile(rb'"seq":(\d+)')   # payload 開頭即為 ts / ts_ms / seq，不必整份解碼
+
+
+# ===== Minimal MQTT 3.1.1 client (asyncio streams) =====
+def _mqtt_str(text: str) -> bytes:
+    raw = text.encode()
+    return struct.pack("!H", len(raw)) + raw
+
+
+def _packet(ptype: int, body: bytes, flags: int = 0) -> bytes:
+    return bytes([(ptype << 4) | flags]) + encode_varint(len(body)) + body
+
+
+class MiniClient:
+    """只實作本工具需要的部分：CONNECT、PUBLISH（QoS 0/1）、SUBSCRIBE、PINGREQ。"""
+
+    def __init__(self, client_id: str):
+        self.client_id = client_id
+        self.reader = None
+        self.writer = None
+        self.keepalive = 0
+        self.next_mid = 0
+        self.pending: dict = {}      # mid -> 送出時間（QoS 1）
+        self.on_puback = None        # callback(rtt_seconds)
+        self.on_message = None       # callback(topic, payload)
+
+    async def connect(self, host: str, port: int, keepalive: int = 60):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.keepalive = keepalive
+        flags = 0x02 | (0x80 if MQTT_USER else 0) | (0x40 if MQTT_PASS else 0)
+        body = _mqtt_str("MQTT") + bytes([4, flags]) + struct.pack("!H", keepalive) + _mqtt_str(self.client_id)
+        if MQTT_USER:
+            body += _mqtt_str(MQTT_USER)
+        if MQTT_PASS:
+            body += _mqtt_str(MQTT_PASS)
+        self.writer.write(_packet(1, body))
+        ptype, body = await self._read_packet()
+        if ptype != 2 or body[1] != 0:
+            raise ConnectionError(f"CONNACK refused ({body[1] if len(body) > 1 else '?'})")
+
+    async def _read_packet(self) -> tuple:
+        head = await self.reader.readexactly(1)
+        mult, length = 1, 0
+        while True:
+            b = (await self.reader.readexactly(1))[0]
+            length += (b & 0x7F) * mult
+            mult *= 128
+            if not b & 0x80:
+                break
+        return head[0] >> 4, await self.reader.readexactly(length)
+
+    async def run_reader(self):
+        """讀取 PUBACK / PUBLISH；連線中斷時結束。期間每 keepalive/2 秒送一次 PINGREQ。"""
+        pinger = asyncio.create_task(self._ping_loop()) if self.keepalive else None
+        try:
+            while True:
+                ptype, body = await self._read_packet()
+                if ptype == 4 and self.on_puback:
+                    sent = self.pending.pop(struct.unpack_from("!H", body)[0], None)
+                    if sent is not None:
+                        self.on_puback(time.perf_counter() - sent)
+                elif ptype == 3 and self.on_message:
+                    tlen = struct.unpack_from("!H", body)[0]
+                    self.on_message(body[2:2 + tlen].decode(), body[2 + tlen:])
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if pinger:
+                pinger.cancel()
+
+    async def _ping_loop(self):
+        # 只訂閱不發佈的連線沒有其他封包，broker 會在 1.5 倍 keepalive 後斷線
+        while True:
+            await asyncio.sleep(self.keepalive / 2)
+            self.ping()
+
+    def publish(self, topic: str, payload: bytes, qos: int = 0):
+        head = _mqtt_str(topic)
+        if qos:
+            self.next_mid = self.next_mid % 65535 + 1
+            self.pending[self.next_mid] = time.perf_counter()
+            head += struct.pack("!H", self.next_mid)
+        self.writer.write(_packet(3, head + payload, flags=qos << 1))
+
+    def subscribe(self, topic: str):
+        self.writer.write(_packet(8, struct.pack("!H", 1) + _mqtt_str(topic) + b"\x00", flags=0x02))
+
+    def ping(self):
+        self.writer.write(_packet(12, b""))
+
+    async def close(self):
+        if self.writer:
+            self.writer.write(_packet(14, b""))
+            self.writer.close()
+
+
+# ===== Synthetic agent =====
+class Drift:
+    """有上下限、會回歸平均的隨機漫步，讓數值看起來像真的主機。"""
+
+    __slots__ = ("value", "mean", "lo", "hi", "step")
+
+    def __init__(self, mean: float, lo: float, hi: float, step: float):
+        self.value = random.uniform(lo, hi) * 0.5 + mean * 0.5
+        self.mean, self.lo, self.hi, self.step = mean, lo, hi, step
+
+    def next(self) -> float:
+        self.value += random.gauss(0, self.step) + (self.mean - self.value) * 0.05
+        self.value = min(self.hi, max(self.lo, self.value))
+        return self.value
+
+
+class SimAgent:
+    def __init__(self, index: int, args):
+        self.host = f"{args.prefix}-{index:05d}"
+        self.topic = f"sys/agents/{self.host}/metrics"
+        self.cores = [Drift(random.uniform(5, 60), 0, 100, 4) for _ in range(args.cores)]
+        self.load = Drift(args.cores * 0.3, 0, args.cores * 2, 0.2)
+        self.mem_total = random.choice((8, 16, 32, 64)) * GiB
+        self.mem_pct = Drift(random.uniform(20, 80), 1, 99, 0.5)
+        self.disks = {f"sd{chr(97 + i)}": (Drift(2e6, 0, 5e8, 1e6), Drift(5e6, 0, 5e8, 2e6), Drift(10, 0, 100, 3))
+                      for i in range(args.disks)}
+        self.nics = {f"eth{i}": [Drift(1e6, 0, 1.25e8, 2e5), Drift(5e5, 0, 1.25e8, 1e5), 0, 0]
+                     for i in range(args.nics)}
+        self.sensors = [Drift(random.uniform(35, 60), 20, 95, 0.3) for _ in range(args.sensors)]
+        self.procs = args.procs
+        self.boot = time.time() - random.randint(3600, 90 * 86400)
+        self.pid = random.randint(100, 60000)
+        self.started = time.time()
+        self.sent = 0
+
+    def payload(self) -> dict:
+        now = time.time()
+        per_core = [round(c.next(), 1) for c in self.cores]
+        load1 = self.load.next()
+        mem_pct = self.mem_pct.next()
+        used = int(self.mem_total * mem_pct / 100)
+
+        disk_io = {}
+        for dev, (rd, wr, util) in self.disks.items():
+            r, w = rd.next(), wr.next()
+            disk_io[dev] = {
+                "rate": {"read_bytes_per_s": round(r, 3), "write_bytes_per_s": round(w, 3),
+                         "read_iops": round(r / 65536, 3), "write_iops": round(w / 65536, 3)},
+                "stats": {"util_percent": round(util.next(), 3), "read_await_ms": round(random.uniform(0.1, 4), 3),
+                          "write_await_ms": round(random.uniform(0.2, 8), 3),
+                          "avg_queue_depth": round(random.uniform(0, 2), 3), "in_flight": random.randint(0, 4)},
+            }
+
+        per_nic, rx_tot, tx_tot, recv_tot, sent_tot = {}, 0.0, 0.0, 0, 0
+        for nic, st in self.nics.items():
+            rx, tx = st[0].next(), st[1].next()
+            st[2] += int(rx)
+            st[3] += int(tx)
+            rx_tot += rx
+            tx_tot += tx
+            recv_tot += st[2]
+            sent_tot += st[3]
+            per_nic[nic] = {
+                "rate": {"rx_bytes_per_s": round(rx, 3), "tx_bytes_per_s": round(tx, 3)},
+                "cumulative": {"bytes_recv": st[2], "bytes_sent": st[3]},
+                "meta": {"isup": True, "speed_mbps": 1000, "mtu": 1500, "duplex": 2},
+            }
+
+        temps = None
+        if self.sensors:
+            temps = {"coretemp": [{"label": f"Core {i}", "current": round(s.next(), 1), "high": 80.0, "critical": 100.0}
+                                  for i, s in enumerate(self.sensors)]}
+
+        def proc(i):
+            return {"pid": 1000 + i, "name": f"worker{i}", "cpu_percent": round(random.uniform(0, 50), 1),
+                    "rss": random.randint(10, 2000) * 1024 * 1024, "io_bytes_per_s": round(random.uniform(0, 1e6), 3)}
+
+        top = [proc(i) for i in range(self.procs)]
+        self.sent += 1
+        return {
+            "ts": int(now),
+            "ts_ms": int(now * 1000),
+            "seq": self.sent,
+            "host": self.host,
+            "cpu": {
+                "percent_total": round(sum(per_core) / len(per_core), 1) if per_core else 0.0,
+                "percent_per_core": per_core,
+                "freq_mhz": {"current": round(random.uniform(2200, 3600), 1), "min": 800.0, "max": 3600.0},
+                "count_logical": len(per_core),
+                "count_physical": max(1, len(per_core) // 2),
+                "loadavg": [round(load1, 2), round(load1 * 0.9, 2), round(load1 * 0.8, 2)],
+            },
+            "memory": {
+                "ram": {"total": self.mem_total, "used": used, "available": self.mem_total - used,
+                        "percent": round(mem_pct, 1)},
+                "swap": {"total": 2 * GiB, "used": 0, "free": 2 * GiB, "percent": 0.0},
+            },
+            "disk_io": disk_io,
+            "temperatures": temps,
+            "network_io": {
+                "per_nic": per_nic,
+                "total": {"rate": {"rx_bytes_per_s": round(rx_tot, 3), "tx_bytes_per_s": round(tx_tot, 3)},
+                          "cumulative": {"bytes_recv": recv_tot, "bytes_sent": sent_tot}},
+            },
+            "system": {"uptime_sec": int(now - self.boot), "hostname": self.host, "pid": self.pid},
+            "processes": {"count": random.randint(150, 400), "top_cpu": top, "top_rss": top, "top_io": top,
+                          "scan_ms": round(random.uniform(2, 9), 3), "slices": 1} if self.procs else None,
+            "cgroups": None,
+            "filesystems": {"/": {"device": "/dev/sda1", "fstype": "ext4", "total": 500 * GiB, "used": 120 * GiB,
+                                  "free": 380 * GiB, "percent": 24.0, "inodes_total": 32768000,
+                                  "inodes_used": 600000, "inodes_free": 32168000, "inodes_percent": 1.8}},
+            "mqtt_stats": {
+                "publish_ok": self.sent, "publish_err": 0, "last_publish_rc": 0, "is_connected": True,
+                "reconnects": 0, "last_error": None, "protocol": "3.1.1", "mode": "failover",
+                "queue_depth": 0, "queue_bytes": 0, "dropped": 0, "queue_policy": "drop-oldest",
+                "brokers": [{"publish_ok": self.sent, "publish_err": 0, "last_publish_rc": 0, "reconnects": 0,
+                             "is_connected": True, "last_error": None, "protocol": "3.1.1", "queue_depth": 0,
+                             "queue_bytes": 0, "dropped": 0, "broker": "loadgen", "active": True}],
+            },
+            "agent": {"pid": self.pid, "started_at": int(self.started), "init_ms": 120.0,
+                      "first_publish_ms": 125.0, "first_connect_ms": 130.0,
+                      "uptime_sec": round(now - self.started, 1), "collectors": {}},
+        }
+
+
+# ===== Load loop =====
+class Stats:
+    def __init__(self):
+        self.published = 0
+        self.delivered = 0
+        self.bytes = 0
+        self.errors = 0
+        self.e2e: list = []
+        self.ack: list = []
+        self.inflight: dict = {}     # topic -> {seq: 送出時間}；遺失的訊息只影響自己那一筆
+        self.tracking = False        # 量測用的訂閱端在線時才記錄送出時間
+
+    def reset_window(self):
+        self.e2e, self.ack = [], []
+
+
+def percentiles(samples: list) -> str:
+    if not samples:
+        return "n/a"
+    s = sorted(samples)
+    pick = lambda q: s[min(len(s) - 1, int(q * len(s)))] * 1000
+    return f"p50={pick(0.5):.1f} p90={pick(0.9):.1f} p99={pick(0.99):.1f} max={s[-1] * 1000:.1f} ms"
+
+
+async def run_agent(agent: SimAgent, args, stats: Stats, host: str, port: int, stop: asyncio.Event):
+    client = MiniClient(f"loadgen-{agent.host}")
+    try:
+        await client.connect(host, port)
+    except (OSError, ConnectionError) as e:
+        stats.errors += 1
+        print(f"⚠️ {agent.host}: {e}")
+        return
+    client.on_puback = stats.ack.append
+    reader = asyncio.create_task(client.run_reader())
+    period = 1.0 / args.rate
+    sent_times = stats.inflight.setdefault(agent.topic, {})
+    await asyncio.sleep(random.uniform(0, period))  # 錯開相位，避免所有 agent 同時送出
+    next_at = time.perf_counter()
+    try:
+        while not stop.is_set():
+            if reader.done():
+                stats.errors += 1
+                print(f"⚠️ {agent.host}: connection closed by broker")
+                break
+            data = json.dumps(agent.payload(), separators=(",", ":")).encode()
+            if stats.tracking:
+                sent_times[agent.sent] = time.perf_counter()
+                if len(sent_times) > INFLIGHT_MAX:
+                    del sent_times[next(iter(sent_times))]
+            client.publish(agent.topic, data, qos=args.qos)
+            stats.published += 1
+            stats.bytes += len(data)
+            if client.writer.transport.get_write_buffer_size() > 1 << 20:
+                await client.writer.drain()  # broker 跟不上時在這裡產生背壓
+            next_at += period
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+    except ConnectionError:
+        stats.errors += 1
+    finally:
+        reader.cancel()
+        await client.close()
+
+
+async def run_subscriber(stats: Stats, host: str, port: int, topic: str, stop: asyncio.Event):
+    client = MiniClient(f"loadgen-sub-{os.getpid()}")
+    try:
+        await client.connect(host, port)
+    except (OSError, ConnectionError) as e:
+        print(f"⚠️ latency subscriber failed to connect: {e}; e2e latency will not be measured")
+        return
+
+    def on_message(topic, payload):
+        stats.delivered += 1
+        sent = stats.inflight.get(topic)
+        if not sent:
+            return
+        m = _SEQ.search(payload, 0, 128)
+        if m is None:
+            return
+        seq = int(m.group(1))
+        t0 = sent.pop(seq, None)
+        if t0 is not None:
+            stats.e2e.append(time.perf_counter() - t0)
+        # 同一連線保持順序：序號更小而仍未送達的已被 broker 丟棄（QoS 0）或在 SUBACK 前就送出
+        while sent:
+            oldest = next(iter(sent))
+            if oldest >= seq:
+                break
+            del sent[oldest]
+
+    client.on_message = on_message
+    client.subscribe(topic)
+    stats.tracking = True
+    try:
+        await client.run_reader()
+    finally:
+        stats.tracking = False
+        for sent in stats.inflight.values():
+            sent.clear()
+    if not stop.is_set():
+        print("⚠️ latency subscriber disconnected; e2e latency is no longer measured")
+
+
+async def report(stats: Stats, every: float, stop: asyncio.Event):
+    last_pub, last_del, last_t = 0, 0, time.perf_counter()
+    while not stop.is_set():
+        await asyncio.sleep(every)
+        now = time.perf_counter()
+        dt = now - last_t
+        line = (f"pub {(stats.published - last_pub) / dt:8.1f}/s  recv {(stats.delivered - last_del) / dt:8.1f}/s  "
+                f"e2e {percentiles(stats.e2e)}")
+        if stats.ack:
+            line += f"  puback {percentiles(stats.ack)}"
+        print(line)
+        last_pub, last_del, last_t = stats.published, stats.delivered, now
+        stats.reset_window()
+
+
+async def main_async(args):
+    host, _, port = args.broker.rpartition(":") if ":" in args.broker else (args.broker, "", "")
+    port = int(port) if port else BROKER_PORT
+    stats, stop = Stats(), asyncio.Event()
+    agents = [SimAgent(i, args) for i in range(args.agents)]
+    sample = len(json.dumps(agents[0].payload(), separators=(",", ":")))
+    print(f"🚚 {args.agents} agents x {args.rate}/s -> {host}:{port} (payload ~{sample} B, qos {args.qos})")
+
+    sub = asyncio.create_task(run_subscriber(stats, host, port, "sys/agents/+/metrics", stop)) if not args.no_subscribe else None
+    await asyncio.sleep(0.2)
+    t0 = time.perf_counter()
+    tasks = []
+    for i, a in enumerate(agents):
+        tasks.append(asyncio.create_task(run_agent(a, args, stats, host, port, stop)))
+        if args.ramp and i % 100 == 99:
+            await asyncio.sleep(args.ramp)  # 分批建立連線，避免 SYN 風暴
+    rep = asyncio.create_task(report(stats, args.report_every, stop))
+    try:
+        await asyncio.sleep(args.duration) if args.duration else await asyncio.Event().wait()
+    finally:
+        stop.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        rep.cancel()
+        if sub:
+            await asyncio.sleep(0.5)  # 讓最後幾筆送達
+            sub.cancel()
+    elapsed = time.perf_counter() - t0
+    print(f"📊 published={stats.published} ({stats.published / elapsed:.1f}/s, {stats.bytes / elapsed / 1e6:.2f} MB/s) "
+          f"delivered={stats.delivered} errors={stats.errors} elapsed={elapsed:.1f}s")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--agents", type=int, default=100)
+    ap.add_argument("--rate", type=float, default=1.0, help="messages per second per agent")
+    ap.add_argument("--broker", default=f"{BROKER_HOST}:{BROKER_PORT}", help="host[:port]")
+    ap.add_argument("--duration", type=float, default=30, help="seconds (0 = until Ctrl-C)")
+    ap.add_argument("--qos", type=int, choices=(0, 1), default=0)
+    ap.add_argument("--cores", type=int, default=8)
+    ap.add_argument("--disks", type=int, default=2)
+    ap.add_argument("--nics", type=int, default=2)
+    ap.add_argument("--sensors", type=int, default=4)
+    ap.add_argument("--procs", type=int, default=5, help="entries per top-N process list (0 = no processes block)")
+    ap.add_argument("--prefix", default="sim", help="simulated hostname prefix")
+    ap.add_argument("--ramp", type=float, default=0.05, help="pause after every 100 connections")
+    ap.add_argument("--report-every", type=float, default=5.0)
+    ap.add_argument("--no-subscribe", action="store_true", help="skip the latency subscriber")
+    ap.add_argument("--seed", type=int, default=None)
+    args = ap.parse_args()
+    random.seed(args.seed)
+
+    # 每個 agent 一條連線；先把檔案描述子上限拉到 hard limit
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < args.agents + 64:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, args.agents + 1024), hard))
+    try:
+        asyncio.run(main_async(args))
+    except KeyboardInterrupt:
+        print("🛑 stopped by user")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,456 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Columnar long-term archive for sys/agents/+/metrics
+- Flattens each payload into typed rows in five tables:
+    host : ts, host, cpu, load1, ram, swap, net_rx, net_tx
+    disk : ts, host, dev, read_bps, write_bps, read_iops, write_iops, util
+    nic  : ts, host, dev, rx_bps, tx_bps
+    temp : ts, host, dev (chip/label), current
+    fs   : ts, host, dev (mountpoint), used, percent
+- One .hwcol file per UTC hour; rows are buffered and appended as compressed row groups,
+  so a crash loses at most one flush interval
+- Host and device names are dictionary-encoded per file; timestamps are delta-encoded ms
+- Reader skips files by name and row groups by their time range, and only
+  decompresses the requested columns
+
+Usage:
+    python metrics_archiver.py run ./archive --broker 127.0.0.1:1883
+    python metrics_archiver.py info ./archive
+    python metrics_archiver.py query ./archive disk --start 2026-10-19T08:00 --end 2026-10-19T09:00 \\
+        --columns ts,host,dev,write_bps --hosts web-*
+    python metrics_archiver.py export ./archive out.parquet --table host     # requires pyarrow
+
+Reader API:
+    from metrics_archiver import Archive
+    cols = Archive("./archive").query("host", start, end, columns=["ts", "host", "cpu"])
+"""
+import argparse
+import csv
+import fnmatch
+import glob
+import json
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from array import array
+from datetime import datetime, timezone
+from itertools import accumulate
+from typing import Dict, Iterable, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BROKER_HOST = os.getenv("BROKER_HOST", "127.0.0.1")
+BROKER_PORT = int(os.getenv("BROKER_PORT", "1883"))
+MQTT_USER = os.getenv("MQTT_USER", "mqtter")
+MQTT_PASS = os.getenv("MQTT_PASS", "seven777")
+TOPIC = "sys/agents/+/metrics"
+
+MAGIC = b"HWCOL1\n\0"
+GROUP = struct.Struct("<2sI")   # b"RG", meta JSON 長度；之後接各欄位的壓縮資料
+
+# 欄位型別：T = 時間（ms，差分 int64）、K = 字典編碼（uint32）、f = float32、d = float64
+SCHEMA = {
+    "host": (("ts", "T"), ("host", "K"), ("cpu", "f"), ("load1", "f"), ("ram", "f"), ("swap", "f"),
+             ("net_rx", "f"), ("net_tx", "f")),
+    "disk": (("ts", "T"), ("host", "K"), ("dev", "K"), ("read_bps", "f"), ("write_bps", "f"),
+             ("read_iops", "f"), ("write_iops", "f"), ("util", "f")),
+    "nic": (("ts", "T"), ("host", "K"), ("dev", "K"), ("rx_bps", "f"), ("tx_bps", "f")),
+    "temp": (("ts", "T"), ("host", "K"), ("dev", "K"), ("current", "f")),
+    "fs": (("ts", "T"), ("host", "K"), ("dev", "K"), ("used", "d"), ("percent", "f")),
+}
+STORAGE = {"T": "q", "K": "I", "f": "f", "d": "d"}
+NAN = float("nan")
+
+
+def _num(v) -> float:
+    return NAN if v is None else float(v)
+
+
+def flatten(payload: dict) -> Dict[str, List[tuple]]:
+    """payload -> 各表的列；字典欄位此時仍是字串，由 writer 編碼。"""
+    host = payload.get("host") or ""
+    ts = int(round(float(payload.get("ts") or time.time()) * 1000))
+    cpu = payload.get("cpu") or {}
+    mem = payload.get("memory") or {}
+    net = payload.get("network_io") or {}
+    total = (net.get("total") or {}).get("rate") or {}
+    load = cpu.get("loadavg") or [None]
+    rows = {name: [] for name in SCHEMA}
+    rows["host"].append((ts, host, _num(cpu.get("percent_total")), _num(load[0]),
+                         _num((mem.get("ram") or {}).get("percent")), _num((mem.get("swap") or {}).get("percent")),
+                         _num(total.get("rx_bytes_per_s")), _num(total.get("tx_bytes_per_s"))))
+    for dev, d in (payload.get("disk_io") or {}).items():
+        rate, stats = d.get("rate") or {}, d.get("stats") or {}
+        rows["disk"].append((ts, host, dev, _num(rate.get("read_bytes_per_s")), _num(rate.get("write_bytes_per_s")),
+                             _num(rate.get("read_iops")), _num(rate.get("write_iops")),
+                             _num(stats.get("util_percent"))))
+    for dev, d in (net.get("per_nic") or {}).items():
+        rate = d.get("rate") or {}
+        rows["nic"].append((ts, host, dev, _num(rate.get("rx_bytes_per_s")), _num(rate.get("tx_bytes_per_s"))))
+    for chip, entries in (payload.get("temperatures") or {}).items():
+        for i, e in enumerate(entries or []):
+            rows["temp"].append((ts, host, f"{chip}/{e.get('label') or i}", _num(e.get("current"))))
+    for mount, d in (payload.get("filesystems") or {}).items():
+        rows["fs"].append((ts, host, mount, _num(d.get("used")), _num(d.get("percent"))))
+    return rows
+
+
+def _pack(kind: str, values) -> bytes:
+    if kind == "T":
+        values = [b - a for a, b in zip([0] + values[:-1], values)]
+    arr = array(STORAGE[kind], values)
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return zlib.compress(arr.tobytes(), 6)
+
+
+def _unpack(kind: str, blob: bytes) -> array:
+    arr = array(STORAGE[kind])
+    arr.frombytes(zlib.decompress(blob))
+    if sys.byteorder == "big":
+        arr.byteswap()
+    if kind == "T":
+        arr = array("q", accumulate(arr))
+    return arr
+
+
+def hour_file(root: str, ts_ms: int) -> str:
+    return os.path.join(root, datetime.fromtimestamp(ts_ms / 1000, timezone.utc).strftime("%Y%m%d-%H") + ".hwcol")
+
+
+def scan_groups(f) -> Iterable[tuple]:
+    """逐一讀出 (meta, 資料起點)；遇到不完整的 row group（寫到一半中斷）就停止。"""
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    f.seek(0)
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError(f"{getattr(f, 'name', '?')}: not a .hwcol file")
+    pos = len(MAGIC)
+    while pos + GROUP.size <= size:
+        f.seek(pos)
+        tag, meta_len = GROUP.unpack(f.read(GROUP.size))
+        if tag != b"RG" or pos + GROUP.size + meta_len > size:
+            return
+        meta = json.loads(f.read(meta_len))
+        data = pos + GROUP.size + meta_len
+        end = data + sum(c[2] for c in meta["columns"])
+        if end > size:
+            return
+        yield meta, data, end
+        pos = end
+
+
+class HourWriter:
+    """單一小時檔：啟動時掃描既有 row group 重建字典，截掉寫到一半的尾端。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.dicts: Dict[str, Dict[str, int]] = {"host": {}, "dev": {}}
+        if os.path.exists(path):
+            with open(path, "r+b") as f:
+                end = len(MAGIC)
+                for meta, _, end in scan_groups(f):
+                    for ns, names in meta["dict"].items():
+                        for name in names:
+                            self.dicts[ns].setdefault(name, len(self.dicts[ns]))
+                f.truncate(end)
+        else:
+            with open(path, "wb") as f:
+                f.write(MAGIC)
+
+    def append(self, table: str, rows: List[tuple], src: Optional[dict] = None) -> int:
+        schema = SCHEMA[table]
+        added: Dict[str, List[str]] = {}
+        cols = list(zip(*rows))
+        for i, (name, kind) in enumerate(schema):
+            if kind == "K":
+                ns = "host" if name == "host" else "dev"
+                codes = self.dicts[ns]
+                out = []
+                for v in cols[i]:
+                    code = codes.get(v)
+                    if code is None:
+                        code = codes[v] = len(codes)
+                        added.setdefault(ns, []).append(v)
+                    out.append(code)
+                cols[i] = out
+            else:
+                cols[i] = list(cols[i])
+        blobs = [_pack(kind, cols[i]) for i, (_, kind) in enumerate(schema)]
+        ts = cols[0]
+        meta = {"table": table, "rows": len(rows), "ts": [min(ts), max(ts)], "dict": added,
+                "columns": [[name, kind, len(b)] for (name, kind), b in zip(schema, blobs)]}
+        if src:
+            meta["src"] = src
+        head = json.dumps(meta, separators=(",", ":")).encode()
+        with open(self.path, "ab") as f:
+            f.write(GROUP.pack(b"RG", len(head)) + head + b"".join(blobs))
+        return GROUP.size + len(head) + sum(map(len, blobs))
+
+
+class Archiver:
+    def __init__(self, root: str, flush_every: float, max_rows: int):
+        self.root = root
+        self.flush_every = flush_every
+        self.max_rows = max_rows
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.buffers: Dict[str, Dict[str, list]] = {}     # 檔案 -> 表 -> 列
+        self.src: Dict[str, list] = {}                    # 檔案 -> [訊息數, JSON bytes]
+        self.writers: Dict[str, HourWriter] = {}
+        self.rows = 0
+        self.messages = 0
+        self.bad = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.last_flush = time.monotonic()
+
+    def on_message(self, client, userdata, msg):
+        try:
+            rows = flatten(json.loads(msg.payload))
+        except (ValueError, TypeError, AttributeError):
+            self.bad += 1
+            return
+        path = hour_file(self.root, rows["host"][0][0])
+        with self.lock:
+            buf = self.buffers.setdefault(path, {name: [] for name in SCHEMA})
+            for name, r in rows.items():
+                buf[name].extend(r)
+                self.rows += len(r)
+            src = self.src.setdefault(path, [0, 0])
+            src[0] += 1
+            src[1] += len(msg.payload)
+            self.messages += 1
+            self.bytes_in += len(msg.payload)
+        if self.rows >= self.max_rows:
+            self.flush()
+
+    def flush(self):
+        with self.flush_lock:
+            self._flush()
+
+    def _flush(self):
+        with self.lock:
+            buffers, self.buffers = self.buffers, {}
+            src, self.src = self.src, {}
+            self.rows = 0
+            self.last_flush = time.monotonic()
+        for path, tables in buffers.items():
+            writer = self.writers.get(path)
+            if writer is None:
+                writer = self.writers[path] = HourWriter(path)
+            info = {"messages": src[path][0], "bytes": src[path][1]}
+            for name, rows in tables.items():
+                if rows:
+                    self.bytes_out += writer.append(name, rows, info if name == "host" else None)
+        # 只保留目前與上一小時的 writer（遲到的樣本仍可寫回上一小時）
+        for path in sorted(self.writers)[:-2]:
+            del self.writers[path]
+
+
+class Archive:
+    """讀取端：query() 回傳 {欄位: array 或 list}，字典欄位解碼成字串。"""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def files(self, start: Optional[float] = None, end: Optional[float] = None) -> List[str]:
+        out = []
+        for path in sorted(glob.glob(os.path.join(self.root, "*.hwcol"))):
+            try:
+                hour = datetime.strptime(os.path.basename(path)[:-6], "%Y%m%d-%H").replace(tzinfo=timezone.utc)
+            except ValueError:
+                continue
+            t0 = hour.timestamp()
+            if (end is None or t0 < end) and (start is None or t0 + 3600 > start):
+                out.append(path)
+        return out
+
+    def query(self, table: str, start: Optional[float] = None, end: Optional[float] = None,
+              columns: Optional[List[str]] = None, hosts: Optional[List[str]] = None) -> Dict[str, list]:
+        schema = dict(SCHEMA[table])
+        columns = columns or list(schema)
+        unknown = [c for c in columns if c not in schema]
+        if unknown:
+            raise KeyError(f"{table}: unknown columns {unknown}")
+        lo = -2 ** 63 if start is None else int(start * 1000)
+        hi = 2 ** 63 - 1 if end is None else int(end * 1000)
+        need = set(columns) | {"ts"} | ({"host"} if hosts else set())
+        out: Dict[str, list] = {c: [] for c in columns}
+        for path in self.files(start, end):
+            names = {"host": [], "dev": []}
+            with open(path, "rb") as f:
+                for meta, pos, _ in scan_groups(f):
+                    for ns, added in meta["dict"].items():
+                        names[ns].extend(added)
+                    if meta["table"] != table or meta["ts"][1] < lo or meta["ts"][0] >= hi:
+                        continue
+                    cols = {}
+                    for name, kind, size in meta["columns"]:
+                        if name in need:
+                            f.seek(pos)
+                            cols[name] = _unpack(kind, f.read(size))
+                        pos += size
+                    keep = None
+                    if meta["ts"][0] < lo or meta["ts"][1] >= hi:
+                        keep = [i for i, t in enumerate(cols["ts"]) if lo <= t < hi]
+                    if hosts:
+                        wanted = {i for i, h in enumerate(names["host"])
+                                  if any(fnmatch.fnmatchcase(h, p) for p in hosts)}
+                        host_col = cols["host"]
+                        keep = [i for i in (range(meta["rows"]) if keep is None else keep) if host_col[i] in wanted]
+                    for c in columns:
+                        col = cols[c]
+                        if keep is not None:
+                            col = [col[i] for i in keep]
+                        kind = schema[c]
+                        if kind == "K":
+                            lookup = names["host" if c == "host" else "dev"]
+                            out[c].extend(lookup[v] for v in col)
+                        elif kind == "T":
+                            out[c].extend(v / 1000 for v in col)
+                        else:
+                            out[c].extend(col)
+        return out
+
+
+# ===== CLI =====
+def parse_time(s: Optional[str]) -> Optional[float]:
+    if not s:
+        return None
+    try:
+        return float(s)
+    except ValueError:
+        dt = datetime.fromisoformat(s)
+        return (dt if dt.tzinfo else dt.astimezone()).timestamp()
+
+
+def cmd_run(args):
+    import paho.mqtt.client as mqtt
+
+    os.makedirs(args.root, exist_ok=True)
+    arch = Archiver(args.root, args.flush_every, args.max_rows)
+    host, _, port = args.broker.rpartition(":") if ":" in args.broker else (args.broker, "", "")
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"hwarch-{os.getpid()}")
+    client.username_pw_set(MQTT_USER, MQTT_PASS)
+    client.on_connect = lambda c, u, f, rc, p=None: c.subscribe(args.topic) if rc == 0 else None
+    client.on_message = arch.on_message
+    client.connect_async(host, int(port) if port else BROKER_PORT, 60)
+    client.loop_start()
+    print(f"🗄️  archiving {args.topic} from {args.broker} -> {args.root} (flush every {args.flush_every:g}s)")
+    try:
+        while True:
+            time.sleep(1)
+            if time.monotonic() - arch.last_flush >= args.flush_every:
+                arch.flush()
+                if args.verbose:
+                    ratio = arch.bytes_in / arch.bytes_out if arch.bytes_out else 0
+                    print(f"   msgs={arch.messages} bad={arch.bad} in={arch.bytes_in / 1e6:.2f}MB "
+                          f"out={arch.bytes_out / 1e6:.2f}MB (x{ratio:.1f})")
+    except KeyboardInterrupt:
+        print("🛑 stopped by user")
+    finally:
+        client.loop_stop()
+        arch.flush()
+
+
+def cmd_info(args):
+    total_in = total_out = 0
+    for path in Archive(args.root).files():
+        tables: Dict[str, int] = {}
+        groups = src_bytes = 0
+        hosts = set()
+        with open(path, "rb") as f:
+            for meta, _, _ in scan_groups(f):
+                groups += 1
+                tables[meta["table"]] = tables.get(meta["table"], 0) + meta["rows"]
+                hosts.update(meta["dict"].get("host", []))
+                src_bytes += meta.get("src", {}).get("bytes", 0)
+        size = os.path.getsize(path)
+        total_in += src_bytes
+        total_out += size
+        rows = " ".join(f"{k}={v}" for k, v in sorted(tables.items()))
+        print(f"{os.path.basename(path)}  {size / 1024:8.1f} KiB  groups={groups} hosts={len(hosts)}  {rows}")
+    if total_out:
+        print(f"total {total_out / 1e6:.2f} MB on disk for {total_in / 1e6:.2f} MB of JSON (x{total_in / total_out:.1f})")
+
+
+def cmd_query(args):
+    columns = args.columns.split(",") if args.columns else None
+    hosts = args.hosts.split(",") if args.hosts else None
+    t0 = time.perf_counter()
+    cols = Archive(args.root).query(args.table, parse_time(args.start), parse_time(args.end), columns, hosts)
+    elapsed = time.perf_counter() - t0
+    names = list(cols)
+    n = len(cols[names[0]]) if names else 0
+    w = csv.writer(sys.stdout)
+    w.writerow(names)
+    for i in range(min(n, args.limit) if args.limit else n):
+        w.writerow([cols[c][i] for c in names])
+    print(f"# {n} rows in {elapsed * 1000:.1f} ms", file=sys.stderr)
+
+
+def cmd_export(args):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit("export requires pyarrow (pip install pyarrow)")
+    cols = Archive(args.root).query(args.table, parse_time(args.start), parse_time(args.end))
+    data = {}
+    for name, kind in SCHEMA[args.table]:
+        if kind == "K":
+            data[name] = pa.array(cols[name]).dictionary_encode()
+        elif kind == "T":
+            data[name] = pa.array([int(t * 1000) for t in cols[name]], pa.timestamp("ms", tz="UTC"))
+        else:
+            data[name] = pa.array(cols[name], pa.float32() if kind == "f" else pa.float64())
+    pq.write_table(pa.table(data), args.out, compression="zstd")
+    print(f"📦 {len(cols['ts'])} rows -> {args.out}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("run", help="subscribe and archive")
+    p.add_argument("root")
+    p.add_argument("--broker", default=f"{BROKER_HOST}:{BROKER_PORT}", help="host[:port]")
+    p.add_argument("--topic", default=TOPIC)
+    p.add_argument("--flush-every", type=float, default=60.0, help="seconds between row groups")
+    p.add_argument("--max-rows", type=int, default=200000, help="flush early when this many rows are buffered")
+    p.add_argument("-v", "--verbose", action="store_true")
+    p.set_defaults(func=cmd_run)
+
+    p = sub.add_parser("info", help="summarize archive files")
+    p.add_argument("root")
+    p.set_defaults(func=cmd_info)
+
+    for name, func, help_ in (("query", cmd_query, "print rows as CSV"),
+                              ("export", cmd_export, "write one table to Parquet (pyarrow)")):
+        p = sub.add_parser(name, help=help_)
+        p.add_argument("root")
+        if name == "export":
+            p.add_argument("out")
+            p.add_argument("--table", choices=sorted(SCHEMA), default="host")
+        else:
+            p.add_argument("table", choices=sorted(SCHEMA))
+            p.add_argument("--columns", default="", help="comma-separated subset")
+            p.add_argument("--hosts", default="", help="comma-separated glob patterns")
+            p.add_argument("--limit", type=int, default=0, help="print at most N rows")
+        p.add_argument("--start", default="", help="epoch seconds or ISO time")
+        p.add_argument("--end", default="", help="epoch seconds or ISO time")
+        p.set_defaults(func=func)
+
+    args = ap.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Record and replay MQTT metric streams
+- record : subscribe to sys/agents/+/metrics and append every message to a .hwrec file
+- replay : republish a recording to a broker (e.g. mqtt_standin.py) or feed it straight
+           into a viewer's on_message, at 1x, Nx or as fast as possible; at most --max-queued
+           messages wait unwritten in paho, a slow broker throttles the replay instead
+- info   : print message count, hosts, time span and index size of a recording
+
+File format (little endian, append-only):
+    header  b"HWREC1\\0\\0"
+    record  <d ts><I payload_len><H topic_len> topic payload     (repeated)
+    trailer index entries <d ts><Q offset> ..., then <Q index_offset><Q entry_count> b"HWRECIDX"
+The trailer is written on clean shutdown and stripped again when recording resumes;
+a file without one (e.g. after a crash) is still readable, the index is rebuilt by a scan.
+
+Usage:
+    python mqtt_recorder.py record incident.hwrec --host 127.0.0.1
+    python mqtt_recorder.py replay incident.hwrec --broker 127.0.0.1:1883 --speed 10
+    python mqtt_recorder.py replay incident.hwrec --viewer tui_viewer --speed max --headless
+"""
+import argparse
+import bisect
+import importlib
+import mmap
+import os
+import struct
+import threading
+import time
+from types import SimpleNamespace
+from typing import Iterator, Optional
+
+import paho.mqtt.client as mqtt
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BROKER_HOST = os.getenv("BROKER_HOST", "127.0.0.1")
+BROKER_PORT = int(os.getenv("BROKER_PORT", "1883"))
+MQTT_USER = os.getenv("MQTT_USER", "mqtter")
+MQTT_PASS = os.getenv("MQTT_PASS", "seven777")
+TOPIC = "sys/agents/+/metrics"
+REPLAY_QUEUE_MAX = 1000     # replay 時尚未寫出的訊息上限；滿了就等，不讓記憶體無限成長
+
+MAGIC = b"HWREC1\0\0"
+TRAILER_MAGIC = b"HWRECIDX"
+RECORD = struct.Struct("<dIH")
+INDEX_ENTRY = struct.Struct("<dQ")
+TRAILER = struct.Struct("<QQ8s")
+
+
+class Recorder:
+    """Append-only writer. An index entry (ts, offset) is kept every index_every seconds of traffic."""
+
+    def __init__(self, path: str, index_every: float = 1.0):
+        self.index_every = index_every
+        self.index: list = []
+        self.count = 0
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        self.f = open(path, "r+b" if exists else "wb")
+        if exists:
+            # 續錄：讀回既有索引並去掉 trailer，之後繼續附加
+            rec = Recording(path)
+            self.index, self.count = list(zip(rec.index_ts, rec.index_off)), len(rec)
+            end = rec.data_end
+            rec.close()
+            self.f.truncate(end)
+            self.f.seek(end)
+        else:
+            self.f.write(MAGIC)
+        self._last_indexed = self.index[-1][0] if self.index else float("-inf")
+
+    def write(self, topic: str, payload: bytes, ts: Optional[float] = None):
+        ts = time.time() if ts is None else ts
+        if ts - self._last_indexed >= self.index_every:
+            self.index.append((ts, self.f.tell()))
+            self._last_indexed = ts
+        t = topic.encode()
+        self.f.write(RECORD.pack(ts, len(payload), len(t)))
+        self.f.write(t)
+        self.f.write(payload)
+        self.count += 1
+
+    def close(self):
+        index_offset = self.f.tell()
+        for ts, off in self.index:
+            self.f.write(INDEX_ENTRY.pack(ts, off))
+        self.f.write(TRAILER.pack(index_offset, len(self.index), TRAILER_MAGIC))
+        self.f.close()
+
+
+class Recording:
+    """mmap-backed reader with a sparse time index; records() can start at any timestamp."""
+
+    def __init__(self, path: str, index_every: float = 1.0):
+        self._file = open(path, "rb")
+        self.buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.buf[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path}: not a .hwrec recording")
+        self.index_ts: list = []
+        self.index_off: list = []
+        self._count: Optional[int] = None
+        self.data_end = len(self.buf)
+        if len(self.buf) >= len(MAGIC) + TRAILER.size:
+            index_offset, entries, magic = TRAILER.unpack_from(self.buf, len(self.buf) - TRAILER.size)
+            if magic == TRAILER_MAGIC:
+                self.data_end = index_offset
+                for i in range(entries):
+                    ts, off = INDEX_ENTRY.unpack_from(self.buf, index_offset + i * INDEX_ENTRY.size)
+                    self.index_ts.append(ts)
+                    self.index_off.append(off)
+        if not self.index_ts:
+            self._rebuild_index(index_every)
+
+    def _rebuild_index(self, index_every: float):
+        last, count, end = float("-inf"), 0, len(MAGIC)
+        for off, ts, body, (tlen, plen) in self._scan(len(MAGIC)):
+            if ts - last >= index_every:
+                self.index_ts.append(ts)
+                self.index_off.append(off)
+                last = ts
+            count += 1
+            end = body + tlen + plen
+        self._count = count
+        self.data_end = end  # 續錄時從最後一筆完整紀錄之後接著寫
+
+    def _scan(self, pos: int) -> Iterator[tuple]:
+        buf, end = self.buf, self.data_end
+        while pos + RECORD.size <= end:
+            ts, plen, tlen = RECORD.unpack_from(buf, pos)
+            body = pos + RECORD.size
+            if body + tlen + plen > end:
+                break  # 寫到一半的最後一筆（程序被中斷）
+            yield pos, ts, body, (tlen, plen)
+            pos = body + tlen + plen
+
+    def __len__(self) -> int:
+        if self._count is None:
+            self._count = sum(1 for _ in self._scan(len(MAGIC)))
+        return self._count
+
+    @property
+    def start_ts(self) -> Optional[float]:
+        return self.index_ts[0] if self.index_ts else None
+
+    def records(self, start_ts: Optional[float] = None, end_ts: Optional[float] = None) -> Iterator[tuple]:
+        """Yield (ts, topic, payload) from the first record at or after start_ts."""
+        pos = len(MAGIC)
+        if start_ts is not None and self.index_ts:
+            i = bisect.bisect_right(self.index_ts, start_ts) - 1
+            if i >= 0:
+                pos = self.index_off[i]
+        buf = self.buf
+        for _, ts, body, (tlen, plen) in self._scan(pos):
+            if start_ts is not None and ts < start_ts:
+                continue
+            if end_ts is not None and ts > end_ts:
+                return
+            yield ts, buf[body:body + tlen].decode(), buf[body + tlen:body + tlen + plen]
+
+    def close(self):
+        self.buf.close()
+        self._file.close()
+
+
+def parse_speed(text: str) -> float:
+    """'1' / '10' / '10x' -> 倍速；'max' 或 0 -> 不等待"""
+    text = text.lower()
+    if text == "max":
+        return 0.0
+    return float(text[:-1] if text.endswith("x") else text)
+
+
+def replay(rec: Recording, sink, speed: float, start: float = 0.0, duration: Optional[float] = None) -> dict:
+    """
+    依錄製時的間隔把每筆訊息交給 sink(topic, payload)；speed=0 代表不等待。
+    回傳送出筆數、耗時與最大落後時間（排程時間與實際送出時間的差）。
+    """
+    t0 = rec.start_ts
+    if t0 is None:
+        return {"messages": 0, "elapsed_s": 0.0, "max_lag_ms": 0.0}
+    first = t0 + start
+    last = first + duration if duration is not None else None
+    sent, max_lag = 0, 0.0
+    wall0 = time.perf_counter()
+    for ts, topic, payload in rec.records(first, last):
+        if speed > 0:
+            due = wall0 + (ts - first) / speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                max_lag = max(max_lag, -delay)
+        sink(topic, payload)
+        sent += 1
+    elapsed = time.perf_counter() - wall0
+    return {"messages": sent, "elapsed_s": round(elapsed, 3),
+            "rate_per_s": round(sent / elapsed, 1) if elapsed else None,
+            "max_lag_ms": round(max_lag * 1000, 1)}
+
+
+def split_hostport(text: str) -> tuple:
+    host, _, port = text.rpartition(":") if ":" in text else (text, "", "")
+    return host, int(port) if port else BROKER_PORT
+
+
+def cmd_record(args):
+    rec = Recorder(args.file, index_every=args.index_every)
+    host, port = split_hostport(args.host)
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+    client.username_pw_set(MQTT_USER, MQTT_PASS)
+    lock = threading.Lock()
+
+    def on_connect(c, userdata, flags, reason_code, properties=None):
+        if reason_code == 0:
+            c.subscribe(args.topic)
+            print(f"🔴 recording {args.topic} from {host}:{port} -> {args.file}")
+        else:
+            print(f"⚠️ connect failed: {reason_code}")
+
+    def on_message(c, userdata, msg):
+        with lock:
+            rec.write(msg.topic, msg.payload)
+
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.connect(host, port, 60)
+    client.loop_start()
+    deadline = time.monotonic() + args.duration if args.duration else None
+    try:
+        while deadline is None or time.monotonic() < deadline:
+            time.sleep(1)
+            with lock:
+                rec.f.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.loop_stop()
+        client.disconnect()
+        with lock:
+            rec.close()
+        print(f"💾 {rec.count} messages, {len(rec.index)} index entries")
+
+
+def cmd_info(args):
+    rec = Recording(args.file)
+    hosts, first, last, size = set(), None, None, 0
+    for ts, topic, payload in rec.records():
+        first = ts if first is None else first
+        last = ts
+        size += len(payload)
+        hosts.add(topic.split("/")[2] if topic.count("/") >= 3 else topic)
+    print(f"messages : {len(rec)}")
+    print(f"hosts    : {len(hosts)}")
+    if first is not None:
+        print(f"span     : {last - first:.1f} s ({time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(first))})")
+        print(f"payload  : {size / 1024:.1f} KiB (avg {size / len(rec):.0f} B)")
+    print(f"index    : {len(rec.index_ts)} entries")
+    rec.close()
+
+
+def cmd_replay(args):
+    rec = Recording(args.file)
+    speed = parse_speed(args.speed)
+    if args.viewer:
+        stats = replay_into_viewer(rec, args.viewer, speed, args.start, args.duration, args.headless)
+    else:
+        host, port = split_hostport(args.broker)
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"hwrec-replay-{os.getpid()}")
+        client.username_pw_set(MQTT_USER, MQTT_PASS)
+        # QoS 0 不受 max_queued_messages_set 限制（paho 直接放進無上限的寫出佇列），自己計算尚未寫出的筆數；
+        # on_publish 在 QoS 0 封包寫進 socket 後觸發，斷線時 paho 丟棄佇列，計數歸零
+        cond = threading.Condition()
+        pending = throttled = 0
+
+        def on_publish(c, userdata, mid, reason_code=None, properties=None):
+            nonlocal pending
+            with cond:
+                pending -= 1
+                cond.notify()
+
+        def on_disconnect(c, userdata, flags, reason_code=None, properties=None):
+            nonlocal pending
+            with cond:
+                pending = 0
+                cond.notify()
+
+        client.on_publish = on_publish
+        client.on_disconnect = on_disconnect
+        client.connect(host, port, 60)
+        client.loop_start()
+        print(f"▶️ replaying {len(rec)} messages to {host}:{port} at {args.speed}")
+
+        def sink(topic, payload):
+            nonlocal pending, throttled
+            with cond:
+                if pending >= args.max_queued:
+                    # broker 跟不上：等 paho 寫出一些再送，落後時間會反映在 max_lag_ms
+                    throttled += 1
+                    cond.wait_for(lambda: pending < args.max_queued)
+                pending += 1    # 先計入：已連線時 publish() 可能直接寫出並在同一執行緒觸發 on_publish（RLock 可重入）
+                if client.publish(topic, payload, qos=0).rc != mqtt.MQTT_ERR_SUCCESS:
+                    pending -= 1
+
+        stats = replay(rec, sink, speed, args.start, args.duration)
+        stats["throttled"] = throttled
+        with cond:
+            cond.wait_for(lambda: pending == 0, timeout=10)  # 等 paho 把最後幾筆寫出去再停
+        client.loop_stop()
+        client.disconnect()
+    rec.close()
+    print("📊 " + ", ".join(f"{k}={v}" for k, v in stats.items()))
+
+
+def replay_into_viewer(rec: Recording, module: str, speed: float, start: float,
+                       duration: Optional[float], headless: bool) -> dict:
+    """
+    直接呼叫 viewer 的 on_message（不經過 broker）。訊息從背景執行緒送入，
+    與 paho 的網路執行緒相同，viewer 內的 call_from_thread 照常運作。
+    """
+    viewer = importlib.import_module(module)
+    app = viewer.MonitorApp()
+    app.setup_mqtt = lambda: None
+    stats: dict = {}
+
+    def feed():
+        while not app.is_running:
+            time.sleep(0.01)
+        stats.update(replay(rec, lambda topic, payload: app.on_message(
+            None, None, SimpleNamespace(topic=topic, payload=payload)), speed, start, duration))
+        if headless:
+            app.call_from_thread(app.exit)
+
+    threading.Thread(target=feed, daemon=True).start()
+    app.run(headless=headless)
+    return stats
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("record", help="subscribe and append messages to a recording")
+    p.add_argument("file")
+    p.add_argument("--host", default=f"{BROKER_HOST}:{BROKER_PORT}", help="broker host[:port]")
+    p.add_argument("--topic", default=TOPIC)
+    p.add_argument("--duration", type=float, default=0, help="stop after N seconds (0 = until Ctrl-C)")
+    p.add_argument("--index-every", type=float, default=1.0, help="seconds of traffic between index entries")
+    p.set_defaults(func=cmd_record)
+
+    p = sub.add_parser("replay", help="republish a recording or feed it into a viewer")
+    p.add_argument("file")
+    p.add_argument("--broker", default=f"{BROKER_HOST}:{BROKER_PORT}", help="target broker host[:port]")
+    p.add_argument("--viewer", help="feed a viewer module directly, e.g. tui_viewer or tui_viewer_classical")
+    p.add_argument("--headless", action="store_true", help="run the viewer headless and exit when done")
+    p.add_argument("--speed", default="1", help="1, 10, 10x ... or max")
+    p.add_argument("--max-queued", type=int, default=REPLAY_QUEUE_MAX,
+                   help="broker replay: unwritten messages paho may hold before the replay waits")
+    p.add_argument("--start", type=float, default=0.0, help="seconds into the recording to start from")
+    p.add_argument("--duration", type=float, default=None, help="seconds of recording to replay")
+    p.set_defaults(func=cmd_replay)
+
+    p = sub.add_parser("info", help="summarize a recording")
+    p.add_argument("file")
+    p.set_defaults(func=cmd_info)
+
+    args = ap.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
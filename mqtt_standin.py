@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Minimal MQTT broker stand-in for local testing
+- asyncio, single process, MQTT 3.1.1 and 5
+- CONNECT / SUBSCRIBE / UNSUBSCRIBE / PUBLISH (QoS 0/1/2 in, QoS 0 out) / PING / DISCONNECT
+- Resolves inbound v5 topic aliases; delivers the last will on abnormal disconnect
+- A CONNECT with a client id already in use takes over: the older connection is closed
+- Shared subscriptions ($share/<group>/<filter>), round-robin within a group
+- No auth, no sessions, no retained messages
+- Meant for exercising the agent, viewers and tools without a real broker
+
+Usage:
+    python mqtt_standin.py --port 1883
+"""
+import argparse
+import asyncio
+import struct
+import time
+
+MQTTv5 = 5
+
+# v5 property id -> 編碼型別（只列出本專案會用到的；遇到未知 id 就不轉送 properties）
+_PROP_TYPES = {
+    0x01: "byte", 0x02: "int4", 0x03: "str", 0x08: "str", 0x09: "bin",
+    0x0B: "varint", 0x23: "int2", 0x26: "pair",
+}
+TOPIC_ALIAS = 0x23
+
+
+def encode_varint(n: int) -> bytes:
+    out = bytearray()
+    while True:
+        b, n = n % 128, n // 128
+        out.append(b | (0x80 if n else 0))
+        if not n:
+            return bytes(out)
+
+
+def decode_varint(buf: bytes, pos: int) -> tuple:
+    mult, value = 1, 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        value += (b & 0x7F) * mult
+        if not b & 0x80:
+            return value, pos
+        mult *= 128
+
+
+def split_props(raw: bytes) -> tuple:
+    """回傳 (topic_alias, 去掉 alias 後的 raw properties；無法解析時為 b"")。"""
+    alias, keep, pos = None, bytearray(), 0
+    while pos < len(raw):
+        start, pid = pos, raw[pos]
+        pos += 1
+        kind = _PROP_TYPES.get(pid)
+        if kind is None:
+            return alias, b""
+        if kind == "byte":
+            pos += 1
+        elif kind == "int2":
+            if pid == TOPIC_ALIAS:
+                alias = struct.unpack_from("!H", raw, pos)[0]
+            pos += 2
+        elif kind == "int4":
+            pos += 4
+        elif kind == "varint":
+            _, pos = decode_varint(raw, pos)
+        elif kind in ("str", "bin"):
+            pos += 2 + struct.unpack_from("!H", raw, pos)[0]
+        elif kind == "pair":
+            for _ in range(2):
+                pos += 2 + struct.unpack_from("!H", raw, pos)[0]
+        if pid != TOPIC_ALIAS:
+            keep += raw[start:pos]
+    return alias, bytes(keep)
+
+
+def topic_matches(filt: str, topic: str) -> bool:
+    f_parts, t_parts = filt.split("/"), topic.split("/")
+    for i, f in enumerate(f_parts):
+        if f == "#":
+            return True
+        if i >= len(t_parts) or (f != "+" and f != t_parts[i]):
+            return False
+    return len(f_parts) == len(t_parts)
+
+
+class Session:
+    def __init__(self, broker: "Broker", writer: asyncio.StreamWriter):
+        self.broker = broker
+        self.writer = writer
+        self.version = 4
+        self.client_id = ""
+        self.filters: set = set()      # 含萬用字元或 $share 的訂閱
+        self.exact: set = set()        # 完整 topic：route 時直接查表，不逐一比對
+        self.aliases: dict = {}
+        self.will = None  # (topic, payload)；收到 DISCONNECT 時清除
+
+    def send(self, packet_type: int, body: bytes, flags: int = 0):
+        self.writer.write(bytes([(packet_type << 4) | flags]) + encode_varint(len(body)) + body)
+
+    def deliver(self, topic: bytes, payload: bytes, props: bytes):
+        body = struct.pack("!H", len(topic)) + topic
+        if self.version == MQTTv5:
+            body += encode_varint(len(props)) + props
+        self.send(3, body + payload)
+
+
+class Broker:
+    def __init__(self, verbose: bool = False, topic_alias_max: int = 16):
+        self.sessions: set = set()
+        self.verbose = verbose
+        self.topic_alias_max = topic_alias_max
+        self.messages_in = 0
+        self.messages_out = 0
+        self.share_turns: dict = {}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        sess = Session(self, writer)
+        try:
+            while True:
+                head = await reader.readexactly(1)
+                mult, length = 1, 0
+                while True:
+                    b = (await reader.readexactly(1))[0]
+                    length += (b & 0x7F) * mult
+                    mult *= 128
+                    if not b & 0x80:
+                        break
+                body = await reader.readexactly(length)
+                if not self.dispatch(sess, head[0] >> 4, head[0] & 0x0F, body):
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.sessions.discard(sess)
+            if sess.will:
+                self.route(*sess.will, b"")
+            writer.close()
+
+    def dispatch(self, sess: Session, ptype: int, flags: int, body: bytes) -> bool:
+        if ptype == 1:  # CONNECT
+            name_len = struct.unpack_from("!H", body, 0)[0]
+            sess.version = body[2 + name_len]
+            connect_flags = body[3 + name_len]
+            pos = 2 + name_len + 4
+            if sess.version == MQTTv5:
+                plen, pos = decode_varint(body, pos)
+                pos += plen
+            cid_len = struct.unpack_from("!H", body, pos)[0]
+            sess.client_id = body[pos + 2:pos + 2 + cid_len].decode(errors="replace")
+            pos += 2 + cid_len
+            if sess.client_id:
+                # 與正式 broker 相同：同一 client id 的舊連線被接管（非正常斷線，會送出 last will）
+                for old in [s for s in self.sessions if s.client_id == sess.client_id]:
+                    self.sessions.discard(old)
+                    old.writer.close()
+                    if self.verbose:
+                        print(f"~ {sess.client_id} taken over")
+            if connect_flags & 0x04:  # will flag
+                if sess.version == MQTTv5:
+                    plen, pos = decode_varint(body, pos)
+                    pos += plen
+                tlen = struct.unpack_from("!H", body, pos)[0]
+                will_topic = body[pos + 2:pos + 2 + tlen]
+                pos += 2 + tlen
+                wlen = struct.unpack_from("!H", body, pos)[0]
+                sess.will = (will_topic, body[pos + 2:pos + 2 + wlen])
+            if sess.version == MQTTv5:
+                props = bytes([0x22]) + struct.pack("!H", self.topic_alias_max)
+                sess.send(2, b"\x00\x00" + encode_varint(len(props)) + props)
+            else:
+                sess.send(2, b"\x00\x00")
+            self.sessions.add(sess)
+            if self.verbose:
+                print(f"+ {sess.client_id} (v{sess.version})")
+        elif ptype == 3:  # PUBLISH
+            qos = (flags >> 1) & 0x03
+            tlen = struct.unpack_from("!H", body, 0)[0]
+            topic, pos = body[2:2 + tlen], 2 + tlen
+            pid = None
+            if qos:
+                pid = body[pos:pos + 2]
+                pos += 2
+            props = b""
+            if sess.version == MQTTv5:
+                plen, pos = decode_varint(body, pos)
+                alias, props = split_props(body[pos:pos + plen])
+                pos += plen
+                if alias:
+                    if topic:
+                        sess.aliases[alias] = topic
+                    else:
+                        topic = sess.aliases.get(alias, b"")
+            if qos == 1:
+                sess.send(4, pid)
+            elif qos == 2:
+                sess.send(5, pid)
+            self.route(topic, body[pos:], props)
+        elif ptype == 6:  # PUBREL
+            sess.send(7, body[:2])
+        elif ptype == 8:  # SUBSCRIBE
+            pid, pos = body[:2], 2
+            if sess.version == MQTTv5:
+                plen, pos = decode_varint(body, pos)
+                pos += plen
+            granted = bytearray()
+            while pos < len(body):
+                flen = struct.unpack_from("!H", body, pos)[0]
+                filt = body[pos + 2:pos + 2 + flen].decode()
+                if "+" in filt or "#" in filt or filt.startswith("$share/"):
+                    sess.filters.add(filt)
+                else:
+                    sess.exact.add(filt)
+                pos += 2 + flen + 1
+                granted.append(0)
+            sess.send(9, pid + (b"\x00" if sess.version == MQTTv5 else b"") + bytes(granted))
+        elif ptype == 10:  # UNSUBSCRIBE
+            pid, pos = body[:2], 2
+            if sess.version == MQTTv5:
+                plen, pos = decode_varint(body, pos)
+                pos += plen
+            codes = bytearray()
+            while pos < len(body):
+                flen = struct.unpack_from("!H", body, pos)[0]
+                filt = body[pos + 2:pos + 2 + flen].decode()
+                sess.filters.discard(filt)
+                sess.exact.discard(filt)
+                pos += 2 + flen
+                codes.append(0)
+            sess.send(11, pid + (b"\x00" + bytes(codes) if sess.version == MQTTv5 else b""))
+        elif ptype == 12:  # PINGREQ
+            sess.send(13, b"")
+        elif ptype == 14:  # DISCONNECT
+            sess.will = None
+            return False
+        return True
+
+    def route(self, topic: bytes, payload: bytes, props: bytes):
+        self.messages_in += 1
+        name = topic.decode(errors="replace")
+        groups = {}
+        for sess in self.sessions:
+            plain = name in sess.exact
+            for f in sess.filters:
+                if f.startswith("$share/"):
+                    _, group, filt = f.split("/", 2)
+                    if topic_matches(filt, name):
+                        groups.setdefault(f, []).append(sess)
+                elif not plain and topic_matches(f, name):
+                    plain = True
+            if plain:
+                sess.deliver(topic, payload, props)
+                self.messages_out += 1
+        # 共享訂閱：每個群組只交給一個成員（輪流）
+        for f, members in groups.items():
+            turn = self.share_turns.get(f, 0)
+            self.share_turns[f] = turn + 1
+            members[turn % len(members)].deliver(topic, payload, props)
+            self.messages_out += 1
+
+
+async def serve(host: str, port: int, verbose: bool = False, topic_alias_max: int = 16):
+    broker = Broker(verbose=verbose, topic_alias_max=topic_alias_max)
+    server = await asyncio.start_server(broker.handle, host, port)
+    print(f"🧪 MQTT stand-in listening on {host}:{port}")
+    last_in, last_t = 0, time.monotonic()
+    async with server:
+        while True:
+            await asyncio.sleep(5)
+            now = time.monotonic()
+            if verbose:
+                rate = (broker.messages_in - last_in) / (now - last_t)
+                print(f"   clients={len(broker.sessions)} in={broker.messages_in} out={broker.messages_out} ({rate:.1f} msg/s)")
+            last_in, last_t = broker.messages_in, now
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=1883)
+    ap.add_argument("--topic-alias-max", type=int, default=16, help="TopicAliasMaximum announced to v5 clients")
+    ap.add_argument("-v", "--verbose", action="store_true")
+    args = ap.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.verbose, args.topic_alias_max))
+    except KeyboardInterrupt:
+        print("🛑 stopped by user")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Per-host delivery health for the metric stream (used by the viewers and fleet_aggregator.py)
+- The agent stamps every sample with `seq` (per process) and `ts_ms` (sample time, ms)
+- lag     : receive time - ts_ms, kept as a fixed-bucket histogram per host and fleet-wide
+- gaps    : seq jumped forward; `missed` counts the samples that never arrived
+- stalls  : seq is contiguous but samples are far apart -> the agent itself stalled
+- restarts: agent.started_at changed or seq went backwards (not counted as loss)
+- dups    : same seq seen twice (QoS 1 redelivery, fan-out to two brokers)
+Lag assumes agent and receiver clocks are NTP-synced; negative lag lands in the first bucket.
+Payloads from agents without seq / ts_ms are ignored.
+"""
+import threading
+import time
+from array import array
+from typing import Dict, Optional
+
+LAG_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)   # 最後一格為 > 10 s
+STALL_MS = 3000      # 連續 seq 的樣本間隔超過此值視為 agent 停頓（agent 每秒送一次）
+GAP_RECENT_S = 60    # gap 發生後多久內仍標示在畫面上
+
+
+def bucket_of(lag_ms: float) -> int:
+    for i, edge in enumerate(LAG_BUCKETS_MS):
+        if lag_ms <= edge:
+            return i
+    return len(LAG_BUCKETS_MS)
+
+
+def percentile(hist, q: float) -> Optional[float]:
+    """以直方圖估計百分位：回傳所在桶的上緣；落在最後一格（> 10 s）時回傳 10001。"""
+    total = sum(hist)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for i, n in enumerate(hist):
+        seen += n
+        if seen >= rank and n:
+            break
+    return float(LAG_BUCKETS_MS[i]) if i < len(LAG_BUCKETS_MS) else LAG_BUCKETS_MS[-1] + 1.0
+
+
+def format_ms(ms: Optional[float]) -> str:
+    if ms is None:
+        return "-"
+    if ms > LAG_BUCKETS_MS[-1]:
+        return f">{LAG_BUCKETS_MS[-1] // 1000}s"
+    return f"{ms / 1000:g}s" if ms >= 1000 else f"{ms:g}ms"
+
+
+class HostHealth:
+    __slots__ = ("seq", "ts_ms", "started", "received", "gaps", "missed", "dups", "restarts", "stalls",
+                 "last_lag_ms", "last_gap_at", "hist")
+
+    def __init__(self):
+        self.seq = 0
+        self.ts_ms = 0
+        self.started = None
+        self.received = 0
+        self.gaps = 0
+        self.missed = 0
+        self.dups = 0
+        self.restarts = 0
+        self.stalls = 0
+        self.last_lag_ms = 0.0
+        self.last_gap_at = 0.0
+        self.hist = array("I", bytes(4 * (len(LAG_BUCKETS_MS) + 1)))
+
+    def recent_gap(self, now: float) -> bool:
+        return now - self.last_gap_at < GAP_RECENT_S
+
+    def summary(self) -> dict:
+        total = self.received + self.missed
+        return {
+            "received": self.received,
+            "gaps": self.gaps,
+            "missed": self.missed,
+            "loss_pct": round(self.missed * 100.0 / total, 3) if total else 0.0,
+            "dups": self.dups,
+            "restarts": self.restarts,
+            "stalls": self.stalls,
+            "last_lag_ms": round(self.last_lag_ms, 1),
+            "lag_p50_ms": percentile(self.hist, 0.5),
+            "lag_p99_ms": percentile(self.hist, 0.99),
+        }
+
+
+class StreamHealth:
+    """observe() 由 MQTT 執行緒呼叫，summary() 由 UI 執行緒呼叫，以 lock 保護。"""
+
+    def __init__(self, track_seq: bool = True, stall_ms: float = STALL_MS):
+        self.track_seq = track_seq      # 共享訂閱時每個訂閱者只看到部分 seq，必須關閉
+        self.stall_ms = stall_ms
+        self.hosts: Dict[str, HostHealth] = {}
+        self.hist = array("I", bytes(4 * (len(LAG_BUCKETS_MS) + 1)))
+        self.lock = threading.Lock()
+
+    def observe(self, host: str, payload: dict, now_ms: Optional[float] = None) -> Optional[HostHealth]:
+        seq, ts_ms = payload.get("seq"), payload.get("ts_ms")
+        if seq is None or ts_ms is None:
+            return None
+        if now_ms is None:
+            now_ms = time.time() * 1000.0
+        started = (payload.get("agent") or {}).get("started_at")
+        lag = now_ms - ts_ms
+        b = bucket_of(lag)
+        with self.lock:
+            h = self.hosts.get(host)
+            if h is None:
+                h = self.hosts[host] = HostHealth()
+            elif self.track_seq:
+                step = seq - h.seq
+                if started != h.started or step < 0:
+                    h.restarts += 1
+                elif step == 0:
+                    h.dups += 1
+                    return h            # 重複的樣本不計入 lag
+                elif step > 1:
+                    h.gaps += 1
+                    h.missed += step - 1
+                    h.last_gap_at = now_ms / 1000.0
+                elif ts_ms - h.ts_ms > self.stall_ms:
+                    h.stalls += 1
+            h.seq, h.ts_ms, h.started = seq, ts_ms, started
+            h.received += 1
+            h.last_lag_ms = lag
+            h.hist[b] += 1
+            self.hist[b] += 1
+        return h
+
+    def summary(self, worst: int = 3) -> dict:
+        with self.lock:
+            hosts = list(self.hosts.items())
+            hist = array("I", self.hist)
+        received = sum(h.received for _, h in hosts)
+        missed = sum(h.missed for _, h in hosts)
+        lossy = sorted(((h.missed, name) for name, h in hosts if h.missed), reverse=True)[:worst]
+        return {
+            "hosts": len(hosts),
+            "received": received,
+            "gaps": sum(h.gaps for _, h in hosts),
+            "missed": missed,
+            "loss_pct": round(missed * 100.0 / (received + missed), 3) if received + missed else 0.0,
+            "stalls": sum(h.stalls for _, h in hosts),
+            "restarts": sum(h.restarts for _, h in hosts),
+            "dups": sum(h.dups for _, h in hosts),
+            "lag_p50_ms": percentile(hist, 0.5),
+            "lag_p99_ms": percentile(hist, 0.99),
+            "lag_hist": dict(zip([f"le_{e}" for e in LAG_BUCKETS_MS] + ["inf"], hist)),
+            "lossiest": [{"host": name, "missed": n} for n, name in lossy],
+        }
@@ -0,0 +1,160 @@
+"""
+Smoke tests: the agent's asyncio MQTT I/O path (MQTT_IO=asyncio) against mqtt_standin.py
+- the stand-in and the agent run as subprocesses on free local ports
+- a paho subscriber checks consecutive samples, the OpenMetrics endpoint and the last will
+- failover with two brokers keeps both links connected (the stand-in enforces client-id takeover)
+"""
+import json
+import os
+import queue
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+import pytest
+from paho.mqtt import client as mqtt
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until(check, timeout: float, what: str):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = check()
+        if result:
+            return result
+        time.sleep(0.1)
+    pytest.fail(f"timed out waiting for {what}")
+
+
+def port_open(port: int) -> bool:
+    try:
+        socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+        return True
+    except OSError:
+        return False
+
+
+def run_standin():
+    port = free_port()
+    proc = subprocess.Popen([sys.executable, str(ROOT / "mqtt_standin.py"), "--port", str(port)],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until(lambda: port_open(port), 10, "the stand-in to listen")
+        yield port
+    finally:
+        proc.terminate()
+        proc.wait(5)
+
+
+standin = pytest.fixture(run_standin)
+standin_backup = pytest.fixture(run_standin)
+
+
+@pytest.fixture
+def subscriber(standin):
+    inbox = queue.Queue()
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id="pytest-sub")
+    client.on_message = lambda c, u, msg: inbox.put((msg.topic, json.loads(msg.payload)))
+    client.connect("127.0.0.1", standin)
+    client.subscribe([("sys/agents/+/metrics", 0), ("sys/agents/+/alerts", 0)])
+    client.loop_start()
+    try:
+        yield inbox
+    finally:
+        client.loop_stop()
+        client.disconnect()
+
+
+def start_agent(broker_port: int, metrics_port: int, **extra) -> subprocess.Popen:
+    env = dict(os.environ, BROKER_HOST="127.0.0.1", BROKER_PORT=str(broker_port), MQTT_IO="asyncio",
+               METRICS_PORT=str(metrics_port), PROC_INTERVAL="1", PYTHONUNBUFFERED="1", **extra)
+    return subprocess.Popen([sys.executable, str(ROOT / "agent_sender_async.py")], cwd=ROOT, env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+
+
+def next_message(inbox: queue.Queue, suffix: str, agent: subprocess.Popen = None, timeout: float = 10) -> dict:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if agent is not None and agent.poll() is not None:
+            pytest.fail(f"agent exited with {agent.returncode}:\n{agent.stderr.read()}")
+        try:
+            topic, payload = inbox.get(timeout=0.2)
+        except queue.Empty:
+            continue
+        if topic.endswith(suffix):
+            return payload
+    pytest.fail(f"no message on */{suffix} within {timeout} s")
+
+
+def scrape(port: int) -> str:
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=1) as resp:
+            return resp.read().decode()
+    except OSError:
+        return ""
+
+
+def test_asyncio_io_publishes_samples_and_openmetrics(standin, subscriber):
+    metrics_port = free_port()
+    agent = start_agent(standin, metrics_port)
+    try:
+        first = next_message(subscriber, "/metrics", agent, timeout=20)
+        assert {"ts", "ts_ms", "seq", "cpu", "memory"} <= first.keys()
+        # 進程 collector 產生資料後 OpenMetrics 也要能渲染（含 name label）
+        wait_until(lambda: "hwmon_process_cpu_percent" in scrape(metrics_port), 15, "process families in /metrics")
+        samples = [next_message(subscriber, "/metrics", agent) for _ in range(3)]
+        seqs = [p["seq"] for p in samples]
+        assert seqs == list(range(seqs[0], seqs[0] + 3))
+        assert samples[-1]["mqtt_stats"]["is_connected"]    # 第一筆在 CONNACK 前就已排隊，之後必為已連線
+
+        agent.send_signal(signal.SIGINT)
+        _, err = agent.communicate(timeout=10)
+        assert "Traceback" not in err
+    finally:
+        if agent.poll() is None:
+            agent.kill()
+            agent.communicate()
+
+
+def test_broker_delivers_last_will_when_agent_dies(standin, subscriber):
+    agent = start_agent(standin, 0)
+    try:
+        next_message(subscriber, "/metrics", agent, timeout=20)
+        agent.kill()
+        agent.wait(5)
+        alert = next_message(subscriber, "/alerts")
+        assert (alert["rule"], alert["state"]) == ("agent_offline", "firing")
+    finally:
+        if agent.poll() is None:
+            agent.kill()
+        agent.communicate()
+
+
+@pytest.mark.parametrize("same_broker", [False, True], ids=["two-brokers", "one-cluster"])
+def test_failover_links_stay_connected(standin, standin_backup, subscriber, same_broker):
+    # one-cluster：兩條連線指向同一個 broker，等同叢集節點共用 session，client id 相同就會互相接管
+    backup = standin if same_broker else standin_backup
+    agent = start_agent(standin, 0, MQTT_BROKERS=f"127.0.0.1:{standin},127.0.0.1:{backup}",
+                        MQTT_BROKER_MODE="failover")
+    try:
+        next_message(subscriber, "/metrics", agent, timeout=20)
+        samples = [next_message(subscriber, "/metrics", agent) for _ in range(4)]
+        links = samples[-1]["mqtt_stats"]["brokers"]
+        assert len(links) == 2
+        assert all(link["is_connected"] for link in links)
+        assert [link["reconnects"] for link in links] == [0, 0]
+        assert all(s["mqtt_stats"]["brokers"][0]["active"] for s in samples)
+    finally:
+        agent.kill()
+        agent.communicate()
@@ -19,6 +19,7 @@ import paho.mqtt.client as mqtt
 from dotenv import load_dotenv
 import psutil
 import socket
+from stream_health import StreamHealth, format_ms
 
 load_dotenv()
 
@@ -107,7 +108,21 @@ class HostInfoFooter(Static):
             temp_color = "dim"
 
         content = f"[bold]{self.hostname}[/bold] CPU [{cpu_color}]{cpu:4.1f}%[/{cpu_color}] [{temp_color}]{temp}[/{temp_color}]"
-        self.update(content)
+        self.update(self.link_health() + content)
+
+    def link_health(self) -> str:
+        """Fleet-wide ingestion lag (p99) and lost samples, from seq / ts_ms."""
+        health = self.app.health.summary()
+        if not health["hosts"]:
+            return ""
+        p99 = health["lag_p99_ms"] or 0
+        if health["loss_pct"] >= 1 or p99 > 2500:
+            color = "red"
+        elif health["missed"] or p99 > 500:
+            color = "yellow"
+        else:
+            color = "green"
+        return f"[{color}]⏱{format_ms(p99)} ↯{health['missed']}[/{color}] "
 
 class DeviceDisplay(Static):
     """Ultra-compact device widget for portrait displays."""
@@ -169,8 +184,10 @@ class DeviceDisplay(Static):
 
         # Disk IO
         disk_io = data.get("disk_io", {})
-        total_read = sum(d.get("rate", {}).get("read_bytes_per_s", 0) for d in disk_io.values())
-        total_write = sum(d.get("rate", {}).get("write_bytes_per_s", 0) for d in disk_io.values())
+        # Logical volumes (LVM/LUKS/md) carry "parents"; their I/O is already counted on the physical disks
+        physical = [d for d in disk_io.values() if "parents" not in d]
+        total_read = sum(d.get("rate", {}).get("read_bytes_per_s", 0) for d in physical)
+        total_write = sum(d.get("rate", {}).get("write_bytes_per_s", 0) for d in physical)
 
         # --- Color Coding ---
         cpu_color = self._get_usage_color(cpu_percent)
@@ -219,9 +236,13 @@ class DeviceDisplay(Static):
         except (ValueError, AttributeError):
             return "dim"
 
-    def check_staleness(self, now: float):
+    def check_staleness(self, now: float, health=None):
         if now - self.last_update > 15:
             self.stale_label.update("[bold yellow on black]⚠[/bold yellow on black]")
+        elif health is not None and health.recent_gap(now):
+            self.stale_label.update("[bold red on black]↯[/bold red on black]")
+        elif health is not None and health.last_lag_ms > 2000:
+            self.stale_label.update("[bold yellow on black]⏱[/bold yellow on black]")
         else:
             self.stale_label.update("")
 
@@ -305,6 +326,7 @@ class MonitorApp(App):
         self.device_widgets = {}
         self.display_order = deque()
         self.current_page = 0
+        self.health = StreamHealth()
 
     def compose(self) -> ComposeResult:
         yield Header()
@@ -335,6 +357,7 @@ class MonitorApp(App):
             self.call_from_thread(self.notify, f"Connect failed: {rc}", severity="error")
 
     def on_message(self, client, userdata, msg):
+        recv_ms = time.time() * 1000.0
         try:
             payload = json.loads(msg.payload.decode())
             host = payload.get("host")
@@ -342,6 +365,8 @@ class MonitorApp(App):
             if not host:
                 return
 
+            self.health.observe(host, payload, recv_ms)
+
             self.all_devices_data[host] = payload
 
             if host not in self.device_widgets:
@@ -394,7 +419,7 @@ class MonitorApp(App):
     def check_stale_status(self) -> None:
         now = time.time()
         for widget in self.device_widgets.values():
-            widget.check_staleness(now)
+            widget.check_staleness(now, self.health.hosts.get(widget.host_id))
 
 
 if __name__ == "__main__":
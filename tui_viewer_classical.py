@@ -16,6 +16,7 @@ from textual.widgets import Header, Footer, Static, Label
 from textual.reactive import reactive
 import paho.mqtt.client as mqtt
 from dotenv import load_dotenv
+from stream_health import StreamHealth, format_ms
 
 load_dotenv()
 
@@ -98,8 +99,10 @@ class DeviceDisplay(Static):
         net_down = net_total.get("rx_bytes_per_s", 0)
         
         disk_io = data.get("disk_io", {})
-        total_read = sum(d.get("rate", {}).get("read_bytes_per_s", 0) for d in disk_io.values())
-        total_write = sum(d.get("rate", {}).get("write_bytes_per_s", 0) for d in disk_io.values())
+        # Logical volumes (LVM/LUKS/md) carry "parents"; their I/O is already counted on the physical disks
+        physical = [d for d in disk_io.values() if "parents" not in d]
+        total_read = sum(d.get("rate", {}).get("read_bytes_per_s", 0) for d in physical)
+        total_write = sum(d.get("rate", {}).get("write_bytes_per_s", 0) for d in physical)
         
         max_disk_temp = "N/A"
         hottest_disk = ""
@@ -160,9 +163,13 @@ class DeviceDisplay(Static):
         except (ValueError, AttributeError):
             return "dim"
         
-    def check_staleness(self, now: float):
+    def check_staleness(self, now: float, health=None):
         if now - self.last_update > 15:
             self.stale_label.update("[bold yellow on black] ⚠ STALE [/bold yellow on black]")
+        elif health is not None and health.recent_gap(now):
+            self.stale_label.update(f"[bold red on black] ↯ LOST {health.missed} [/bold red on black]")
+        elif health is not None and health.last_lag_ms > 2000:
+            self.stale_label.update(f"[bold yellow on black] ⏱ {format_ms(health.last_lag_ms)} [/bold yellow on black]")
         else:
             self.stale_label.update("")
 
@@ -225,6 +232,7 @@ class MonitorApp(App):
         self.device_widgets = {}
         self.display_order = deque()
         self.current_page = 0
+        self.health = StreamHealth()
 
     def compose(self) -> ComposeResult:
         yield Header()
@@ -256,6 +264,7 @@ class MonitorApp(App):
 
     def on_message(self, client, userdata, msg):
         """The callback for when a PUBLISH message is received from the server."""
+        recv_ms = time.time() * 1000.0
         try:
             payload = json.loads(msg.payload.decode())
             host = payload.get("host")
@@ -263,6 +272,8 @@ class MonitorApp(App):
             if not host:
                 return
 
+            self.health.observe(host, payload, recv_ms)
+
             self.all_devices_data[host] = payload
 
             if host not in self.device_widgets:
@@ -325,7 +336,17 @@ class MonitorApp(App):
         """Periodically check if devices are stale."""
         now = time.time()
         for widget in self.device_widgets.values():
-            widget.check_staleness(now)
+            widget.check_staleness(now, self.health.hosts.get(widget.host_id))
+        self.update_link_health()
+
+    def update_link_health(self) -> None:
+        """Show fleet-wide ingestion lag and sample loss (from seq / ts_ms) in the header."""
+        health = self.health.summary()
+        if not health["hosts"]:
+            return
+        self.sub_title = (f"lag p50 {format_ms(health['lag_p50_ms'])} p99 {format_ms(health['lag_p99_ms'])}"
+                          f" · lost {health['missed']} ({health['loss_pct']:g}%)"
+                          f" · stalls {health['stalls']}")
 
 
 if __name__ == "__main__":
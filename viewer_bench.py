@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Headless render benchmark for the Textual viewers
+- Runs MonitorApp from tui_viewer.py / tui_viewer_classical.py under Textual's test pilot
+  (no terminal, no broker) and feeds synthetic fleet_loadgen payloads straight into on_message
+  from a background thread, the same way paho's network thread does
+- Each (viewer, host count) pair runs in a fresh process so memory numbers are comparable
+- Measures, after a warm-up:
+    on_message      wall time per message (decode + call_from_thread round trip)
+    update_widget   update_widget_data on the UI thread (reactive update + update_display)
+    update_display  / rotate_devices    page (re)mount cost
+    frame / layout  Textual screen refreshes that actually repainted, and layout passes
+    rss / blocks    growth per minute (RSS and sys.getallocatedblocks())
+    achieved rate   if it falls below the target, the viewer cannot keep up
+- frame / layout timing wraps private Screen internals (Textual has no public per-frame
+  timing hook); verified on 6.3.0 (uv.lock) and 8.2, and the benchmark stops with a clear
+  error if those internals are missing
+- A run that crashes or exceeds warm-up + duration + --timeout is reported as failed
+
+Usage:
+    python viewer_bench.py --hosts 50,200,1000 --rate 1 --duration 20
+    python viewer_bench.py --viewer tui_viewer --hosts 200 --json results.json
+"""
+import argparse
+import gc
+import importlib
+import json
+import multiprocessing as mp
+import queue
+import random
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+VIEWERS = {"tui_viewer": (24, 43), "tui_viewer_classical": (120, 40)}   # 預設終端尺寸（欄 x 列）
+POOL = 4    # 每台主機預先產生的 payload 數，輪流送出
+# frame / layout 量測依賴的 Screen 私有成員（Textual 6.3.0、8.2 驗證過）；缺少時直接報錯
+SCREEN_METHODS = ("_on_timer_update", "_refresh_layout")
+SCREEN_STATE = ("_layout_required", "_dirty_widgets", "_repaint_required")
+
+
+def percentiles(samples: list) -> tuple:
+    if not samples:
+        return (None, None, None)
+    s = sorted(samples)
+    pick = lambda q: s[min(len(s) - 1, int(q * len(s)))]
+    return (pick(0.5), pick(0.99), s[-1])
+
+
+class Timings:
+    """以 wrapper 量測函式耗時（ms）；warm-up 結束時清空。"""
+
+    def __init__(self):
+        self.samples = {}
+        self.enabled = False
+
+    def wrap(self, name: str, fn, when=None):
+        bucket = self.samples.setdefault(name, [])
+
+        def timed(*args, **kwargs):
+            busy = when is None or when(*args)
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                if self.enabled and busy:
+                    bucket.append((time.perf_counter() - t0) * 1000.0)
+        return timed
+
+    def reset(self):
+        for bucket in self.samples.values():
+            bucket.clear()
+        self.enabled = True
+
+
+def check_textual() -> str:
+    """回傳無法量測的原因；空字串表示可以執行。實例屬性要等 screen 建立後才在 run_one 內檢查。"""
+    import textual
+    from textual.screen import Screen
+
+    version = textual.__version__
+    missing = [name for name in SCREEN_METHODS if not callable(getattr(Screen, name, None))]
+    if missing:
+        return f"Textual {version} has no Screen.{', Screen.'.join(missing)}; frame / layout timing cannot hook in"
+    return ""
+
+
+def make_pool(hosts: int, seed: int) -> list:
+    from fleet_loadgen import SimAgent
+
+    random.seed(seed)
+    opts = SimpleNamespace(prefix="bench", cores=8, disks=2, nics=2, sensors=4, procs=5)
+    agents = [SimAgent(i, opts) for i in range(hosts)]
+    return [[(a.topic, json.dumps(a.payload(), separators=(",", ":")).encode()) for _ in range(POOL)]
+            for a in agents]
+
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * 4096
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_one(viewer: str, hosts: int, args, out):
+    import asyncio
+    from textual.screen import Screen
+
+    timings = Timings()
+    # frame = 一次真的有東西要畫的 screen 更新（layout 或 dirty widget）
+    Screen._on_timer_update = timings.wrap(
+        "frame", Screen._on_timer_update,
+        when=lambda self: bool(self._layout_required or self._dirty_widgets or self._repaint_required))
+    Screen._refresh_layout = timings.wrap("layout", Screen._refresh_layout)
+
+    module = importlib.import_module(viewer)
+    pool = make_pool(hosts, args.seed)
+    app = module.MonitorApp()
+    app.setup_mqtt = lambda: None
+    for name in ("update_widget_data", "update_display", "rotate_devices"):
+        setattr(app, name, timings.wrap(name, getattr(app, name)))
+    on_message = timings.wrap("on_message", app.on_message)
+
+    interval = 1.0 / (hosts * args.rate)
+    warm = threading.Event()
+    stop = threading.Event()
+    state = {"sent": 0, "sent_at_warmup": 0, "mem": []}
+
+    def feed():
+        t_start = time.perf_counter()
+        i = base = 0
+        while not stop.is_set():
+            if warm.is_set() and "t_warm" not in state:
+                # 量測期重新起算排程，warm-up 落後的量不在量測期補送
+                state["sent_at_warmup"] = state["sent"]
+                state["t_warm"] = t_start = time.perf_counter()
+                base = i
+            topic, payload = pool[i % hosts][(i // hosts) % POOL]
+            on_message(None, None, SimpleNamespace(topic=topic, payload=payload))
+            state["sent"] += 1
+            i += 1
+            delay = (i - base) * interval - (time.perf_counter() - t_start)
+            if delay > 0:
+                time.sleep(delay)
+        state["t_end"] = time.perf_counter()
+
+    async def main():
+        size = args.size or VIEWERS[viewer]
+        async with app.run_test(headless=True, size=size) as pilot:
+            missing = [name for name in SCREEN_STATE if not hasattr(app.screen, name)]
+            if missing:
+                raise RuntimeError(f"Textual screen has no {', '.join(missing)}; frame timing cannot tell "
+                                   f"repaints from idle ticks")
+            feeder = threading.Thread(target=feed, daemon=True)
+            feeder.start()
+            # warm-up 至少 args.warmup 秒，且等所有主機都建立 widget，避免把首次建立算成成長
+            await asyncio.sleep(args.warmup)
+            while len(app.device_widgets) < hosts:
+                await asyncio.sleep(0.2)
+            gc.collect()
+            timings.reset()
+            warm.set()
+            t0 = time.perf_counter()
+            while time.perf_counter() - t0 < args.duration:
+                state["mem"].append((time.perf_counter() - t0, rss_bytes(), sys.getallocatedblocks()))
+                await asyncio.sleep(min(1.0, max(0.0, args.duration - (time.perf_counter() - t0))))
+            stop.set()
+            while feeder.is_alive():    # feeder 可能正卡在 call_from_thread，不可阻塞 event loop
+                await asyncio.sleep(0.05)
+            state["mem"].append((time.perf_counter() - t0, rss_bytes(), sys.getallocatedblocks()))
+            await pilot.pause()
+
+    asyncio.run(main())
+    mem = state["mem"]
+    span_min = max(1e-9, (mem[-1][0] - mem[0][0]) / 60.0)
+    elapsed = state["t_end"] - state.get("t_warm", state["t_end"])
+    result = {
+        "viewer": viewer,
+        "hosts": hosts,
+        "target_per_s": hosts * args.rate,
+        "achieved_per_s": round((state["sent"] - state["sent_at_warmup"]) / elapsed, 1) if elapsed > 0 else 0.0,
+        "rss_mb": round(mem[-1][1] / 2 ** 20, 1),
+        "rss_growth_mb_per_min": round((mem[-1][1] - mem[0][1]) / 2 ** 20 / span_min, 2),
+        "blocks_growth_per_min": int((mem[-1][2] - mem[0][2]) / span_min),
+        "widgets": len(app.device_widgets),
+    }
+    for name, samples in timings.samples.items():
+        p50, p99, mx = percentiles(samples)
+        result[name] = {"count": len(samples), "p50_ms": p50, "p99_ms": p99, "max_ms": mx}
+    out.put(result)
+
+
+def fmt(v) -> str:
+    return "-" if v is None else (f"{v:.2f}" if v < 100 else f"{v:.0f}")
+
+
+def run_isolated(viewer: str, hosts: int, args, ctx) -> dict:
+    """在獨立程序中執行 run_one；程序崩潰或逾時時回傳含 error 的結果而不是卡住。"""
+    out = ctx.Queue()
+    proc = ctx.Process(target=run_one, args=(viewer, hosts, args, out))
+    proc.start()
+    # warm-up 另外要等所有主機建立 widget，因此額外給 --timeout 秒
+    deadline = time.monotonic() + args.warmup + args.duration + args.timeout
+    result = None
+    while result is None and time.monotonic() < deadline:
+        try:
+            result = out.get(timeout=0.5)
+        except queue.Empty:
+            if not proc.is_alive():
+                try:
+                    result = out.get(timeout=0.5)     # 結束前剛放進去的結果
+                except queue.Empty:
+                    break
+    if result is None and proc.is_alive():
+        proc.terminate()
+    proc.join(5)
+    if result is not None:
+        return result
+    reason = f"exit code {proc.exitcode}" if proc.exitcode not in (None, -15) else "timed out"
+    print(f"❌ {viewer} with {hosts} hosts failed: {reason}", flush=True)
+    return {"viewer": viewer, "hosts": hosts, "target_per_s": hosts * args.rate, "error": reason}
+
+
+def report(results: list):
+    print(f"{'viewer':<22}{'hosts':>6}{'msg/s':>14}  {'on_message':>12}  {'update_widget':>13}  "
+          f"{'update_disp':>12}  {'rotate':>11}  {'frames':>7} {'frame':>11}  {'rss MB':>7} {'MB/min':>7}")
+    print(f"{'':<22}{'':>6}{'got/target':>14}  {'p50/p99 ms':>12}  {'p50/p99 ms':>13}  "
+          f"{'p50/p99 ms':>12}  {'p50/max ms':>11}  {'':>7} {'p50/p99 ms':>11}")
+    for r in results:
+        if "error" in r:
+            print(f"{r['viewer']:<22}{r['hosts']:>6}  failed: {r['error']}")
+            continue
+        t = lambda k, a="p50_ms", b="p99_ms": f"{fmt(r[k][a])}/{fmt(r[k][b])}" if k in r else "-"
+        keep_up = "" if r["achieved_per_s"] >= 0.95 * r["target_per_s"] else " !"
+        print(f"{r['viewer']:<22}{r['hosts']:>6}{r['achieved_per_s']:>8.0f}/{r['target_per_s']:<5.0f}{keep_up:2}"
+              f"{t('on_message'):>12}  {t('update_widget_data'):>13}  {t('update_display'):>12}  "
+              f"{t('rotate_devices', 'p50_ms', 'max_ms'):>11}  {r['frame']['count']:>7} {t('frame'):>11}  "
+              f"{r['rss_mb']:>7.1f} {r['rss_growth_mb_per_min']:>7.2f}")
+    if any("error" not in r and r["achieved_per_s"] < 0.95 * r["target_per_s"] for r in results):
+        print("! = viewer could not keep up with the target rate")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--viewer", choices=["both", *VIEWERS], default="both")
+    ap.add_argument("--hosts", default="50,200,1000", help="comma-separated host counts")
+    ap.add_argument("--rate", type=float, default=1.0, help="messages per second per host")
+    ap.add_argument("--duration", type=float, default=20.0, help="measured seconds per run")
+    ap.add_argument("--warmup", type=float, default=3.0, help="minimum seconds before measuring; also waits until every host has been seen")
+    ap.add_argument("--size", type=lambda s: tuple(map(int, s.lower().split("x"))), default=None,
+                    help="terminal size COLSxROWS (default: 24x43 portrait, 120x40 classical)")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--json", default="", help="also write the raw results to this file")
+    ap.add_argument("--timeout", type=float, default=120.0,
+                    help="seconds allowed beyond warm-up + duration before a run is treated as hung")
+    args = ap.parse_args()
+
+    problem = check_textual()
+    if problem:
+        sys.exit(f"❌ {problem}")
+
+    viewers = list(VIEWERS) if args.viewer == "both" else [args.viewer]
+    ctx = mp.get_context("spawn")
+    results = []
+    for hosts in (int(h) for h in args.hosts.split(",") if h.strip()):
+        for viewer in viewers:
+            print(f"⏱️  {viewer} with {hosts} hosts @ {args.rate:g}/s ...", flush=True)
+            results.append(run_isolated(viewer, hosts, args, ctx))
+    report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if any("error" in r for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+WebSocket / SSE gateway for the web UI
+- Subscribes to sys/agents/+/metrics once; browsers connect here instead of to the broker
+- Each client gets a snapshot, then field-level diffs (JSON merge patch) at its own rate
+- Clients choose hosts with glob patterns; clients with the same filter and rate share
+  one "view", which diffs and serializes once per tick for all of them
+- Slow clients are not buffered without bound: they are resynced with a fresh snapshot
+- Hosts silent for --host-ttl seconds are dropped and sent to clients as {"<host>": null}
+- null fields in agent payloads are omitted (a merge-patch null means "removed"), so
+  clients should treat a missing field the same as null
+- Also serves monitor.html, so http://<gateway>/ works without a separate web server
+
+Endpoints:
+    GET /ws?rate=1&hosts=web-*,db-01     WebSocket (text frames, JSON)
+    GET /sse?rate=0.2&hosts=web-*        Server-Sent Events
+    GET /stats                           gateway counters as JSON
+    GET /                                monitor.html in gateway mode
+
+WebSocket clients may send {"rate": 0.5, "hosts": ["db-*"]} to switch views.
+
+Usage:
+    python web_gateway.py --listen 0.0.0.0:8090 --broker 127.0.0.1:1883 --host-ttl 120
+"""
+import argparse
+import asyncio
+import base64
+import fnmatch
+import hashlib
+import json
+import os
+import struct
+import time
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import paho.mqtt.client as mqtt
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BROKER_HOST = os.getenv("BROKER_HOST", "127.0.0.1")
+BROKER_PORT = int(os.getenv("BROKER_PORT", "1883"))
+MQTT_USER = os.getenv("MQTT_USER", "mqtter")
+MQTT_PASS = os.getenv("MQTT_PASS", "seven777")
+TOPIC = "sys/agents/+/metrics"
+
+WS_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC11B85"
+MIN_RATE, MAX_RATE = 0.05, 10.0
+SLOW_CLIENT_BYTES = 1 << 20     # 送出緩衝超過此值的 client 暫停送 diff，之後補送 snapshot
+MAX_FRAME = 1 << 16
+HOST_TTL = float(os.getenv("GATEWAY_HOST_TTL", "120"))   # 超過此秒數沒有新 payload 的主機自 fleet 移除
+HERE = os.path.dirname(os.path.abspath(__file__))
+_MISSING = object()
+
+
+def merge_patch(old: dict, new: dict) -> dict:
+    """RFC 7386 JSON merge patch：只含變動的欄位，被移除的欄位為 null。"""
+    patch = {}
+    for k, v in new.items():
+        o = old.get(k, _MISSING)
+        if o == v:
+            continue
+        if isinstance(v, dict) and isinstance(o, dict):
+            patch[k] = merge_patch(o, v)
+        else:
+            patch[k] = v
+    for k in old:
+        if k not in new:
+            patch[k] = None
+    return patch
+
+
+def strip_nulls(value):
+    """移除 dict 中值為 null 的欄位（遞迴）；merge patch 無法表達「值為 null」，null 只保留給「已移除」。"""
+    if isinstance(value, dict):
+        return {k: strip_nulls(v) for k, v in value.items() if v is not None}
+    if isinstance(value, list):
+        return [strip_nulls(v) for v in value]
+    return value
+
+
+def ws_frame(data: bytes, opcode: int = 0x1) -> bytes:
+    n = len(data)
+    if n < 126:
+        head = struct.pack("!BB", 0x80 | opcode, n)
+    elif n < 1 << 16:
+        head = struct.pack("!BBH", 0x80 | opcode, 126, n)
+    else:
+        head = struct.pack("!BBQ", 0x80 | opcode, 127, n)
+    return head + data
+
+
+def sse_frame(data: bytes) -> bytes:
+    return b"data: " + data + b"\n\n"
+
+
+class Fleet:
+    """最新的原始 payload；paho 執行緒直接寫入 dict，解碼延後到有 view 需要時才做、且只做一次。"""
+
+    def __init__(self):
+        self.raw: Dict[str, bytes] = {}
+        self.last: Dict[str, float] = {}
+        self._decoded: Dict[str, Tuple[bytes, dict]] = {}
+        self.messages = 0
+        self.expired = 0
+
+    def on_message(self, client, userdata, msg):
+        parts = msg.topic.split("/")
+        if len(parts) >= 4:
+            self.raw[parts[2]] = msg.payload
+            self.last[parts[2]] = time.monotonic()
+            self.messages += 1
+
+    def expire(self, ttl: float):
+        """移除超過 ttl 秒沒有新 payload 的主機；各 view 在下個 tick 發現主機消失後送出刪除。"""
+        cutoff = time.monotonic() - ttl
+        for host, last in list(self.last.items()):
+            if last >= cutoff:
+                continue
+            # paho 執行緒可能剛好寫入新 payload：此時只會晚一則訊息才重新出現，不會留下半套狀態
+            self.raw.pop(host, None)
+            self.last.pop(host, None)
+            self._decoded.pop(host, None)
+            self.expired += 1
+
+    def get(self, host: str) -> Optional[dict]:
+        raw = self.raw.get(host)
+        cached = self._decoded.get(host)
+        if cached is not None and cached[0] is raw:
+            return cached[1]
+        try:
+            data = strip_nulls(json.loads(raw))
+        except (TypeError, ValueError):
+            return cached[1] if cached else None
+        self._decoded[host] = (raw, data)
+        return data
+
+
+class Client:
+    def __init__(self, writer: asyncio.StreamWriter, kind: str):
+        self.writer = writer
+        self.kind = kind                # "ws" | "sse"
+        self.view: Optional["View"] = None
+        self.need_snapshot = True
+
+    def frame(self, data: bytes) -> bytes:
+        return ws_frame(data) if self.kind == "ws" else sse_frame(data)
+
+    @property
+    def slow(self) -> bool:
+        return self.writer.transport.get_write_buffer_size() > SLOW_CLIENT_BYTES
+
+
+class View:
+    """同一組 (hosts 篩選, 速率) 的所有 client 共用：每個 tick 只算一次 diff、只序列化一次。"""
+
+    def __init__(self, gw: "Gateway", patterns: Tuple[str, ...], interval: float):
+        self.gw = gw
+        self.patterns = patterns
+        self.interval = interval
+        self.clients: set = set()
+        self.state: Dict[str, dict] = {}
+        self.seen: Dict[str, bytes] = {}
+        self._snapshot: Optional[bytes] = None
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    def matches(self, host: str) -> bool:
+        return not self.patterns or any(fnmatch.fnmatchcase(host, p) for p in self.patterns)
+
+    def snapshot(self) -> bytes:
+        if self._snapshot is None:
+            self._snapshot = json.dumps({"type": "snapshot", "ts": time.time(), "hosts": self.state},
+                                        separators=(",", ":")).encode()
+        return self._snapshot
+
+    def tick(self) -> bytes:
+        fleet = self.gw.fleet
+        changed = {}
+        for host in [h for h in self.seen if h not in fleet.raw]:
+            del self.seen[host]
+            if self.state.pop(host, None) is not None:
+                changed[host] = None        # 主機已過期：整個主機的 merge patch 刪除
+        for host, raw in list(fleet.raw.items()):
+            if self.seen.get(host) is raw or not self.matches(host):
+                continue
+            data = fleet.get(host)
+            self.seen[host] = raw
+            if data is None:
+                continue
+            old = self.state.get(host)
+            changed[host] = data if old is None else merge_patch(old, data)
+            self.state[host] = data
+        self._snapshot = None
+        return json.dumps({"type": "diff", "ts": time.time(), "hosts": changed}, separators=(",", ":")).encode()
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            diff = self.tick()
+            frames = {}
+            for c in list(self.clients):
+                if c.slow:
+                    c.need_snapshot = True      # 跳過這輪；之後以 snapshot 重新同步
+                    self.gw.resyncs += 1
+                    continue
+                body = self.snapshot() if c.need_snapshot else diff
+                key = (c.kind, body is diff)
+                if key not in frames:
+                    frames[key] = c.frame(body)
+                c.writer.write(frames[key])
+                c.need_snapshot = False
+                self.gw.bytes_out += len(frames[key])
+
+
+class Gateway:
+    def __init__(self, default_rate: float, host_ttl: float = HOST_TTL):
+        self.fleet = Fleet()
+        self.host_ttl = host_ttl
+        self.views: Dict[Tuple[Tuple[str, ...], float], View] = {}
+        self.default_rate = default_rate
+        self.clients = 0
+        self.bytes_out = 0
+        self.resyncs = 0
+
+    def attach(self, client: Client, hosts, rate):
+        patterns = tuple(sorted({h.strip() for h in hosts if h and h.strip()}))
+        try:
+            rate = float(rate) if rate is not None else self.default_rate
+        except (TypeError, ValueError):
+            rate = self.default_rate
+        rate = min(max(rate, MIN_RATE), MAX_RATE)
+        key = (patterns, round(1.0 / rate, 3))
+        self.detach(client)
+        view = self.views.get(key)
+        if view is None:
+            view = self.views[key] = View(self, patterns, key[1])
+            view.tick()                         # 先建立基準狀態，新 client 馬上拿到完整 snapshot
+        view.clients.add(client)
+        client.view = view
+        client.writer.write(client.frame(view.snapshot()))
+        client.need_snapshot = False
+
+    def detach(self, client: Client):
+        view = client.view
+        if view is None:
+            return
+        view.clients.discard(client)
+        client.view = None
+        if not view.clients:
+            view.task.cancel()
+            self.views.pop((view.patterns, view.interval), None)
+
+    def stats(self) -> dict:
+        return {
+            "hosts": len(self.fleet.raw),
+            "messages_in": self.fleet.messages,
+            "hosts_expired": self.fleet.expired,
+            "clients": self.clients,
+            "views": [{"hosts": list(v.patterns) or ["*"], "rate_hz": round(1.0 / v.interval, 3),
+                       "clients": len(v.clients), "tracked": len(v.state)} for v in self.views.values()],
+            "bytes_out": self.bytes_out,
+            "resyncs": self.resyncs,
+        }
+
+    # ---------- HTTP ----------
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 10)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+            writer.close()
+            return
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, _ = lines[0].split(" ", 2)
+        except ValueError:
+            writer.close()
+            return
+        headers = {k.strip().lower(): v.strip() for k, _, v in (l.partition(":") for l in lines[1:] if l)}
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+        hosts = ",".join(query.get("hosts", [])).split(",")
+        rate = query.get("rate", [None])[0]
+
+        try:
+            if url.path == "/ws" and headers.get("upgrade", "").lower() == "websocket":
+                await self.serve_ws(reader, writer, headers, hosts, rate)
+            elif url.path == "/sse":
+                await self.serve_sse(reader, writer, hosts, rate)
+            elif url.path == "/stats":
+                self.respond(writer, 200, "application/json", json.dumps(self.stats()).encode())
+            elif url.path in ("/", "/index.html", "/monitor.html") and method == "GET":
+                if not url.query:
+                    self.respond(writer, 302, "text/plain", b"", {"Location": "/monitor.html?gateway=auto"})
+                else:
+                    with open(os.path.join(HERE, "monitor.html"), "rb") as f:
+                        self.respond(writer, 200, "text/html; charset=utf-8", f.read())
+            else:
+                self.respond(writer, 404, "text/plain", b"not found\n")
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def respond(writer, status: int, ctype: str, body: bytes, extra: Optional[dict] = None):
+        reason = {200: "OK", 302: "Found", 404: "Not Found"}[status]
+        hdr = {"Content-Type": ctype, "Content-Length": str(len(body)), "Connection": "close",
+               "Access-Control-Allow-Origin": "*", **(extra or {})}
+        writer.write(f"HTTP/1.1 {status} {reason}\r\n".encode()
+                     + "".join(f"{k}: {v}\r\n" for k, v in hdr.items()).encode() + b"\r\n" + body)
+
+    async def serve_sse(self, reader, writer, hosts, rate):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                     b"Access-Control-Allow-Origin: *\r\nConnection: keep-alive\r\n\r\n")
+        client = Client(writer, "sse")
+        self.clients += 1
+        self.attach(client, hosts, rate)
+        try:
+            while await reader.read(1024):      # SSE 為單向；讀到 EOF 代表瀏覽器離開
+                pass
+        finally:
+            self.clients -= 1
+            self.detach(client)
+
+    async def serve_ws(self, reader, writer, headers, hosts, rate):
+        key = headers.get("sec-websocket-key", "").encode()
+        accept = base64.b64encode(hashlib.sha1(key + WS_GUID).digest()).decode()
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode())
+        client = Client(writer, "ws")
+        self.clients += 1
+        self.attach(client, hosts, rate)
+        try:
+            while True:
+                b1, b2 = await reader.readexactly(2)
+                opcode, n = b1 & 0x0F, b2 & 0x7F
+                if n == 126:
+                    n = struct.unpack("!H", await reader.readexactly(2))[0]
+                elif n == 127:
+                    n = struct.unpack("!Q", await reader.readexactly(8))[0]
+                if n > MAX_FRAME:
+                    break
+                mask = await reader.readexactly(4) if b2 & 0x80 else b"\0\0\0\0"
+                data = bytes(b ^ mask[i % 4] for i, b in enumerate(await reader.readexactly(n)))
+                if opcode == 0x8:               # close
+                    writer.write(ws_frame(data[:2], 0x8))
+                    break
+                if opcode == 0x9:               # ping
+                    writer.write(ws_frame(data, 0xA))
+                elif opcode == 0x1:             # 控制訊息：{"rate": .., "hosts": [..]}
+                    try:
+                        req = json.loads(data)
+                        self.attach(client, req.get("hosts") or [], req.get("rate"))
+                    except (ValueError, AttributeError):
+                        pass
+        finally:
+            self.clients -= 1
+            self.detach(client)
+
+
+async def serve(args):
+    gw = Gateway(args.rate, args.host_ttl)
+    broker_host, _, broker_port = args.broker.rpartition(":") if ":" in args.broker else (args.broker, "", "")
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"hwgw-{os.getpid()}")
+    client.username_pw_set(MQTT_USER, MQTT_PASS)
+    client.on_connect = lambda c, u, f, rc, p=None: c.subscribe(args.topic) if rc == 0 else None
+    client.on_message = gw.fleet.on_message
+    client.connect_async(broker_host, int(broker_port) if broker_port else BROKER_PORT, 60)
+    client.loop_start()
+
+    host, _, port = args.listen.rpartition(":")
+    server = await asyncio.start_server(gw.handle, host or "0.0.0.0", int(port))
+    print(f"🌐 gateway on http://{args.listen}  <- {args.broker} ({args.topic})")
+    try:
+        async with server:
+            while True:
+                await asyncio.sleep(args.report_every)
+                if gw.host_ttl > 0:
+                    gw.fleet.expire(gw.host_ttl)
+                if args.verbose:
+                    s = gw.stats()
+                    print(f"   hosts={s['hosts']} in={s['messages_in']} clients={s['clients']} "
+                          f"views={len(s['views'])} out={s['bytes_out'] / 1e6:.2f}MB resyncs={s['resyncs']}")
+    finally:
+        client.loop_stop()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--listen", default="0.0.0.0:8090", help="host:port")
+    ap.add_argument("--broker", default=f"{BROKER_HOST}:{BROKER_PORT}", help="host[:port]")
+    ap.add_argument("--topic", default=TOPIC)
+    ap.add_argument("--rate", type=float, default=1.0, help="default updates per second per client")
+    ap.add_argument("--report-every", type=float, default=5.0)
+    ap.add_argument("--host-ttl", type=float, default=HOST_TTL,
+                    help="drop hosts with no payload for this many seconds (0 = never)")
+    ap.add_argument("-v", "--verbose", action="store_true")
+    args = ap.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        print("🛑 stopped by user")
+
+
+if __name__ == "__main__":
+    main()